@@ -0,0 +1,262 @@
+"""Headless benchmarks of the frame-processing and scan pipelines of the GUI.
+
+Each stage is timed call by call on frames of the simulator, then run again
+under ``tracemalloc`` to count the memory allocated per call.
+``frame_processing`` is the path of a frame from the ring buffer to the fluxes,
+it should allocate (almost) nothing.
+The results are the throughput (calls per second, from the median latency), the latency percentiles
+and the allocations of each stage, for each detector size.
+
+Usage (from the root of the repository)::
+
+    python benchmarks/bench_pipeline.py                       # report only
+    python benchmarks/bench_pipeline.py --save-baseline       # store the throughputs
+    python benchmarks/bench_pipeline.py --check               # fail if slower than the baseline
+
+The baseline depends on the machine, create it on the one running the checks.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from astropy.io import fits
+from scipy.optimize import curve_fit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'glint_pygui'))
+from core import FrameRingBuffer, FitsFrameSource, RawFrameSource, RoiLayout, RollingSeries, \
+    SimulatedIrisAO, FrameSimulator, WavelengthSolution, SpectralExtractor, NullDepthEstimator, fit_fringe, \
+    fit_fringes, fringe_minimum, fringe_minimum_error, interp_tt_map
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SIZES = ['344x96', '688x192', '1376x384']
+NB_SEGMENTS = 37
+NB_AVERAGED = 10
+WAVELENGTH = 1.6
+
+
+def scaled_layout(frame_shape):
+    """Default layout of the outputs stretched to a larger detector.
+    """
+    layout = RoiLayout()
+    row_scale = frame_shape[0] / 344.
+    col_scale = frame_shape[1] / 96.
+    layout.rects = [[int(x * col_scale), int(y * row_scale), int(w * col_scale), int(h * row_scale)]
+                    for x, y, w, h in layout.rects]
+    return layout
+
+
+def time_stage(function, nb_calls, nb_warmup=5):
+    """Latencies in second of successive calls of a function.
+    """
+    for _ in range(nb_warmup):
+        function()
+    latencies = np.zeros(nb_calls)
+    for k in range(nb_calls):
+        start = time.perf_counter()
+        function()
+        latencies[k] = time.perf_counter() - start
+    return latencies
+
+
+def allocations(function, nb_calls=20):
+    """Mean memory in bytes allocated at the peak of a call of a function.
+
+    Zero means that the call works in preallocated buffers.
+    """
+    function()
+    tracemalloc.start()
+    peaks = np.zeros(nb_calls)
+    for k in range(nb_calls):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        function()
+        peaks[k] = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return float(peaks.mean())
+
+
+def build_stages(frame_shape, tmp_dir):
+    """Functions of the stages of the pipeline for a detector size.
+    """
+    mirror = SimulatedIrisAO(NB_SEGMENTS)
+    layout = scaled_layout(frame_shape)
+    simulator = FrameSimulator(mirror, layout, frame_shape, seed=0)
+    frame = simulator.read()
+    dark = np.full(frame_shape, simulator.bias, dtype=np.float32)
+    img_data = np.zeros(frame_shape, dtype=np.float32)
+    roi_index = layout.compile(frame_shape)
+    spectra, fluxes = roi_index.extract(img_data)
+    extractor = SpectralExtractor(roi_index, WavelengthSolution.linear(roi_index.rects),
+                                  profiles=roi_index.gather(simulator.read().astype(float)).sum(2))
+    calibrated_spectra = extractor.extract(img_data)
+    null_estimator = NullDepthEstimator(layout.names)
+    null_depths, null_peaks = null_estimator.compute(calibrated_spectra)
+    saturation_counts = np.zeros(roi_index.nb_outputs, dtype=int)
+    ring_buffer = FrameRingBuffer(32, frame_shape, np.float32, saturation_level=2**14)
+    ring_buffer.set_saturation_index(roi_index)
+    ring_buffer.set_depth(NB_AVERAGED)
+    for _ in range(ring_buffer.nb_slots):
+        ring_buffer.push(frame)
+    flux_history = RollingSeries(len(layout.names), 1000)
+
+    fits_path = os.path.join(tmp_dir, 'frame_%sx%s.fits' % frame_shape)
+    fits.PrimaryHDU(frame).writeto(fits_path, overwrite=True)
+    fits_source = FitsFrameSource(fits_path)
+    raw_path = os.path.join(tmp_dir, 'frame_%sx%s.raw' % frame_shape)
+    frame.tofile(raw_path)
+    raw_source = RawFrameSource(raw_path, frame_shape, frame.dtype)
+
+    def processing(new_frame):
+        ring_buffer.push(new_frame)
+        ring_buffer.running_average(img_data)
+        ring_buffer.saturated_pixels(saturation_counts)
+        np.subtract(img_data, dark, out=img_data)
+        roi_index.extract(img_data, spectra, fluxes)
+        extractor.extract(img_data, calibrated_spectra)
+        null_estimator.compute(calibrated_spectra, null_depths, null_peaks)
+        flux_history.push(fluxes)
+
+    stages = [('frame_simulate', simulator.read),
+              ('frame_load_fits', lambda: fits_source.read(force=True)),
+              ('frame_load_raw', lambda: raw_source.read(force=True)),
+              ('dark_subtraction', lambda: np.subtract(img_data, dark, out=img_data)),
+              ('averaging', lambda: ring_buffer.running_average(img_data)),
+              ('saturation_count', lambda: roi_index.count_above(frame, 2**14, saturation_counts)),
+              ('roi_extraction', lambda: roi_index.extract(img_data, spectra, fluxes)),
+              ('spectral_extraction', lambda: extractor.extract(img_data, calibrated_spectra)),
+              ('null_depths', lambda: null_estimator.compute(calibrated_spectra, null_depths, null_peaks)),
+              ('flux_history', lambda: flux_history.push(fluxes)),
+              ('frame_processing', lambda: processing(frame)),
+              ('full_pipeline', lambda: processing(simulator.read()))]
+    closers = [fits_source.close, raw_source.close]
+    return stages, closers
+
+
+def build_scan_stages():
+    """Functions of the post-processing of the scans, independent of the detector size.
+    """
+    rng = np.random.default_rng(0)
+    ttx = np.linspace(-2.5, 2.5, 11)
+    tty = np.linspace(-2.5, 2.5, 11)
+    tt_map = np.exp(-0.5 * ((ttx[:, None] - 0.3)**2 + (tty[None, :] + 0.6)**2) / 0.8**2)
+    tt_map += 0.01 * rng.standard_normal(tt_map.shape)
+    ttx_interp = np.linspace(ttx[0], ttx[-1], 201)
+    tty_interp = np.linspace(tty[0], tty[-1], 201)
+
+    pistons = np.arange(-2.5, 2.5, 0.5)
+    fluxes = 1. + np.sin(2 * np.pi * pistons / WAVELENGTH + 0.4) + 0.02 * rng.standard_normal(pistons.size)
+    null_model = lambda x, amp, freq, phase, offset: amp * np.sin(freq*x + phase) + offset
+    init_guess = [(fluxes.max()-fluxes.min())/2, 2*np.pi/WAVELENGTH, 0, fluxes.mean()]
+
+    # Null depths of a scan: 5 loops, 6 nulls, 61 wavelengths
+    wavelengths = np.linspace(1.4, 1.7, 61)
+    loop_pistons = pistons + 0.01 * rng.standard_normal((5, pistons.size))
+    null_depths = 1. + np.sin(2 * np.pi * loop_pistons[:, None, None, :] / wavelengths[:, None] + 0.4)
+    null_depths = null_depths + 0.02 * rng.standard_normal((5, 6, wavelengths.size, pistons.size))
+
+    def null_fit_linear():
+        fringe_minimum(fit_fringe(pistons, fluxes, WAVELENGTH), WAVELENGTH)
+
+    def null_fit_batch():
+        coefs, covariance = fit_fringes(loop_pistons[:, None, None, :], null_depths, wavelengths)
+        fringe_minimum(coefs, wavelengths)
+        fringe_minimum_error(coefs, covariance, wavelengths)
+
+    return [('tt_map_interpolation', lambda: interp_tt_map(ttx, tty, tt_map, ttx_interp, tty_interp)),
+            ('null_fit_curve_fit', lambda: curve_fit(null_model, pistons, fluxes, p0=init_guess)),
+            ('null_fit_linear', null_fit_linear),
+            ('null_fit_batch', null_fit_batch)]
+
+
+def run_stage(name, function, nb_calls):
+    latencies = time_stage(function, nb_calls)
+    allocated = allocations(function)
+    # The median is less sensitive than the mean to the other processes of the machine
+    return {'throughput': float(1. / np.median(latencies)),
+            'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+            'p90_ms': float(np.percentile(latencies, 90) * 1e3),
+            'p99_ms': float(np.percentile(latencies, 99) * 1e3),
+            'allocated_bytes': allocated}
+
+
+def run(sizes, nb_calls):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            frame_shape = tuple(int(elt) for elt in size.split('x'))
+            stages, closers = build_stages(frame_shape, tmp_dir)
+            for name, function in stages:
+                results['%s/%s' % (size, name)] = run_stage(name, function, nb_calls)
+            for close in closers:
+                close()
+    for name, function in build_scan_stages():
+        results['scan/%s' % name] = run_stage(name, function, nb_calls)
+    return results
+
+
+def report(results):
+    print('%-36s %12s %9s %9s %9s %15s' % ('stage', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms',
+                                           'allocated bytes'))
+    for name, res in results.items():
+        print('%-36s %12.1f %9.3f %9.3f %9.3f %15.0f' % (
+            name, res['throughput'], res['p50_ms'], res['p90_ms'], res['p99_ms'],
+            res['allocated_bytes']))
+
+
+def check(results, baseline, tolerance):
+    """List the stages slower than their baseline throughput by more than ``tolerance``.
+    """
+    regressions = []
+    for name, reference in baseline.items():
+        if name not in results:
+            continue
+        if results[name]['throughput'] < (1. - tolerance) * reference:
+            regressions.append('%s: %.1f calls/s instead of %.1f' % (name, results[name]['throughput'], reference))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES,
+                        help='detector sizes as ROWSxCOLUMNS, default: %(default)s')
+    parser.add_argument('--calls', type=int, default=200, help='number of timed calls per stage')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path of the baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the throughputs as baseline')
+    parser.add_argument('--check', action='store_true', help='exit with an error if a stage regressed')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='accepted relative loss of throughput, default: %(default)s')
+    parser.add_argument('--json', help='save the full results in this file')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.calls)
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({name: res['throughput'] for name, res in results.items()}, f, indent=4)
+        print('Baseline saved in', args.baseline)
+    if args.check:
+        if not os.path.isfile(args.baseline):
+            print('No baseline in', args.baseline)
+            return 2
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = check(results, baseline, args.tolerance)
+        if regressions:
+            print('Throughput regressions:')
+            for elt in regressions:
+                print('   ', elt)
+            return 1
+        print('No regression against', args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
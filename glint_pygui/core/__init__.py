@@ -0,0 +1,26 @@
+"""Processing core of the GLINT RT control GUI.
+
+Nothing in this package depends on Qt: the GUI drives it and displays its results.
+
+For linux OS: like any package using C-based code, it must be imported
+**after** the MEMS python library.
+"""
+from .acquisition import FrameRingBuffer, AcquisitionThread, HysteresisAlarm
+from .statistics import RollingSeries, DecimatedHistory
+from .calibration import DarkAccumulator, MasterDark, DarkLibrary, find_bad_pixels
+from .frame_source import FrameSource, FitsFrameSource, RawFrameSource
+from .rois import RoiIndex
+from .spectra import WavelengthSolution, SpectralExtractor
+from .nulling import NullDepthEstimator
+from .layout import RoiLayout, BEAM_SEGMENTS, NULL_BEAMS
+from .recorder import FrameRecorder
+from .fringes import fit_fringe, fit_fringes, fringe_model, fringe_minimum, fringe_minimum_error
+from .optimizers import search_null, search_tt_max
+from .ttmaps import interp_tt_map, mean_tt_map
+from .errors import display_error
+from .mems import MemsControl
+from .simulator import SimulatedIrisAO, FrameSimulator
+from .scheduler import ScanScheduler
+from .scans import Axis, Grid, FixedPoints, Spiral, LatinHypercube, AdaptiveGrid, ScanSpec, ScanResult, ScanExecutor
+from .engine import GlintEngine
+from .parameters import ParameterStore, int_parser, float_parser, limit_parser, optional_parser
@@ -0,0 +1,355 @@
+import threading
+import time
+import numpy as np
+
+
+class FrameRingBuffer(object):
+    """Preallocated ring buffer of camera frames.
+
+    The acquisition thread writes each new frame in the next slot while the GUI
+    reads the latest completed ones.
+    Slots are never reallocated, the frames are copied (and cast) into them.
+
+    The sum of the last ``depth`` frames is updated at each new frame
+    (the new frame is added, the one leaving the window is subtracted) so
+    ``running_average`` costs the same whatever the number of averaged frames.
+
+    With a saturation index, the saturated pixels of each output are counted on the raw frame,
+    before its conversion, when it is pushed.
+
+    Each frame is tagged with its timestamp and the epoch of the command of the mirror
+    it was acquired after, so that the scans keep only the frames of a settled mirror.
+    """
+    def __init__(self, nb_slots, frame_shape, dtype=float, saturation_level=None):
+        """
+        :param nb_slots: number of frames kept in the buffer.
+        :type nb_slots: int
+        :param frame_shape: shape of a frame (rows, columns).
+        :type frame_shape: tuple
+        :param dtype: type of the stored frames, defaults to float
+        :type dtype: numpy dtype, optional
+        :param saturation_level: flag a frame as saturated if any pixel is
+                                above or equal to this level, defaults to None
+        :type saturation_level: float, optional
+        """
+        self.nb_slots = int(nb_slots)
+        self.frame_shape = tuple(frame_shape)
+        self.saturation_level = saturation_level
+        self.frames = np.zeros((self.nb_slots,) + self.frame_shape, dtype=dtype)
+        self.timestamps = np.zeros(self.nb_slots)
+        self.epochs = np.full(self.nb_slots, -1, dtype=int)
+        self.saturated = np.zeros(self.nb_slots, dtype=bool)
+        # Number of frames written since the creation of the buffer
+        self.count = 0
+        self._lock = threading.Lock()
+
+        # Running sum of the last ``depth`` frames, in the type of the frames if it is a float:
+        # float32 is exact for the sum of a few tens of 16-bit frames
+        self.depth = 1
+        sum_dtype = self.frames.dtype if self.frames.dtype.kind == 'f' else float
+        self._running_sum = np.zeros(self.frame_shape, dtype=sum_dtype)
+        self._running_saturated = 0
+        self._pushes_since_sync = 0
+
+        # Saturated pixels of each output in each slot
+        self.saturation_index = None
+        self.saturation_counts = np.zeros((self.nb_slots, 0), dtype=int)
+
+    def push(self, frame, timestamp=None, epoch=-1):
+        """Copy a frame in the next slot of the buffer.
+
+        :param frame: frame to store, it must have the shape ``frame_shape``.
+        :type frame: array
+        :param timestamp: time of acquisition of the frame, defaults to now.
+        :type timestamp: float, optional
+        :param epoch: epoch of the last command of the mirror, defaults to -1
+        :type epoch: int, optional
+        :return: index of the frame since the creation of the buffer.
+        :rtype: int
+        """
+        idx = self.count % self.nb_slots
+        saturation_index, saturation_counts = self.saturation_index, self.saturation_counts
+        if self.saturation_level is not None and saturation_index is not None:
+            # The slot is not published yet, the raw frame is read out of the lock
+            saturation_index.count_above(frame, self.saturation_level, saturation_counts[idx])
+        with self._lock:
+            # The frame leaving the window is still in its slot since depth < nb_slots
+            if self.count >= self.depth:
+                old = (self.count - self.depth) % self.nb_slots
+                self._running_sum -= self.frames[old]
+                self._running_saturated -= self.saturated[old]
+            self.frames[idx] = frame
+            self.timestamps[idx] = time.time() if timestamp is None else timestamp
+            self.epochs[idx] = epoch
+            if self.saturation_level is not None and saturation_index is not None:
+                self.saturated[idx] = saturation_counts[idx].any()
+            elif self.saturation_level is not None:
+                self.saturated[idx] = np.any(frame >= self.saturation_level)
+            self._running_sum += self.frames[idx]
+            self._running_saturated += self.saturated[idx]
+            # The slot is published only once it is completely written
+            self.count += 1
+            self._pushes_since_sync += 1
+            if self._pushes_since_sync >= 64 * self.nb_slots and self.frames.dtype.kind == 'f':
+                # Float frames: get rid of the rounding errors accumulated by the updates
+                self._sync_running_sum()
+        return self.count - 1
+
+    def read_frame(self, index, out=None):
+        """Copy of a frame given by its index since the creation of the buffer.
+
+        :param index: index of the frame, as returned by ``push``.
+        :type index: int
+        :param out: array in which the frame is copied, defaults to None
+        :type out: array, optional
+        :return: tuple of the frame, its timestamp and its epoch, `None` if the frame
+                is not written yet or already overwritten.
+        :rtype: tuple
+        """
+        with self._lock:
+            # The oldest slot is the next one to be written
+            if index >= self.count or index <= self.count - self.nb_slots:
+                return None
+            idx = index % self.nb_slots
+            if out is None:
+                out = self.frames[idx].copy()
+            else:
+                out[:] = self.frames[idx]
+            return out, self.timestamps[idx], self.epochs[idx]
+
+    def frame_interval(self, nb_frames=8):
+        """Median time between the last frames, i.e. the period of the camera.
+
+        :param nb_frames: number of last frames used, defaults to 8
+        :type nb_frames: int, optional
+        :return: interval in second, `None` with less than two frames.
+        :rtype: float
+        """
+        with self._lock:
+            nb_frames = min(nb_frames, self.count, self.nb_slots)
+            if nb_frames < 2:
+                return None
+            slots = (self.count - nb_frames + np.arange(nb_frames)) % self.nb_slots
+            return float(np.median(np.diff(self.timestamps[slots])))
+
+    def set_saturation_index(self, roi_index):
+        """Count the saturated pixels of each output of an index.
+
+        :param roi_index: extraction index of the outputs.
+        :type roi_index: RoiIndex
+        """
+        with self._lock:
+            self.saturation_counts = np.zeros((self.nb_slots, roi_index.nb_outputs), dtype=int)
+            self.saturation_index = roi_index
+
+    def saturated_pixels(self, out=None):
+        """Largest number of saturated pixels of each output in the frames of the running average.
+
+        :param out: array of shape (outputs,) in which the counts are written, defaults to None
+        :type out: array, optional
+        :rtype: array
+        """
+        with self._lock:
+            counts = self.saturation_counts
+            if out is None:
+                out = np.zeros(counts.shape[1], dtype=int)
+            nb_frames = min(self.depth, self.count)
+            if nb_frames == 0 or counts.shape[1] == 0:
+                out[:] = 0
+                return out
+            first = (self.count - nb_frames) % self.nb_slots
+            last = first + nb_frames
+            # The window may wrap around the end of the buffer
+            np.max(counts[first:min(last, self.nb_slots)], 0, out=out)
+            if last > self.nb_slots:
+                np.maximum(out, counts[:last - self.nb_slots].max(0), out=out)
+        return out
+
+    def set_depth(self, depth):
+        """Set the number of frames of the running average.
+
+        The running sum is computed again from the buffer, only when the depth changes.
+
+        :param depth: number of averaged frames, it is capped at ``nb_slots - 1``.
+        :type depth: int
+        """
+        depth = min(max(1, int(depth)), self.nb_slots - 1)
+        with self._lock:
+            if depth != self.depth:
+                self.depth = depth
+                self._sync_running_sum()
+
+    def _sync_running_sum(self):
+        nb_frames = min(self.depth, self.count)
+        slots = np.arange(self.count - nb_frames, self.count) % self.nb_slots
+        np.sum(self.frames[slots], 0, out=self._running_sum)
+        self._running_saturated = int(self.saturated[slots].sum())
+        self._pushes_since_sync = 0
+
+    def running_average(self, out=None):
+        """Average of the last ``depth`` frames, from the running sum.
+
+        :param out: array in which the average is written, defaults to None
+        :type out: array, optional
+        :return: tuple of the averaged frame, the number of averaged frames
+                and whether any of them is saturated.
+        :rtype: tuple
+        """
+        if out is None:
+            out = np.zeros(self.frame_shape)
+        with self._lock:
+            nb_frames = min(self.depth, self.count)
+            if nb_frames == 0:
+                out[:] = 0.
+                return out, 0, False
+            np.multiply(self._running_sum, self._running_sum.dtype.type(1. / nb_frames), out=out)
+            saturated = self._running_saturated > 0
+        return out, nb_frames, saturated
+
+    def average(self, nb_frames, out=None):
+        """Average the last completed frames.
+
+        If the buffer holds fewer frames than requested, all of them are averaged.
+
+        :param nb_frames: number of frames to average, it is capped at ``nb_slots - 1``
+                        so that the slot being written is never read.
+        :type nb_frames: int
+        :param out: array in which the average is written, defaults to None
+        :type out: array, optional
+        :return: tuple of the averaged frame, the number of averaged frames
+                and whether any of them is saturated.
+        :rtype: tuple
+        """
+        if out is None:
+            out = np.zeros(self.frame_shape, dtype=self.frames.dtype)
+        with self._lock:
+            count = self.count
+        nb_frames = min(max(1, int(nb_frames)), self.nb_slots - 1, count)
+        if nb_frames == 0:
+            out[:] = 0.
+            return out, 0, False
+
+        slots = np.arange(count - nb_frames, count) % self.nb_slots
+        np.sum(self.frames[slots], 0, out=out)
+        out /= nb_frames
+        return out, nb_frames, bool(self.saturated[slots].any())
+
+    def latest(self, out=None):
+        """Copy of the last completed frame.
+
+        :param out: array in which the frame is copied, defaults to None
+        :type out: array, optional
+        :return: tuple of the frame and its index since the creation of the buffer,
+                the index is -1 if no frame has been written yet.
+        :rtype: tuple
+        """
+        out, nb_frames, _ = self.average(1, out)
+        return out, self.count - 1 if nb_frames else -1
+
+
+class HysteresisAlarm(object):
+    """Alarm raised as soon as a value reaches ``on_level`` and cleared only
+    once it has stayed at or below ``off_level`` during ``clear_delay`` updates,
+    so that it does not flicker around the threshold.
+    """
+    def __init__(self, on_level=1, off_level=0, clear_delay=10):
+        """
+        :param on_level: value raising the alarm, defaults to 1
+        :type on_level: float, optional
+        :param off_level: value below which the alarm can be cleared, defaults to 0
+        :type off_level: float, optional
+        :param clear_delay: number of successive updates at or below ``off_level`` clearing the alarm, defaults to 10
+        :type clear_delay: int, optional
+        """
+        self.on_level = on_level
+        self.off_level = off_level
+        self.clear_delay = clear_delay
+        self.active = False
+        self._nb_quiet = 0
+
+    def update(self, value):
+        """Update the alarm with a new value.
+
+        :param value: monitored value, e.g. a number of saturated pixels.
+        :type value: float
+        :return: `True` if the alarm has been raised or cleared by this value.
+        :rtype: bool
+        """
+        if value >= self.on_level:
+            self._nb_quiet = 0
+            if not self.active:
+                self.active = True
+                return True
+            return False
+        if value <= self.off_level:
+            self._nb_quiet += 1
+        else:
+            self._nb_quiet = 0
+        if self.active and self._nb_quiet >= self.clear_delay:
+            self.active = False
+            return True
+        return False
+
+
+class AcquisitionThread(threading.Thread):
+    """Read the camera frames in the background and feed a ring buffer.
+
+    The GUI only reads the last completed frames of the buffer so
+    the display rate does not depend on the acquisition rate and
+    the GUI thread never waits for the disk.
+    """
+    def __init__(self, read_frame, ring_buffer, fps, on_frame=None, get_epoch=None):
+        """
+        :param read_frame: function returning the last frame of the camera,
+                        or `None` if there is no new frame.
+        :type read_frame: callable
+        :param ring_buffer: buffer to fill.
+        :type ring_buffer: FrameRingBuffer
+        :param fps: maximum acquisition rate in Hz.
+        :type fps: float
+        :param on_frame: function called with each new frame and its timestamp
+                        (e.g. to record it), defaults to None
+        :type on_frame: callable, optional
+        :param get_epoch: function returning the epoch of the last command of the mirror,
+                        the frames are tagged with it, defaults to None
+        :type get_epoch: callable, optional
+        """
+        super(AcquisitionThread, self).__init__(daemon=True)
+        self.read_frame = read_frame
+        self.ring_buffer = ring_buffer
+        self.period = 1. / abs(fps)
+        self.on_frame = on_frame
+        self.get_epoch = get_epoch
+        self.nb_errors = 0
+        self.last_error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                # Epoch of the mirror before the read: a frame is never tagged with a later command
+                epoch = -1 if self.get_epoch is None else self.get_epoch()
+                frame = self.read_frame()
+                if frame is not None:
+                    timestamp = time.time()
+                    self.ring_buffer.push(frame, timestamp, epoch)
+                    if self.on_frame is not None:
+                        self.on_frame(frame, timestamp)
+            except Exception as e:
+                # The camera may be writing the file, the next read will do
+                self.nb_errors += 1
+                self.last_error = e
+            remaining = self.period - (time.perf_counter() - start)
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+
+    def stop(self, timeout=1.):
+        """Stop the acquisition and wait for the thread to end.
+
+        :param timeout: maximum waiting time in second, defaults to 1.
+        :type timeout: float, optional
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
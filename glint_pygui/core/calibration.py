@@ -0,0 +1,247 @@
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+from astropy.io import fits
+
+
+def robust_outliers(image, nb_sigma):
+    """Pixels above the median of an image by more than ``nb_sigma`` robust deviations.
+
+    The deviation is the median absolute deviation scaled to a Gaussian standard deviation.
+
+    :rtype: array of bool
+    """
+    median = np.median(image)
+    sigma = 1.4826 * np.median(np.abs(image - median))
+    if sigma == 0:
+        sigma = np.finfo(float).eps * max(abs(median), 1.)
+    return image > median + nb_sigma * sigma
+
+
+def find_bad_pixels(dark, noise, rejected_fraction, nb_sigma=5., max_rejected=0.5):
+    """Mask of the hot, noisy and unstable pixels of a master dark.
+
+    :param dark: master dark.
+    :type dark: array
+    :param noise: temporal standard deviation of each pixel in the darks.
+    :type noise: array
+    :param rejected_fraction: fraction of the dark frames rejected by the clipping, for each pixel.
+    :type rejected_fraction: array
+    :param nb_sigma: threshold of the hot and noisy pixels, in robust deviations, defaults to 5.
+    :type nb_sigma: float, optional
+    :param max_rejected: largest fraction of rejected frames of a stable pixel, defaults to 0.5
+    :type max_rejected: float, optional
+    :return: mask, `True` for a bad pixel.
+    :rtype: array of bool
+    """
+    return robust_outliers(dark, nb_sigma) | robust_outliers(noise, nb_sigma) | \
+        (rejected_fraction > max_rejected)
+
+
+class MasterDark(object):
+    """Master dark, noise and bad-pixel mask measured for given detector settings.
+    """
+    def __init__(self, dark, noise, bad_pixels, nb_frames, settings=None, date=None):
+        """
+        :param dark: master dark.
+        :type dark: array
+        :param noise: temporal standard deviation of each pixel in the dark frames.
+        :type noise: array
+        :param bad_pixels: mask of the bad pixels.
+        :type bad_pixels: array of bool
+        :param nb_frames: number of dark frames.
+        :type nb_frames: int
+        :param settings: settings of the detector (exposure time, gain...), defaults to None
+        :type settings: dict, optional
+        :param date: date of the measurement, ISO format, defaults to now.
+        :type date: string, optional
+        """
+        self.dark = dark
+        self.noise = noise
+        self.bad_pixels = bad_pixels
+        self.nb_frames = nb_frames
+        self.settings = {} if settings is None else dict(settings)
+        self.date = datetime.datetime.now().isoformat() if date is None else date
+
+    def save(self, path):
+        """Save in a FITS file: the dark in the primary HDU, then the noise and the mask.
+
+        :param path: path of the file, overwritten.
+        :type path: string
+        """
+        header = fits.Header()
+        header['NFRAMES'] = self.nb_frames
+        header['DATE'] = self.date
+        header['SETTINGS'] = json.dumps(self.settings, sort_keys=True)
+        hdul = fits.HDUList([fits.PrimaryHDU(self.dark, header),
+                             fits.ImageHDU(self.noise, name='NOISE'),
+                             fits.ImageHDU(self.bad_pixels.astype(np.uint8), name='BADPIX')])
+        hdul.writeto(path, overwrite=True)
+
+    @classmethod
+    def load(cls, path):
+        """Read a master dark saved with ``save``.
+
+        :param path: path of the file.
+        :type path: string
+        :rtype: MasterDark
+        """
+        with fits.open(path) as hdul:
+            header = hdul[0].header
+            return cls(np.array(hdul[0].data, dtype=float), np.array(hdul['NOISE'].data, dtype=float),
+                       np.array(hdul['BADPIX'].data, dtype=bool), header['NFRAMES'],
+                       json.loads(header['SETTINGS']), header['DATE'])
+
+
+class DarkAccumulator(object):
+    """Master dark built frame by frame, in a constant memory.
+
+    The first ``warmup`` frames give a per-pixel median and a robust deviation.
+    Then each frame updates a running mean and variance (Welford) of each pixel,
+    the values further than ``clip_sigma`` deviations from the current estimate
+    (e.g. cosmic rays, glitches) are rejected.
+    A pixel is not clipped while more than ``max_rejected`` of its frames are rejected:
+    a pixel drifting away from its first frames is then followed by the running mean
+    (and shows up as noisy) instead of being rejected for good.
+    Only a few frame-sized arrays are kept, whatever the number of frames.
+
+    The frames must be taken with the source blocked, any light is part of the dark.
+    """
+    def __init__(self, frame_shape, clip_sigma=3., warmup=5, max_rejected=0.2):
+        """
+        :param frame_shape: shape (rows, columns) of the frames.
+        :type frame_shape: tuple
+        :param clip_sigma: rejection threshold in standard deviations, defaults to 3.
+        :type clip_sigma: float, optional
+        :param warmup: number of frames of the initial median, defaults to 5
+        :type warmup: int, optional
+        :param max_rejected: largest fraction of rejected frames of a clipped pixel, defaults to 0.2
+        :type max_rejected: float, optional
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.clip_sigma = clip_sigma
+        self.max_rejected = max_rejected
+        self.warmup = max(1, int(warmup))
+        self.nb_frames = 0
+        self._warmup_frames = np.zeros((self.warmup,) + self.frame_shape)
+        self._count = np.zeros(self.frame_shape)
+        self._mean = np.zeros(self.frame_shape)
+        self._m2 = np.zeros(self.frame_shape)
+        self._rejected = np.zeros(self.frame_shape)
+        self._sigma_floor = 0.
+
+    def add(self, frame):
+        """Add a dark frame.
+
+        :param frame: frame of shape ``frame_shape``.
+        :type frame: array
+        """
+        frame = np.asarray(frame, dtype=float)
+        if self._warmup_frames is not None:
+            self._warmup_frames[self.nb_frames] = frame
+            self.nb_frames += 1
+            if self.nb_frames == self.warmup:
+                self._start()
+            return
+        self.nb_frames += 1
+        self._update(frame, self._mean, self._sigma())
+
+    def _start(self):
+        frames = self._warmup_frames[:self.nb_frames]
+        self._warmup_frames = None
+        center = np.median(frames, 0)
+        sigma = 1.4826 * np.median(np.abs(frames - center), 0)
+        # The deviation over a few frames is inaccurate (even null for integer frames):
+        # a pixel is not clipped below the typical noise of the detector
+        self._sigma_floor = max(np.median(sigma), 1e-6)
+        sigma = np.maximum(sigma, self._sigma_floor)
+        for frame in frames:
+            self._update(frame, center, sigma)
+
+    def _sigma(self):
+        variance = self._m2 / np.maximum(self._count - 1, 1)
+        return np.maximum(np.sqrt(variance), self._sigma_floor)
+
+    def _update(self, frame, center, sigma):
+        accepted = np.abs(frame - center) <= self.clip_sigma * sigma
+        # Re-centre the pixels rejected too often rather than clip them against a stale mean
+        accepted |= self._rejected >= self.max_rejected * self.nb_frames
+        self._count += accepted
+        delta = np.where(accepted, frame - self._mean, 0.)
+        self._mean += delta / np.maximum(self._count, 1)
+        self._m2 += delta * (frame - self._mean)
+        self._rejected += ~accepted
+
+    def result(self, settings=None, nb_sigma=5.):
+        """Master dark of the frames added so far.
+
+        :param settings: settings of the detector, defaults to None
+        :type settings: dict, optional
+        :param nb_sigma: threshold of the hot and noisy pixels, defaults to 5.
+        :type nb_sigma: float, optional
+        :rtype: MasterDark
+        """
+        if self.nb_frames == 0:
+            raise ValueError('No dark frame')
+        if self._warmup_frames is not None:
+            self._start()
+        noise = np.sqrt(self._m2 / np.maximum(self._count - 1, 1))
+        bad_pixels = find_bad_pixels(self._mean, noise, self._rejected / self.nb_frames, nb_sigma)
+        return MasterDark(self._mean.copy(), noise, bad_pixels, self.nb_frames, settings)
+
+
+class DarkLibrary(object):
+    """Master darks cached on disk, one file per set of detector settings.
+
+    The name of a file is a hash of the settings, e.g. the exposure time, the gain
+    and the shape of the frames, so the dark matching the current settings is found
+    without reading the others.
+    """
+    def __init__(self, directory):
+        """
+        :param directory: directory of the files, created if needed.
+        :type directory: string
+        """
+        self.directory = directory
+
+    @staticmethod
+    def key(settings):
+        """Identifier of detector settings.
+
+        :param settings: settings of the detector, with JSON-serializable values.
+        :type settings: dict
+        :rtype: string
+        """
+        text = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def path(self, settings):
+        return os.path.join(self.directory, 'dark_%s.fits' % self.key(settings))
+
+    def save(self, master_dark):
+        """Store a master dark under its settings, replacing the previous one.
+
+        :param master_dark: master dark.
+        :type master_dark: MasterDark
+        :return: path of the file.
+        :rtype: string
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(master_dark.settings)
+        master_dark.save(path)
+        return path
+
+    def load(self, settings):
+        """Master dark of given settings.
+
+        :param settings: settings of the detector.
+        :type settings: dict
+        :return: the master dark, `None` if there is none for these settings.
+        :rtype: MasterDark
+        """
+        path = self.path(settings)
+        if not os.path.isfile(path):
+            return None
+        return MasterDark.load(path)
@@ -0,0 +1,834 @@
+import time
+import contextlib
+import numpy as np
+from .acquisition import FrameRingBuffer, AcquisitionThread, HysteresisAlarm
+from .layout import RoiLayout
+from .recorder import FrameRecorder
+from .statistics import RollingSeries, DecimatedHistory
+from .calibration import DarkAccumulator, DarkLibrary
+from .spectra import WavelengthSolution, SpectralExtractor
+from .nulling import NullDepthEstimator
+from .scheduler import ScanScheduler
+from .scans import Axis, Grid, ScanSpec, ScanExecutor
+from .fringes import fit_fringe, fit_fringes, fringe_minimum, fringe_minimum_error
+from .optimizers import search_null, search_tt_max
+
+
+class GlintEngine(object):
+    """Acquisition, calibration, extraction and scans of GLINT, without GUI.
+
+    The engine owns the frames, the dark, the fluxes of the outputs and the commanded positions
+    of the mirror (``mems_values``), the read-back ones are in ``mems_positions``. The GUI only drives it and displays its state,
+    the same engine runs in a script or a batch job::
+
+        mems = MemsControl(SimulatedIrisAO(37), None, 37)
+        engine = GlintEngine(mems, FrameSimulator(mems.api), 37)
+        engine.take_dark(10)
+        engine.subtract_dark = True
+        tt_maps = engine.scan_tt_grid([29], [16], ttx, tty)
+
+    Long operations (darks, scans) wait with ``wait`` between the moves and the frames,
+    the GUI gives a waiting function processing its events.
+    They stop as soon as possible after ``abort`` is called.
+    """
+    def __init__(self, mems, frame_source, nb_segments, frame_shape=(344, 96), layout=None,
+                 buffer_slots=32, saturation_level=None, acquisition_fps=50.,
+                 mems_range=(-2.5, 2.5), history_width=100, detector_settings=None, dark_library=None,
+                 wavelength_solution=None, wait=time.sleep):
+        """
+        :param mems: connection to the mirror.
+        :type mems: MemsControl
+        :param frame_source: source of the frames, with the methods ``read(force)`` and ``close()``.
+        :type frame_source: FrameSource
+        :param nb_segments: number of segments of the mirror.
+        :type nb_segments: int
+        :param frame_shape: shape (rows, columns) of the frames, defaults to (344, 96)
+        :type frame_shape: tuple, optional
+        :param layout: geometry of the outputs, defaults to the default ``RoiLayout``.
+        :type layout: RoiLayout, optional
+        :param buffer_slots: number of frames kept in the ring buffer, defaults to 32
+        :type buffer_slots: int, optional
+        :param saturation_level: level above which a frame is flagged as saturated, defaults to None
+        :type saturation_level: float, optional
+        :param acquisition_fps: rate of the background acquisition in Hz, defaults to 50.
+        :type acquisition_fps: float, optional
+        :param mems_range: minimum and maximum positions sent to the mirror, defaults to (-2.5, 2.5)
+        :type mems_range: tuple, optional
+        :param history_width: number of refreshes kept in ``flux_history``, defaults to 100
+        :type history_width: int, optional
+        :param detector_settings: settings of the detector (exposure time, gain...) keying
+                                the master darks, the shape of the frames is added, defaults to None
+        :type detector_settings: dict, optional
+        :param dark_library: cache of the master darks, defaults to None
+        :type dark_library: DarkLibrary, optional
+        :param wavelength_solution: wavelengths of the columns of the outputs,
+                                    defaults to a linear solution over the outputs.
+        :type wavelength_solution: WavelengthSolution, optional
+        :param wait: function waiting a given time in second, defaults to ``time.sleep``
+        :type wait: callable, optional
+        """
+        self.mems = mems
+        self.frame_source = frame_source
+        self.nb_segments = nb_segments
+        self.frame_shape = tuple(frame_shape)
+        self.acquisition_fps = acquisition_fps
+        self.mems_range = mems_range
+        self.wait = wait
+
+        self.mems_values = np.zeros((nb_segments, 3))
+        # Read-back positions, shared with ``mems``: NaN until read
+        self.mems_positions = mems.positions
+        # The frames are processed in float32 in buffers allocated once
+        self.frame_buffer = FrameRingBuffer(buffer_slots, self.frame_shape, np.float32,
+                                            saturation_level=saturation_level)
+        self.acquisition = None
+        self.recorder = None
+
+        self.dark = np.zeros(self.frame_shape, dtype=np.float32)
+        self.subtract_dark = False
+        self.master_dark = None
+        self.bad_pixels = None
+        self.set_detector_settings({} if detector_settings is None else detector_settings)
+        self.dark_library = dark_library
+        self.nb_averaged = 1
+        self.img_data = np.zeros(self.frame_shape, dtype=np.float32)
+        self.saturated = False
+        # Raised by a saturated pixel in an output, cleared after 10 refreshes without
+        self.saturation_alarm = HysteresisAlarm(1, 0, 10)
+        self.saturation_changed = False
+        self.history_width = history_width
+        # Spectra of all the outputs on a common wavelength grid, also recorded with the frames
+        self.wavelength_solution = wavelength_solution
+        self.trace_profiles = None
+        self.record_spectra = True
+        self._record_frame = np.zeros(self.frame_shape, dtype=np.float32)
+        self.set_layout(RoiLayout() if layout is None else layout)
+
+        # Called after each move of the mirror, e.g. to update a display
+        self.on_move = None
+        self._aborted = False
+
+        # Each command of the mirror starts a new epoch, the frames are tagged with it
+        self.command_epoch = 0
+        self.command_time = 0.
+        # Settling of the mirror during the scans (see ``ScanScheduler``)
+        self.settle_tolerance = None
+        self.settle_frames = 3
+        self.scan_timeout = 2.
+        # Errors of the scans, e.g. points without frames (see ``pop_scan_errors``)
+        self.scan_errors = []
+
+    # =============================================================================
+    # Frames
+    # =============================================================================
+    def set_layout(self, layout):
+        """Use a new geometry of the outputs.
+
+        :param layout: geometry of the outputs.
+        :type layout: RoiLayout
+        """
+        roi_index = layout.compile(self.frame_shape, self.bad_pixels)
+        solution = self.wavelength_solution
+        if solution is None:
+            solution = WavelengthSolution.linear(roi_index.rects)
+        profiles = self.trace_profiles
+        if profiles is not None and profiles.shape != roi_index.shape[:2]:
+            profiles = None
+        noise = None if self.master_dark is None else self.master_dark.noise
+        extractor = SpectralExtractor(roi_index, solution, profiles=profiles, noise=noise)
+
+        self.roi_layout = layout
+        self.roi_index = roi_index
+        self.spectral_extractor = extractor
+        self.wavelengths = extractor.wavelengths
+        self.calibrated_spectra = extractor.extract(self.img_data)
+        # The acquisition thread extracts the spectra of the recorded frames with its own buffers
+        self._record_extractor = extractor.copy()
+        self._set_null_estimator(layout)
+        self.frame_buffer.set_saturation_index(self.roi_index)
+        self.saturation_counts = np.zeros(self.roi_index.nb_outputs, dtype=int)
+        self.spectra, self.fluxes = self.roi_index.extract(self.img_data)
+        nb_outputs = len(layout.names)
+        if getattr(self, 'flux_archive', None) is None or self.flux_archive.nb_series != nb_outputs:
+            # Fluxes of all the outputs at the last refreshes, and since the start at lower resolution
+            self.flux_history = RollingSeries(nb_outputs, self.history_width)
+            self.flux_archive = DecimatedHistory(nb_outputs)
+
+    def start_acquisition(self):
+        """Read the frames in the background.
+        """
+        self.stop_acquisition()
+        self.acquisition = AcquisitionThread(self.frame_source.read, self.frame_buffer, self.acquisition_fps,
+                                             on_frame=self.record_frame, get_epoch=lambda: self.command_epoch)
+        self.acquisition.start()
+
+    def stop_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+
+    def pop_acquisition_error(self):
+        """Last error of the background acquisition, reset after the call.
+
+        :return: the error or `None`.
+        :rtype: Exception
+        """
+        if self.acquisition is None or self.acquisition.last_error is None:
+            return None
+        error = self.acquisition.last_error
+        self.acquisition.last_error = None
+        return error
+
+    def pop_scan_errors(self):
+        """Errors of the scans since the last call, reset after the call.
+
+        :return: list of the errors.
+        :rtype: list
+        """
+        errors = self.scan_errors
+        self.scan_errors = []
+        return errors
+
+    def read_frames(self, nb_frames):
+        """Read fresh frames now and store them in the buffer.
+
+        :param nb_frames: number of frames to read.
+        :type nb_frames: int
+        """
+        for k in range(nb_frames):
+            frame = self.frame_source.read(force=True)
+            timestamp = time.time()
+            self.frame_buffer.push(frame, timestamp, self.command_epoch)
+            self.record_frame(frame, timestamp)
+
+    def refresh(self, nb_frames=None):
+        """Average the last frames, subtract the dark and extract the outputs.
+
+        Without background acquisition (e.g. during the scans), fresh frames are read first.
+        The average is kept up to date by the ring buffer at each frame, its cost does
+        not depend on the number of averaged frames.
+        The results are in ``img_data``, ``saturated``, ``saturation_counts`` (saturated
+        pixels of each output), ``saturation_changed`` (the alarm has been raised or cleared),
+        ``spectra``, ``calibrated_spectra`` (on the grid ``wavelengths``), ``fluxes``,
+        ``null_depths`` and ``null_peaks`` (per null and wavelength) and ``broadband_null_depths``,
+        the fluxes are appended to ``flux_history`` and ``flux_archive``.
+        These arrays are overwritten at each refresh, nothing is allocated: copy them to keep them.
+
+        :param nb_frames: number of averaged frames, defaults to ``nb_averaged``.
+        :type nb_frames: int, optional
+        :return: fluxes of the outputs, overwritten at the next refresh.
+        :rtype: array
+        """
+        if nb_frames is None:
+            nb_frames = self.nb_averaged
+        if self.acquisition is None:
+            self.read_frames(max(1, nb_frames))
+
+        self.frame_buffer.set_depth(nb_frames)
+        _, nb_frames, self.saturated = self.frame_buffer.running_average(self.img_data)
+        if self.frame_buffer.saturation_level is not None:
+            self.frame_buffer.saturated_pixels(self.saturation_counts)
+            self.saturation_changed = self.saturation_alarm.update(self.saturation_counts.max())
+        if self.subtract_dark:
+            np.subtract(self.img_data, self.dark, out=self.img_data)
+
+        # Spectra and fluxes of all the outputs, shared by the plots and the scans
+        self.roi_index.extract(self.img_data, self.spectra, self.fluxes)
+        self.spectral_extractor.extract(self.img_data, self.calibrated_spectra)
+        self._update_null_depths()
+        self.flux_history.push(self.fluxes)
+        self.flux_archive.push(self.fluxes)
+        return self.fluxes
+
+    def close(self):
+        """Stop the acquisition and the recording and close the frame source.
+        """
+        self.stop_acquisition()
+        self.stop_record()
+        self.frame_source.close()
+
+    # =============================================================================
+    # Dark
+    # =============================================================================
+    def take_dark(self, nb_frames, interval=0., on_frame=None):
+        """Build the master dark and the bad-pixel mask from fresh frames.
+
+        The source must be blocked: nothing checks that the frames are dark,
+        a lit pixel becomes part of the dark.
+        The frames are accumulated one by one with a sigma clipping (see ``DarkAccumulator``),
+        the memory does not depend on their number.
+        They are copied from the ring buffer filled by the background acquisition,
+        which is started for the duration of the dark if needed, so the frame source
+        is never read by two threads.
+        The master dark is stored in the library, if any, under the current detector settings.
+
+        :param nb_frames: number of frames to average.
+        :type nb_frames: int
+        :param interval: waiting time between two frames, in second, defaults to 0.
+        :type interval: float, optional
+        :param on_frame: function called with the index of each frame, defaults to None
+        :type on_frame: callable, optional
+        :return: `False` if aborted or if no frame arrives within ``scan_timeout``
+                (the error is in ``scan_errors``), the dark is then unchanged.
+        :rtype: bool
+        """
+        self._aborted = False
+        accumulator = DarkAccumulator(self.frame_shape)
+        buffer = self.frame_buffer
+        frame = np.zeros(self.frame_shape, dtype=buffer.frames.dtype)
+        with self.scan_acquisition():
+            k = 0
+            # Only the frames acquired after the call
+            next_index = buffer.count
+            deadline = time.time() + self.scan_timeout + 1. / abs(self.acquisition_fps)
+            while k < nb_frames:
+                if self._aborted:
+                    return False
+                if next_index >= buffer.count:
+                    if time.time() > deadline:
+                        self.scan_errors.append(TimeoutError('No frame for the dark after %s frames' % k))
+                        return False
+                    self.wait(1e-3)
+                    continue
+                # Copy made under the lock of the buffer
+                if buffer.read_frame(next_index, frame) is None:
+                    next_index = max(next_index + 1, buffer.count - buffer.nb_slots + 1)
+                    continue
+                accumulator.add(frame)
+                if on_frame is not None:
+                    on_frame(k)
+                k += 1
+                self.wait(interval)
+                next_index = buffer.count if interval > 0 else next_index + 1
+                deadline = time.time() + self.scan_timeout + 1. / abs(self.acquisition_fps)
+        if self._aborted:
+            return False
+        self.set_master_dark(accumulator.result(self.detector_settings))
+        if self.dark_library is not None:
+            self.dark_library.save(self.master_dark)
+        return True
+
+    def set_detector_settings(self, settings):
+        """Use new settings of the detector, e.g. after a change of the exposure time.
+
+        They key the master darks saved by ``take_dark`` and loaded by ``load_dark``,
+        the shape of the frames is added. The master dark in use is kept (see ``dark_matches_settings``).
+
+        :param settings: settings of the detector, with JSON-serializable values.
+        :type settings: dict
+        """
+        self.detector_settings = dict(settings)
+        self.detector_settings['frame_shape'] = list(self.frame_shape)
+
+    def dark_matches_settings(self):
+        """Whether the master dark in use was taken with the current detector settings.
+
+        :return: `True` without master dark.
+        :rtype: bool
+        """
+        if self.master_dark is None:
+            return True
+        return DarkLibrary.key(self.master_dark.settings) == DarkLibrary.key(self.detector_settings)
+
+    def load_dark(self):
+        """Use the master dark of the library matching the current detector settings.
+
+        :return: `False` if there is no library or no master dark for these settings.
+        :rtype: bool
+        """
+        if self.dark_library is None:
+            return False
+        master_dark = self.dark_library.load(self.detector_settings)
+        if master_dark is None or master_dark.dark.shape != self.frame_shape:
+            return False
+        self.set_master_dark(master_dark)
+        return True
+
+    def set_master_dark(self, master_dark):
+        """Use a master dark and its bad-pixel mask.
+
+        :param master_dark: master dark.
+        :type master_dark: MasterDark
+        """
+        self.master_dark = master_dark
+        self.dark = master_dark.dark.astype(np.float32)
+        self.bad_pixels = master_dark.bad_pixels
+        # The bad pixels are left out of the outputs, the noise weights the spectral extraction
+        self.set_layout(self.roi_layout)
+
+    # =============================================================================
+    # Spectra
+    # =============================================================================
+    def _set_null_estimator(self, layout):
+        """Null depths of the layout, none if it does not have the outputs of the nulls.
+        """
+        previous = getattr(self, 'null_estimator', None)
+        try:
+            self.null_estimator = NullDepthEstimator(layout.names, noise=self.spectral_extractor.spectral_noise())
+        except ValueError:
+            self.null_estimator = None
+            self.null_depths, self.null_peaks, self.broadband_null_depths = None, None, None
+            return
+        # The coupling coefficients are kept while the wavelengths do not change
+        if previous is not None and previous.coupling.shape[-1] in [1, self.wavelengths.size]:
+            self.null_estimator.set_coupling(previous.coupling)
+        self.null_depths, self.null_peaks = self.null_estimator.compute(self.calibrated_spectra)
+        self.broadband_null_depths = self.null_estimator.broadband(self.calibrated_spectra)
+
+    def _update_null_depths(self):
+        if self.null_estimator is not None:
+            self.null_estimator.compute(self.calibrated_spectra, self.null_depths, self.null_peaks)
+            self.null_estimator.broadband(self.calibrated_spectra, self.broadband_null_depths)
+
+    def effective_wavelength(self, output):
+        """Period of the broadband fringe of an output, in piston units.
+
+        The flux of an output sums fringes whose periods are the wavelengths of its columns:
+        around a null, they add up to a fringe of the mean wavenumber, whose period is
+        the harmonic mean of the wavelengths given by the wavelength solution.
+
+        :param output: output (starting at 1).
+        :type output: int
+        :rtype: float
+        """
+        wavelengths = self.spectral_extractor.column_wavelengths[output - 1]
+        wavelengths = wavelengths[np.isfinite(wavelengths)]
+        return 1. / np.mean(1. / wavelengths)
+
+    def set_wavelength_solution(self, solution):
+        """Use a new wavelength calibration of the outputs.
+
+        :param solution: wavelengths of the columns of the outputs, `None` for the default linear one.
+        :type solution: WavelengthSolution
+        """
+        previous = self.wavelength_solution
+        self.wavelength_solution = solution
+        try:
+            self.set_layout(self.roi_layout)
+        except ValueError:
+            self.wavelength_solution = previous
+            raise
+
+    def fit_trace_profiles(self):
+        """Measure the spatial profiles of the outputs on ``img_data`` for the optimal extraction.
+
+        All the outputs must be illuminated and the dark subtracted.
+
+        :return: profiles of shape (outputs, rows).
+        :rtype: array
+        """
+        self.trace_profiles = self.spectral_extractor.fit_profiles(self.img_data)
+        self._record_extractor = self.spectral_extractor.copy()
+        return self.trace_profiles
+
+    # =============================================================================
+    # Mirror
+    # =============================================================================
+    def move_mirror(self, force_sync=False, notify=True):
+        """Send ``mems_values`` to the mirror and read back the positions of the moved segments.
+
+        ``mems_values`` keep the commanded positions, so the segments which did not change
+        are not sent again, the read-back positions are in ``mems_positions``.
+        A new command epoch starts once the mirror has been commanded (see ``command_mirror``).
+
+        :param force_sync: send and read back all the segments, defaults to False
+        :type force_sync: bool, optional
+        :param notify: call ``on_move``, defaults to True
+        :type notify: bool, optional
+        :return: tuple of the error-message triggers of the sending and the reading.
+        :rtype: tuple
+        """
+        np.clip(self.mems_values, self.mems_range[0], self.mems_range[1], out=self.mems_values)
+        seg_list, positions, fuse_send, fuse_get_positions = self.command_mirror(self.mems_values, force_sync)
+        if notify and self.on_move is not None:
+            self.on_move(fuse_send, fuse_get_positions)
+        return fuse_send, fuse_get_positions
+
+    def command_mirror(self, mems_values, force_sync=False):
+        """Send given positions to the mirror, e.g. from the worker of the GUI buttons.
+
+        Unlike ``move_mirror``, ``mems_values`` and ``on_move`` are not used.
+        A new command epoch starts once the mirror has been commanded: the frames tagged
+        with the previous epochs are not taken for the new positions.
+
+        :param mems_values: positions (piston, tip, tilt) of all the segments, clipped to ``mems_range``.
+        :type mems_values: array
+        :param force_sync: send and read back all the segments, defaults to False
+        :type force_sync: bool, optional
+        :return: tuple of the moved segments (starting at 1), their read-back positions
+                and the error-message triggers of the sending and the reading.
+        :rtype: tuple
+        """
+        mems_values = np.clip(mems_values, self.mems_range[0], self.mems_range[1])
+        result = self.mems.update_mirror(mems_values, force_sync)
+        self._new_epoch()
+        return result
+
+    def flatten_mirror(self):
+        """Flatten the mirror (all the commands at 0) and read back the positions of all the segments.
+
+        :return: tuple of the error-message triggers of the flattening and the reading.
+        :rtype: tuple
+        """
+        positions, fuse_flatten, fuse_get_positions = self.command_flatten()
+        self.mems_values[:] = 0.
+        if self.on_move is not None:
+            self.on_move(True, fuse_get_positions)
+        return fuse_flatten, fuse_get_positions
+
+    def command_flatten(self):
+        """Flatten the mirror without changing ``mems_values``, see ``command_mirror``.
+
+        :return: tuple of the read-back positions of all the segments and the error-message
+                triggers of the flattening and the reading.
+        :rtype: tuple
+        """
+        fuse_flatten = self.mems.flatten_mirror()
+        self._new_epoch()
+        positions, fuse_get_positions = self.mems.get_positions(np.arange(self.nb_segments) + 1)
+        return positions, fuse_flatten, fuse_get_positions
+
+    def _new_epoch(self):
+        self.command_time = time.time()
+        self.command_epoch += 1
+
+    # =============================================================================
+    # Recording
+    # =============================================================================
+    def start_record(self, save_dir, file_name, *args, **kwargs):
+        """Record every acquired frame with its timestamp and the positions of the mirror.
+
+        The arguments are those of ``FrameRecorder``.
+        With ``record_spectra``, the calibrated spectra of each frame are recorded too.
+        """
+        if self.record_spectra:
+            kwargs.setdefault('wavelengths', self.wavelengths)
+        self.stop_record()
+        recorder = FrameRecorder(save_dir, file_name, *args, **kwargs)
+        recorder.start()
+        self.recorder = recorder
+
+    def stop_record(self):
+        """Stop the recording.
+
+        :return: the stopped recorder, with its statistics, or `None`.
+        :rtype: FrameRecorder
+        """
+        recorder = self.recorder
+        if recorder is None:
+            return None
+        self.recorder = None
+        recorder.stop()
+        return recorder
+
+    def record_frame(self, frame, timestamp):
+        """Queue a frame in the recorder, called from the acquisition thread.
+        """
+        recorder = self.recorder
+        if recorder is None:
+            return
+        spectra = None
+        if self.record_spectra:
+            if self.subtract_dark:
+                np.subtract(frame, self.dark, out=self._record_frame)
+            else:
+                np.copyto(self._record_frame, frame)
+            spectra = self._record_extractor.extract(self._record_frame)
+        recorder.record(frame, self.mems_values, timestamp, spectra)
+
+    # =============================================================================
+    # Scans
+    # =============================================================================
+    def abort(self):
+        """Stop the current dark or scan.
+        """
+        self._aborted = True
+
+    def scheduler(self, scan_wait):
+        """Scheduler of the scans, with the settling parameters of the engine.
+
+        :param scan_wait: settling time of the mirror after each move, in second.
+        :type scan_wait: float
+        :rtype: ScanScheduler
+        """
+        return ScanScheduler(self, scan_wait, self.nb_averaged, self.settle_tolerance, self.settle_frames,
+                             self.scan_timeout)
+
+    @contextlib.contextmanager
+    def scan_acquisition(self):
+        """Run the background acquisition during a scan, if it is not running yet.
+        """
+        own_acquisition = self.acquisition is None
+        if own_acquisition:
+            self.start_acquisition()
+        try:
+            yield
+        finally:
+            if own_acquisition:
+                self.stop_acquisition()
+
+    def measure(self, segments, positions, outputs, scan_wait):
+        """Move segments then measure the fluxes of outputs on the frames of the settled mirror.
+
+        The measured frame, fluxes and null depths are also in the attributes updated by ``refresh``.
+
+        :param segments: segments (starting at 1) to move.
+        :type segments: array
+        :param positions: positions (piston, tip, tilt) given to the segments.
+        :type positions: array
+        :param outputs: outputs (starting at 1) to measure.
+        :type outputs: array
+        :param scan_wait: settling time of the mirror after the move, in second.
+        :type scan_wait: float
+        :return: tuple of the reached positions of the segments and the fluxes of the outputs,
+                `None` if aborted.
+        :rtype: tuple
+        """
+        if self._aborted:
+            return None
+        result = self.scheduler(scan_wait).run(segments, [positions], outputs, keep_frames=True)
+        if result is None:
+            return None
+        reached, fluxes, frames, _ = result
+        np.copyto(self.img_data, frames[0])
+        self.roi_index.extract(self.img_data, self.spectra, self.fluxes)
+        self.spectral_extractor.extract(self.img_data, self.calibrated_spectra)
+        self._update_null_depths()
+        return reached[0], fluxes[0]
+
+    def run_scan(self, spec, scan_wait=0., on_point=None, on_repeat=None):
+        """Run a scan described by a ``ScanSpec`` (see ``ScanExecutor``).
+
+        :param spec: the scan.
+        :type spec: ScanSpec
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        :param on_point: function called with the index of the repetition, the values of the axes
+                        and the fluxes of each measured point, defaults to None
+        :type on_point: callable, optional
+        :param on_repeat: function called with the index of each repetition before it starts, defaults to None
+        :type on_repeat: callable, optional
+        :return: the measurements, `None` if aborted.
+        :rtype: ScanResult
+        """
+        return ScanExecutor(self, scan_wait).run(spec, on_point, on_repeat)
+
+    def scan_tt_grid(self, segments, outputs, ttx, tty, num_loops=1, scan_wait=0., on_loop=None):
+        """Scan the tip/tilt of segments on a grid.
+
+        Several segments are moved together, the injection of each one is read on its own output.
+        The piston of the scanned segments is set to 0.
+
+        :param segments: segments (starting at 1) to scan.
+        :type segments: array
+        :param outputs: output (starting at 1) measuring the injection of each segment.
+        :type outputs: array
+        :param ttx: tips of the grid.
+        :type ttx: array
+        :param tty: tilts of the grid.
+        :type tty: array
+        :param num_loops: number of scans, defaults to 1
+        :type num_loops: int, optional
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        :param on_loop: function called with the index of each scan before it starts, defaults to None
+        :type on_loop: callable, optional
+        :return: TT maps of shape (loops, segments, tips, tilts), `None` if aborted.
+        :rtype: array
+        """
+        segments = np.atleast_1d(segments)
+        outputs = np.atleast_1d(outputs)
+        spec = ScanSpec([Axis.single('tip', segments), Axis.single('tilt', segments)], Grid(ttx, tty),
+                        outputs, num_loops, base=np.zeros((segments.size, 3)), name='tt_grid')
+        result = self.run_scan(spec, scan_wait, on_repeat=on_loop)
+        if result is None:
+            return None
+        return np.reshape(np.transpose(result.fluxes, (0, 2, 1)), (num_loops, outputs.size, len(ttx), len(tty)))
+
+    def search_tt(self, segment, output, bounds, coarse_points=5, num_loops=1, scan_wait=0., on_loop=None):
+        """Coarse-to-fine search of the tip/tilt maximising the injection of a segment.
+
+        A coarse grid is scanned then refined with a Nelder-Mead simplex (see ``search_tt_max``).
+
+        :param segment: segment (starting at 1) to optimise, its piston is set to 0.
+        :type segment: int
+        :param output: output (starting at 1) measuring the injection of the segment.
+        :type output: int
+        :param bounds: minimum and maximum tip and tilt.
+        :type bounds: tuple
+        :param coarse_points: number of points per axis of the coarse grid, defaults to 5
+        :type coarse_points: int, optional
+        :param num_loops: number of searches, the best positions are averaged, defaults to 1
+        :type num_loops: int, optional
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        :param on_loop: function called with the index of each search before it starts, defaults to None
+        :type on_loop: callable, optional
+        :return: tuple of the best (tip, tilt), the measured positions and the measured fluxes,
+                `None` for all of them if aborted or if no flux is valid (the error is in ``scan_errors``).
+        :rtype: tuple
+        """
+        self._aborted = False
+
+        def measure(x, y):
+            result = self.measure([segment], [0, x, y], [output], scan_wait)
+            if result is None:
+                return None
+            return result[0][0, 1], result[0][0, 2], result[1][0]
+
+        best = []
+        positions = []
+        fluxes = []
+        with self.scan_acquisition():
+            for k in range(num_loops):
+                if on_loop is not None:
+                    on_loop(k)
+                try:
+                    coord_max, loop_positions, loop_fluxes = search_tt_max(measure, bounds, coarse_points)
+                except ValueError as e:
+                    self.scan_errors.append(e)
+                    return None, None, None
+                if coord_max is None:
+                    break
+                best.append(coord_max)
+                positions.append(loop_positions)
+                fluxes.append(loop_fluxes)
+
+        if len(best) == 0:
+            return None, None, None
+        return np.mean(best, 0), np.concatenate(positions), np.concatenate(fluxes)
+
+    def scan_null_grid(self, segment, output, scan_range, tt_pos, num_loops=1, scan_wait=0., on_loop=None):
+        """Scan the piston of a segment and measure the flux of a null.
+
+        :param segment: segment (starting at 1) to scan.
+        :type segment: int
+        :param output: output (starting at 1) of the null.
+        :type output: int
+        :param scan_range: pistons of the scan.
+        :type scan_range: array
+        :param tt_pos: tip and tilt of the segment during the scan.
+        :type tt_pos: array
+        :param num_loops: number of scans, defaults to 1
+        :type num_loops: int, optional
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        :param on_loop: function called with the index of each scan before it starts, defaults to None
+        :type on_loop: callable, optional
+        :return: tuple of the reached pistons and the fluxes, of shape (loops, points),
+                the frames of shape (loops, points, rows, columns) and the null depths of all the nulls,
+                of shape (loops, points, nulls, wavelengths) or `None` without nulls in the layout;
+                `None` if aborted.
+        :rtype: tuple
+        """
+        spec = ScanSpec([Axis.single('piston', segment)], Grid(scan_range), [output], num_loops,
+                        base=[[0, *tt_pos]], keep_frames=True, name='null_grid')
+        result = self.run_scan(spec, scan_wait, on_repeat=on_loop)
+        if result is None:
+            return None
+        return result.reached[:, :, 0, 0], result.fluxes[:, :, 0], result.frames, result.null_depths
+
+    def fit_null_scan(self, pistons, null_depths, center=0., per_loop=False, wavelengths=None):
+        """Optimal piston of all the nulls at all the wavelengths, from the null depths of a scan.
+
+        The fringes of all the nulls at all the wavelengths (and of all the loops with ``per_loop``)
+        are fitted at once by linear least squares (see ``fit_fringes``) and their minima are found
+        analytically. The nulls which do not see the scanned segment have no fringe:
+        their minimum is meaningless and its uncertainty is large.
+
+        :param pistons: reached pistons of shape (loops, points), as given by ``scan_null_grid``.
+        :type pistons: array
+        :param null_depths: null depths of shape (loops, points, nulls, wavelengths), as given by ``scan_null_grid``.
+        :type null_depths: array
+        :param center: the closest minimum to this piston is returned, defaults to 0.
+        :type center: float, optional
+        :param per_loop: fit each loop separately instead of all the loops together, defaults to False
+        :type per_loop: bool, optional
+        :param wavelengths: wavelengths of the null depths, defaults to those of the spectra.
+        :type wavelengths: array, optional
+        :return: tuple of the optimal pistons and their uncertainties, of shape (nulls, wavelengths),
+                or (loops, nulls, wavelengths) with ``per_loop``, and the coefficients of the fringes
+                of shape (..., 3).
+        :rtype: tuple
+        """
+        wavelengths = self.wavelengths if wavelengths is None else np.asarray(wavelengths, dtype=float)
+        pistons = np.asarray(pistons, dtype=float)
+        fluxes = np.moveaxis(np.asarray(null_depths, dtype=float), 1, -1)
+        if per_loop:
+            pistons = pistons[:, None, None, :]
+        else:
+            pistons = pistons.reshape(-1)
+            fluxes = np.moveaxis(fluxes, 0, -2).reshape(fluxes.shape[1:-1] + (-1,))
+        coefs, covariance = fit_fringes(pistons, fluxes, wavelengths)
+        return (fringe_minimum(coefs, wavelengths, center), fringe_minimum_error(coefs, covariance, wavelengths),
+                coefs)
+
+    def search_null(self, segment, output, tt_pos, bounds, period=None, num_loops=1, scan_wait=0., on_loop=None):
+        """Adaptive search of the null of a segment.
+
+        Instead of scanning the whole range, the segment is moved to the minimum of
+        the fringe model fitted on the points already measured (see ``search_null``).
+        The points of all the loops are fitted together to give the position of the null.
+
+        :param segment: segment (starting at 1) to scan.
+        :type segment: int
+        :param output: output (starting at 1) of the null.
+        :type output: int
+        :param tt_pos: tip and tilt of the segment during the search.
+        :type tt_pos: array
+        :param bounds: minimum and maximum pistons.
+        :type bounds: tuple
+        :param period: period of the fringe in piston unit, defaults to the effective wavelength
+                    of the output (see ``effective_wavelength``).
+        :type period: float, optional
+        :param num_loops: number of searches, each one starts from the previous null, defaults to 1
+        :type num_loops: int, optional
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        :param on_loop: function called with the index of each search before it starts, defaults to None
+        :type on_loop: callable, optional
+        :return: tuple of the position of the null, the coefficients of the fringe model,
+                the measured pistons and fluxes, the frames of shape (points, rows, columns)
+                and whether all the searches converged; `None` if aborted or if too few fluxes
+                are valid (the error is in ``scan_errors``).
+        :rtype: tuple
+        """
+        self._aborted = False
+        if period is None:
+            period = self.effective_wavelength(output)
+        center = (bounds[0] + bounds[1]) / 2
+        frames = []
+
+        def measure(piston):
+            result = self.measure([segment], [piston, *tt_pos], [output], scan_wait)
+            if result is None:
+                return None
+            # img_data is overwritten at the next refresh
+            frames.append(self.img_data.copy())
+            return result[0][0, 0], result[1][0]
+
+        pistons = []
+        fluxes = []
+        converged = True
+        with self.scan_acquisition():
+            for k in range(num_loops):
+                if on_loop is not None:
+                    on_loop(k)
+                try:
+                    best, positions, loop_fluxes, coefs, loop_converged = \
+                        search_null(measure, center, period, bounds=bounds)
+                except ValueError as e:
+                    self.scan_errors.append(e)
+                    return None
+                pistons += positions
+                fluxes += loop_fluxes
+                if best is None:
+                    return None
+                converged = converged and loop_converged
+                center = best
+
+        pistons = np.array(pistons)
+        fluxes = np.array(fluxes)
+        coefs = fit_fringe(pistons, fluxes, period)
+        best_null_pos = np.clip(fringe_minimum(coefs, period, center), bounds[0], bounds[1])
+        return best_null_pos, coefs, pistons, fluxes, np.array(frames), converged
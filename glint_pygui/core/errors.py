@@ -0,0 +1,37 @@
+def display_error(err_code):
+    """Gather all the hand-made error code which may rise because of MEMS or camera.
+
+    Hand-made error codes to help debugging the software if any issue with the Camera
+    or the MEMS raise.
+    The syntax for the error code for the mirror is MX: M for *mirror* and X the ID of the error.
+
+    Similarly, the syntax for the error code for the camera is CX with C for *Camera*.
+
+    :param err_code: Code of the error.
+    :type err_code: string
+    :return: tuple of messages to return respectively in the history in the GUI and
+            in the terminal.
+    :rtype: tuple
+    """
+    prefix = 'Err '+err_code+': '
+    if err_code == 'M1':
+        history_msg = prefix + 'MEMS connection error'
+        terminal_msg = prefix + 'MEMS initialization failed.'+\
+                        'Restart the GUI and choose to disable HW.'
+    elif err_code == 'M2':
+        history_msg = prefix + 'Flattening failed'
+        terminal_msg = prefix + 'There was an error while'+\
+                        'flattenning the mirror'
+    elif err_code == 'M3':
+        history_msg = prefix + "Error reading position"
+        terminal_msg = prefix + "There was an error reading from the mirror"
+    elif err_code == 'M4':
+        history_msg = prefix + 'Mirror not released'
+        terminal_msg = prefix + 'There was a problem releasing the connection with the mirror'
+    elif err_code == 'M5':
+        history_msg = prefix + 'Error sending positions'
+        terminal_msg = prefix + 'There was a problem sending positions.'
+    else:
+        history_msg = terminal_msg = 'No error code!'
+
+    return (history_msg, terminal_msg)
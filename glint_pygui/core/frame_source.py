@@ -0,0 +1,222 @@
+import os
+import threading
+import numpy as np
+from astropy.io import fits
+
+
+class FrameSource(object):
+    """Give access to the last frame written by the camera.
+
+    A frame is read only if the camera has written a new one since the last read,
+    it is detected from the file status (inode, size and modification time)
+    or from a frame counter written by the camera.
+    The returned frames are views on a memory-mapped file: they must be copied
+    (e.g. in a :class:`~core.acquisition.FrameRingBuffer`) to be kept.
+
+    The daughter classes implement ``_get_stamp`` and ``_get_view``.
+    """
+    def __init__(self, path):
+        """
+        :param path: path to the file written by the camera.
+        :type path: string
+        """
+        self.path = path
+        # Number of different frames seen since the creation of the source
+        self.frame_count = 0
+        self._last_stamp = None
+        self._file_id = None
+        self._lock = threading.Lock()
+
+    def read(self, force=False):
+        """Read the last frame written by the camera.
+
+        :param force: return the frame even if it has already been read, defaults to False
+        :type force: bool, optional
+        :return: view on the frame or `None` if it has not changed since the last read.
+        :rtype: array
+        """
+        with self._lock:
+            stamp = self._get_stamp()
+            if stamp == self._last_stamp and not force:
+                return None
+            frame = self._get_view()
+            if stamp != self._last_stamp:
+                self._last_stamp = stamp
+                self.frame_count += 1
+        return frame
+
+    def close(self):
+        """Release the mapped file.
+        """
+        with self._lock:
+            self._close()
+            self._last_stamp = None
+
+    def settings(self):
+        """Settings of the camera (exposure time, gain...), e.g. to key the master darks.
+
+        :return: settings with JSON-serializable values, `None` if they are unknown.
+        :rtype: dict
+        """
+        return None
+
+    def _file_status(self):
+        """Return the identity of the file and its modification time.
+
+        The file is mapped again if its identity (inode and size) changes.
+        """
+        status = os.stat(self.path)
+        file_id = (status.st_ino, status.st_size)
+        if file_id != self._file_id:
+            self._close()
+            self._file_id = file_id
+        return file_id, status.st_mtime_ns
+
+    def _get_stamp(self):
+        raise NotImplementedError
+
+    def _get_view(self):
+        raise NotImplementedError
+
+    def _close(self):
+        self._file_id = None
+
+
+class FitsFrameSource(FrameSource):
+    """Memory-mapped frames from a FITS file.
+
+    The header is parsed only when the file is replaced, not at every frame.
+    The data are not copied unless the file uses BZERO/BSCALE scaling,
+    the scaled frame is then written in a buffer reused at each read.
+    """
+    # Keywords of the header giving the settings of the camera, the exposure time is required
+    EXPOSURE_KEYWORDS = ('EXPTIME', 'DIT')
+    SETTINGS_KEYWORDS = ('NDIT', 'GAIN', 'DETGAIN', 'READMODE', 'DETMODE', 'FPS', 'BINNING')
+
+    def __init__(self, path, hdu=0):
+        """
+        :param path: path to the FITS file written by the camera.
+        :type path: string
+        :param hdu: index of the HDU containing the frame, defaults to 0
+        :type hdu: int, optional
+        """
+        super(FitsFrameSource, self).__init__(path)
+        self.hdu = hdu
+        self._hdul = None
+        self._buffer = None
+
+    def _get_stamp(self):
+        return self._file_status()
+
+    def _get_view(self):
+        if self._hdul is None:
+            # astropy refuses to memory-map scaled data, the scaling is applied below
+            self._hdul = fits.open(self.path, memmap=True, do_not_scale_image_data=True)
+        hdu = self._hdul[self.hdu]
+        data = hdu.data
+        bscale = hdu.header.get('BSCALE', 1)
+        bzero = hdu.header.get('BZERO', 0)
+        if bscale == 1 and bzero == 32768 and data.dtype.itemsize == 2:
+            # Unsigned 16-bit frames, the usual format of the cameras
+            data = data.view(data.dtype.byteorder + 'u2')
+            return np.bitwise_xor(data, np.uint16(0x8000), out=self._get_buffer(data.shape, data.dtype))
+        if bscale != 1 or bzero != 0:
+            buffer = self._get_buffer(data.shape, np.float32)
+            np.multiply(data, np.float32(bscale), out=buffer)
+            return np.add(buffer, np.float32(bzero), out=buffer)
+        return data
+
+    def settings(self):
+        """Settings of the camera read in the header of the file, see ``SETTINGS_KEYWORDS``.
+
+        :return: settings, `None` if the header has no exposure time or the file cannot be read.
+        :rtype: dict
+        """
+        try:
+            header = fits.getheader(self.path, self.hdu)
+        except (OSError, IndexError) as e:
+            print(e)
+            return None
+        exposure = [header[key] for key in self.EXPOSURE_KEYWORDS if key in header]
+        if len(exposure) == 0:
+            return None
+        settings = {'exposure_time': exposure[0]}
+        for key in self.SETTINGS_KEYWORDS:
+            if key in header:
+                settings[key.lower()] = header[key]
+        return settings
+
+    def _get_buffer(self, shape, dtype):
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != dtype:
+            self._buffer = np.zeros(shape, dtype=dtype)
+        return self._buffer
+
+    def _close(self):
+        if self._hdul is not None:
+            self._hdul.close()
+            self._hdul = None
+        super(FitsFrameSource, self)._close()
+
+
+class RawFrameSource(FrameSource):
+    """Memory-mapped frames from a raw binary file.
+
+    If the camera writes a frame counter in the file, it is used to detect
+    the new frames instead of the modification time of the file.
+    The file has no header: the settings of the camera are given, if known.
+    """
+    def __init__(self, path, shape, dtype, offset=0, counter_offset=None, counter_dtype='<u8',
+                 camera_settings=None):
+        """
+        :param path: path to the binary file written by the camera.
+        :type path: string
+        :param shape: shape of the frame.
+        :type shape: tuple
+        :param dtype: type of the pixels.
+        :type dtype: numpy dtype
+        :param offset: position of the frame in the file in bytes, defaults to 0
+        :type offset: int, optional
+        :param counter_offset: position of the frame counter in the file in bytes,
+                            defaults to None (the modification time of the file is used).
+        :type counter_offset: int, optional
+        :param counter_dtype: type of the frame counter, defaults to '<u8'
+        :type counter_dtype: numpy dtype, optional
+        :param camera_settings: settings of the camera writing the file, defaults to None (unknown)
+        :type camera_settings: dict, optional
+        """
+        super(RawFrameSource, self).__init__(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self.counter_offset = counter_offset
+        self.counter_dtype = np.dtype(counter_dtype)
+        self.camera_settings = camera_settings
+        self._frame = None
+        self._counter = None
+
+    def _map(self):
+        if self._frame is None:
+            self._frame = np.memmap(self.path, dtype=self.dtype, mode='r',
+                                    offset=self.offset, shape=self.shape)
+            if self.counter_offset is not None:
+                self._counter = np.memmap(self.path, dtype=self.counter_dtype, mode='r',
+                                          offset=self.counter_offset, shape=(1,))
+
+    def _get_stamp(self):
+        file_status = self._file_status()
+        if self.counter_offset is None:
+            return file_status
+        self._map()
+        return file_status[0], int(self._counter[0])
+
+    def _get_view(self):
+        self._map()
+        return self._frame
+
+    def settings(self):
+        return None if self.camera_settings is None else dict(self.camera_settings)
+
+    def _close(self):
+        self._frame = None
+        self._counter = None
+        super(RawFrameSource, self)._close()
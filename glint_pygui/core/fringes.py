@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def fit_fringe(positions, fluxes, period):
+    """Fit a fringe of known period on fluxes measured at several positions of a segment.
+
+    The model ``a sin(kx) + b cos(kx) + c``, with ``k = 2 pi / period``,
+    is linear in its coefficients so it is fitted by linear least squares, without initial guess.
+    The points with a NaN flux (e.g. after a timeout) are ignored.
+
+    :param positions: positions (piston) of the segment.
+    :type positions: array
+    :param fluxes: fluxes measured at these positions.
+    :type fluxes: array
+    :param period: period of the fringe in the unit of the positions.
+    :type period: float
+    :return: coefficients (a, b, c) of the model, NaN with less than 3 valid points.
+    :rtype: array
+    """
+    return fit_fringes(positions, fluxes, period)[0]
+
+
+def fit_fringes(positions, fluxes, period):
+    """Fit many fringes of known periods at once, e.g. all the wavelengths, loops and nulls of a scan.
+
+    Each fringe is fitted as in :func:`fit_fringe`: the normal equations of all the fringes
+    are built and solved together, in one batch of 3x3 systems.
+    The points with a NaN flux are ignored. The coefficients of the fringes with less than
+    3 valid points, or whose positions do not constrain the model, are NaN.
+
+    :param positions: positions of shape (..., points), broadcastable to the fluxes,
+                    e.g. the reached pistons of each loop.
+    :type positions: array
+    :param fluxes: fluxes of shape (..., points).
+    :type fluxes: array
+    :param period: period of each fringe, broadcastable to the shape of the fluxes without
+                the points, e.g. the wavelengths.
+    :type period: array or float
+    :return: tuple of the coefficients (a, b, c) of shape (..., 3) and their covariance
+            of shape (..., 3, 3), estimated from the residuals (NaN with 3 valid points).
+    :rtype: tuple
+    """
+    positions = np.asarray(positions, dtype=float)
+    fluxes = np.asarray(fluxes, dtype=float)
+    phases = 2 * np.pi / np.asarray(period, dtype=float)[..., None] * positions
+    shape = np.broadcast_shapes(phases.shape, fluxes.shape)
+    valid = np.broadcast_to(np.isfinite(fluxes) & np.isfinite(phases), shape)
+    design = np.stack(np.broadcast_arrays(np.sin(phases), np.cos(phases), np.ones(shape)), -1)
+    design = np.where(valid[..., None], design, 0.)
+    fluxes = np.where(valid, fluxes, 0.)
+
+    normal = np.matmul(np.swapaxes(design, -1, -2), design)
+    nb_points = valid.sum(-1)
+    # Relative determinant: the scale of the positions does not matter
+    scale = np.maximum(np.einsum('...ii->...', normal), np.finfo(float).tiny)
+    solvable = (nb_points >= 3) & (np.linalg.det(normal) > 1e-10 * (scale / 3)**3)
+    inverse = np.linalg.inv(np.where(solvable[..., None, None], normal, np.eye(3)))
+    coefs = np.matmul(inverse, np.matmul(fluxes[..., None, :], design)[..., 0, :, None])[..., 0]
+
+    residuals = fluxes - np.matmul(design, coefs[..., None])[..., 0]
+    nb_freedom = nb_points - 3
+    variance = np.sum(residuals**2, -1) / np.maximum(nb_freedom, 1)
+    variance = np.where(nb_freedom > 0, variance, np.nan)
+    covariance = variance[..., None, None] * inverse
+    coefs[~solvable] = np.nan
+    covariance[~solvable] = np.nan
+    return coefs, covariance
+
+
+def fringe_model(positions, coefs, period):
+    """Evaluate the fringe model fitted with :func:`fit_fringe`.
+    """
+    k = 2 * np.pi / period
+    positions = np.asarray(positions, dtype=float)
+    coefs = np.asarray(coefs, dtype=float)
+    return coefs[..., 0] * np.sin(k * positions) + coefs[..., 1] * np.cos(k * positions) + coefs[..., 2]
+
+
+def fringe_minimum(coefs, period, center=0.):
+    """Position of the minimum of the fringe model which is the closest to ``center``.
+
+    :param coefs: coefficients (a, b, c) given by :func:`fit_fringe`, or of shape (..., 3)
+                given by :func:`fit_fringes`.
+    :type coefs: array
+    :param period: period of the fringe in the unit of the positions, broadcastable to the coefficients.
+    :type period: float or array
+    :param center: the closest minimum to this position is returned, defaults to 0.
+    :type center: float or array, optional
+    :rtype: float or array
+    """
+    coefs = np.asarray(coefs, dtype=float)
+    # a sin(kx) + b cos(kx) = A sin(kx + phase) is minimum for kx + phase = -pi/2
+    phase = np.arctan2(coefs[..., 1], coefs[..., 0])
+    x_min = (-np.pi / 2 - phase) * period / (2 * np.pi)
+    return x_min + period * np.round((center - x_min) / period)
+
+
+def fringe_minimum_error(coefs, covariance, period):
+    """Uncertainty on the position of the minimum of the fringe model.
+
+    The variance of the phase ``arctan2(b, a)`` is propagated from the covariance of (a, b).
+
+    :param coefs: coefficients of shape (..., 3) given by :func:`fit_fringes`.
+    :type coefs: array
+    :param covariance: covariance of shape (..., 3, 3) given by :func:`fit_fringes`.
+    :type covariance: array
+    :param period: period of the fringe in the unit of the positions, broadcastable to the coefficients.
+    :type period: float or array
+    :return: standard deviation of the position of the minimum.
+    :rtype: float or array
+    """
+    coefs = np.asarray(coefs, dtype=float)
+    a, b = coefs[..., 0], coefs[..., 1]
+    gradient = np.stack([-b, a], -1) / (a**2 + b**2)[..., None]
+    variance = np.einsum('...i,...ij,...j->...', gradient, np.asarray(covariance)[..., :2, :2], gradient)
+    return np.asarray(period) / (2 * np.pi) * np.sqrt(np.maximum(variance, 0.))
@@ -0,0 +1,144 @@
+import json
+import numpy as np
+from scipy.signal import find_peaks
+from .rois import RoiIndex
+
+# Names of the outputs, ordered by increasing row on the detector
+OUTPUT_NAMES = ['P4', 'N3', 'P3', 'N2', 'N10', 'N5', 'N4', 'N11',
+                'N6', 'N7', 'N12', 'N1', 'N8', 'P2', 'N9', 'P1']
+# (x, y, width, height) of the outputs in pixels
+OUTPUT_RECTS = [[35, 26, 61, 15], [35, 46, 61, 15], [35, 66, 61, 15], [35, 85, 61, 15],
+                [35, 105, 61, 15], [35, 125, 61, 15], [35, 145, 61, 15], [35, 165, 61, 15],
+                [35, 184, 61, 15], [35, 204, 61, 15], [35, 224, 61, 15], [35, 244, 61, 15],
+                [35, 263, 61, 15], [35, 283, 61, 15], [35, 303, 61, 15], [35, 323, 61, 15]]
+# Output (starting at 1) where the injection of each segment is measured, by beam
+SEGMENT_OUTPUTS = {29: 16, 35: 14, 26: 3, 24: 1}
+# Output (starting at 1) of each null
+NULL_OUTPUTS = {1: 12, 2: 4, 3: 2, 4: 7, 5: 6, 6: 9}
+# Segment of the mirror feeding each beam (1 to 4), the photometric output of beam k is Pk
+BEAM_SEGMENTS = list(SEGMENT_OUTPUTS)
+# Beams (starting at 1) interfering in each null, the antinull of Nk is N(k+6)
+NULL_BEAMS = {1: (1, 2), 2: (2, 3), 3: (1, 4), 4: (3, 4), 5: (1, 3), 6: (2, 4)}
+
+
+class RoiLayout(object):
+    """Geometry of the outputs on the detector.
+
+    It gathers the rectangles of the outputs and the tables giving which output
+    is read to optimise a segment or a null.
+    The layout is saved in and loaded from a JSON file so that a re-alignment
+    of the chip does not require to edit the code.
+    """
+    def __init__(self, rects=None, names=None, segment_outputs=None, null_outputs=None):
+        """
+        :param rects: list of (x, y, width, height) of the outputs, defaults to ``OUTPUT_RECTS``.
+        :type rects: list, optional
+        :param names: names of the outputs, defaults to ``OUTPUT_NAMES``.
+        :type names: list, optional
+        :param segment_outputs: output measuring the injection of each segment, the segments
+                                being ordered by beam, defaults to ``SEGMENT_OUTPUTS``.
+        :type segment_outputs: dict, optional
+        :param null_outputs: output of each null, defaults to ``NULL_OUTPUTS``.
+        :type null_outputs: dict, optional
+        """
+        self.rects = [list(elt) for elt in (OUTPUT_RECTS if rects is None else rects)]
+        self.names = list(OUTPUT_NAMES if names is None else names)
+        self.segment_outputs = dict(SEGMENT_OUTPUTS if segment_outputs is None else segment_outputs)
+        self.null_outputs = dict(NULL_OUTPUTS if null_outputs is None else null_outputs)
+        if len(self.rects) != len(self.names):
+            raise ValueError('%s outputs but %s names' % (len(self.rects), len(self.names)))
+
+    @property
+    def beam_segments(self):
+        """Segments feeding the beams 1 to 4.
+        """
+        return list(self.segment_outputs)
+
+    @classmethod
+    def load(cls, path):
+        """Load a layout from a JSON file.
+
+        :param path: path to the file.
+        :type path: string
+        :return: the layout.
+        :rtype: RoiLayout
+        """
+        with open(path, 'r') as f:
+            config = json.load(f)
+        outputs = config['outputs']
+        rects = [[elt['x'], elt['y'], elt['width'], elt['height']] for elt in outputs]
+        names = [elt['name'] for elt in outputs]
+        # JSON keys are strings
+        segment_outputs = {int(k): v for k, v in config.get('segment_outputs', SEGMENT_OUTPUTS).items()}
+        null_outputs = {int(k): v for k, v in config.get('null_outputs', NULL_OUTPUTS).items()}
+        return cls(rects, names, segment_outputs, null_outputs)
+
+    def save(self, path):
+        """Save the layout in a JSON file.
+
+        :param path: path to the file.
+        :type path: string
+        """
+        config = {'outputs': [{'name': name, 'x': int(rect[0]), 'y': int(rect[1]),
+                               'width': int(rect[2]), 'height': int(rect[3])}
+                              for name, rect in zip(self.names, self.rects)],
+                  'segment_outputs': self.segment_outputs,
+                  'null_outputs': self.null_outputs}
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=4)
+
+    def compile(self, frame_shape, bad_pixels=None):
+        """Build the extraction index of the outputs.
+
+        :param frame_shape: shape (rows, columns) of the frames.
+        :type frame_shape: tuple
+        :param bad_pixels: mask of the pixels to ignore, defaults to None
+        :type bad_pixels: array of bool, optional
+        :rtype: RoiIndex
+        """
+        return RoiIndex(self.rects, frame_shape, bad_pixels)
+
+    def fit(self, frame, height=None, min_separation=None, threshold=0.1):
+        """Fit the position of the outputs on a bright reference frame.
+
+        The traces are dispersed along the columns:
+        the rows of the outputs are the highest peaks of the row profile of the frame and
+        the spectral extent is where the column profile is above ``threshold`` times its maximum.
+        The outputs keep their names, ordered by increasing row.
+
+        :param frame: dark-subtracted frame with all outputs illuminated.
+        :type frame: array
+        :param height: height of the outputs in pixels, defaults to the current one.
+        :type height: int, optional
+        :param min_separation: minimum distance between two outputs in pixels,
+                            defaults to ``height``.
+        :type min_separation: int, optional
+        :param threshold: relative level defining the spectral extent, defaults to 0.1
+        :type threshold: float, optional
+        :return: the fitted layout.
+        :rtype: RoiLayout
+        """
+        nb_outputs = len(self.names)
+        if height is None:
+            height = int(max(elt[3] for elt in self.rects))
+        if min_separation is None:
+            min_separation = height
+
+        frame = np.asarray(frame, dtype=float)
+        row_profile = frame.sum(1)
+        row_profile -= np.median(row_profile)
+        peaks, properties = find_peaks(row_profile, distance=min_separation, prominence=0)
+        if peaks.size < nb_outputs:
+            raise ValueError('Only %s outputs found instead of %s' % (peaks.size, nb_outputs))
+        peaks = np.sort(peaks[np.argsort(properties['prominences'])[-nb_outputs:]])
+
+        # Columns of the brightest rows only, to get rid of the background
+        rows = np.clip(peaks[:, None] + np.arange(-(height // 2), height - height // 2),
+                       0, frame.shape[0] - 1)
+        col_profile = frame[rows.ravel()].sum(0)
+        col_profile -= np.median(col_profile)
+        lit = np.where(col_profile >= threshold * col_profile.max())[0]
+        x_min, x_max = lit[0], lit[-1] + 1
+
+        rects = [[int(x_min), int(peak - height // 2), int(x_max - x_min), int(height)] for peak in peaks]
+        return RoiLayout(rects, self.names, self.segment_outputs, self.null_outputs)
@@ -0,0 +1,149 @@
+import threading
+import numpy as np
+from .errors import display_error
+
+
+class MemsControl(object):
+    """Control the MEMS
+
+    This class regroups command to send command to the mirror and receive its feedback.
+
+    It keeps a shadow of the last commanded position of each segment (``shadow``, NaN if unknown)
+    so that ``update_mirror`` sends and reads back only the segments which changed.
+    The read-back positions, which never exactly equal the commands, are kept apart
+    in ``positions`` (NaN until read) for the display.
+    """
+    def __init__(self, api, mirror_handle, nb_segments):
+        """
+        :param api: IrisAO python API (module ``IrisAO_PythonAPI``) or an object
+                    with the same functions, like ``SimulatedIrisAO``.
+        :type api: module
+        :param mirror_handle: object containing the features to communicate with the mirror
+        :type mirror_handle: long
+        :param nb_segments: number of segments of the mirror.
+        :type nb_segments: int
+        """
+        self.api = api
+        self.mirror = mirror_handle
+        self.shadow = np.full((nb_segments, 3), np.nan)
+        self.positions = np.full((nb_segments, 3), np.nan)
+        # The mirror is driven from the GUI thread (scans) and from the worker (buttons)
+        self.lock = threading.RLock()
+
+    def flatten_mirror(self):
+        """Flatten the mirror
+        """
+        print( "*** Flatten the mirror")
+        with self.lock:
+            try:
+                self.api.MirrorCommand(self.mirror, self.api.MirrorInitSettings)
+                fuse_flatten = True
+            except Exception as e:
+                print(e)
+                print(display_error('M2')[1])
+                fuse_flatten = False
+            # A flat mirror is commanded at 0, its positions are known again only once they are read back
+            self.shadow[:] = 0. if fuse_flatten else np.nan
+            self.positions[:] = np.nan
+        return fuse_flatten
+
+    def send_command(self, segment_list, pos_list):
+        """Send a list of positions to the mirror
+
+        Send a command to move a list of segments to a given position (piston, tip and tilt).
+
+        The positions are sent in one batch through the array API of the IrisAO library.
+
+        :param segment_list: list or array of segments to move. Segment ID starst at 1.
+        :type segment_list: list
+        :param pos_list: list of list/tuple or array of shape (segments, 3) of piston/tip/tilt in um/mrad/mrad.
+        :type pos_list: list
+        :return: if `False`, triggers an error message depending on the success of sending the command.
+        :rtype: bool
+        """
+        segments = np.asarray(segment_list, dtype=int) - 1
+        with self.lock:
+            try:
+                self.api.SetMirrorPositionArray(self.mirror, segment_list, pos_list)
+                self.api.MirrorCommand(self.mirror, self.api.MirrorSendSettings)
+                self.shadow[segments] = pos_list
+                fuse_send = True
+            except Exception as e:
+                print(e)
+                print(display_error('M5')[1])
+                fuse_send = False
+                # The state of these segments is unknown, they will be sent again
+                self.shadow[segments] = np.nan
+
+        return fuse_send
+
+
+    def get_positions(self, segments_list):
+        """Get positions of a list of segments
+
+        They are also kept in ``positions``, the shadow of the commands is not changed.
+
+        :param segments_list: list or array of segments one wants to know the position.
+        :type segments_list: list
+        :return: tuple of the array of positions (piston/tip/tilt) of shape (segments, 3)
+                and the error-message trigger.
+        :rtype: tuple
+        """
+        with self.lock:
+            try:
+                positions, locked, reachable = \
+                    self.api.GetMirrorPositionArray(self.mirror, segments_list)
+                self.positions[np.asarray(segments_list, dtype=int) - 1] = positions
+                fuse_get_positions = True
+            except Exception as e:
+                print(e)
+                print(display_error('M3')[1])
+                positions = np.zeros((np.size(segments_list), 3))
+                fuse_get_positions = False
+
+        return positions, fuse_get_positions
+
+    def update_mirror(self, mems_values, force_sync=False):
+        """Move the mirror to the positions of all the segments, sending only the changed ones.
+
+        The segments whose position differs from the last command (the shadow) are sent
+        and read back in one batch, so moving one segment during a scan costs the same
+        whatever the size of the mirror.
+
+        :param mems_values: positions (piston, tip, tilt) of all the segments, shape (segments, 3).
+        :type mems_values: array
+        :param force_sync: send and read back all the segments, defaults to False
+        :type force_sync: bool, optional
+        :return: tuple of the moved segments (starting at 1), their read-back positions
+                and the error-message triggers of the sending and the reading.
+        :rtype: tuple
+        """
+        with self.lock:
+            if force_sync:
+                changed = np.arange(self.shadow.shape[0])
+            else:
+                # NaN in the shadow always compares as changed
+                changed = np.where(np.any(mems_values != self.shadow, axis=1))[0]
+            seg_list = changed + 1
+            if seg_list.size == 0:
+                return seg_list, self.positions[changed], True, True
+
+            fuse_send = self.send_command(seg_list, mems_values[changed])
+            positions, fuse_get_positions = self.get_positions(seg_list)
+        return seg_list, positions, fuse_send, fuse_get_positions
+
+    def release_mirror(self):
+        """Terminate connection with the mirror.
+
+        :return: equal to 0 if the termination is successfull, it throws an error otherwise.
+        :rtype: int
+        """
+        try:
+            released = self.api.MirrorRelease(self.mirror)
+            print("*** Mirror released")
+        except Exception as e:
+            print(e)
+            print(display_error('M4')[1])
+            released = self.mirror
+        
+        return released
@@ -0,0 +1,247 @@
+import numpy as np
+from .layout import NULL_BEAMS
+
+
+class NullDepthEstimator(object):
+    """Spectrally resolved null depths of all the nulls, from the spectra of the outputs.
+
+    The null Nk combines the beams a and b of ``NULL_BEAMS[k]``, its antinull is N(k+6)
+    and the beam a is measured on the photometric output Pa.
+    The flux of the null at constructive interference, given by the photometric outputs, is::
+
+        peak = (sqrt(kappa_a * Pa) + sqrt(kappa_b * Pb))**2
+
+    where kappa_a is the ratio of the flux of the beam a in the null to that in its photometric
+    output (see ``measure_coupling``). The null depth is ``Nk / peak``.
+    The antinull ratio ``Nk / (Nk + N(k+6))`` does not need the photometry.
+
+    Where the peak is not above ``snr`` times its noise (propagated from the noise of the
+    photometric spectra, see ``set_noise``), e.g. in the faint spectral channels, the null depth is NaN.
+
+    All the nulls and all the wavelengths are computed together, with array operations,
+    for a frame (outputs, wavelengths) or any stack of frames (..., outputs, wavelengths).
+    """
+    def __init__(self, names, null_beams=None, coupling=None, noise=None, snr=5.):
+        """
+        :param names: names of the outputs, as ``RoiLayout.names``.
+        :type names: list
+        :param null_beams: beams (starting at 1) of each null, defaults to ``NULL_BEAMS``.
+        :type null_beams: dict, optional
+        :param coupling: coupling coefficients of shape (nulls, 2) or (nulls, 2, wavelengths), defaults to 1.
+        :type coupling: array, optional
+        :param noise: standard deviation of the spectra of shape (outputs, wavelengths),
+                    e.g. ``SpectralExtractor.spectral_noise``, defaults to None
+        :type noise: array, optional
+        :param snr: smallest ratio of the peak to its noise giving a null depth, defaults to 5.
+        :type snr: float, optional
+        """
+        null_beams = NULL_BEAMS if null_beams is None else null_beams
+        self.null_ids = sorted(null_beams)
+        names = list(names)
+        missing = [elt for elt in ['N%s' % k for k in self.null_ids] + ['N%s' % (k + 6) for k in self.null_ids] +
+                   ['P%s' % b for k in self.null_ids for b in null_beams[k]] if elt not in names]
+        if missing:
+            raise ValueError('No output %s' % ', '.join(sorted(set(missing))))
+        self._nulls = np.array([names.index('N%s' % k) for k in self.null_ids])
+        self._antinulls = np.array([names.index('N%s' % (k + 6)) for k in self.null_ids])
+        self._photometric = np.array([[names.index('P%s' % b) for b in null_beams[k]] for k in self.null_ids])
+        self.null_beams = {k: tuple(null_beams[k]) for k in self.null_ids}
+        self.coupling = None
+        self.noise = None
+        self.snr = snr
+        self._buffers = {}
+        self.set_coupling(coupling)
+        self.set_noise(noise)
+
+    @property
+    def nb_nulls(self):
+        return len(self.null_ids)
+
+    def set_coupling(self, coupling=None):
+        """Set the coupling coefficients of the beams in the nulls.
+
+        :param coupling: coefficients of shape (nulls, 2) or (nulls, 2, wavelengths), `None` for 1.
+        :type coupling: array, optional
+        """
+        if coupling is None:
+            coupling = np.ones((self.nb_nulls, 2))
+        coupling = np.asarray(coupling, dtype=float)
+        if coupling.ndim == 2:
+            coupling = coupling[:, :, None]
+        self.coupling = coupling
+        self._update_min_peak()
+
+    def set_noise(self, noise=None):
+        """Set the noise of the spectra, which gives the smallest valid peaks.
+
+        :param noise: standard deviation of the spectra of shape (outputs, wavelengths),
+                    `None` to only reject the peaks not above 0.
+        :type noise: array, optional
+        """
+        self.noise = None if noise is None else np.asarray(noise, dtype=float)
+        self._update_min_peak()
+
+    def _update_min_peak(self):
+        """Smallest valid peaks: ``snr`` times their noise.
+
+        For balanced beams, ``peak ~ 2 (kappa_a Pa + kappa_b Pb)`` so its noise is
+        ``2 sqrt((kappa_a sigma_a)**2 + (kappa_b sigma_b)**2)``.
+        """
+        noise = getattr(self, 'noise', None)
+        if self.coupling is None or noise is None:
+            self.min_peak = np.zeros((len(self.null_ids), 1))
+            self.min_broadband_peak = np.zeros(len(self.null_ids))
+            return
+        sigma = 2 * np.sqrt(np.sum((self.coupling * noise[self._photometric])**2, 1))
+        self.min_peak = self.snr * sigma
+        self.min_broadband_peak = self.snr * np.sqrt(np.sum(sigma**2, -1))
+
+    def measure_coupling(self, spectra, beam):
+        """Coupling coefficients of a beam from the spectra of this beam alone.
+
+        The coefficients of the nulls of the beam are updated, those of the other beams are kept.
+
+        :param spectra: spectra (outputs, wavelengths) measured with only ``beam`` injected, e.g. averaged.
+        :type spectra: array
+        :param beam: injected beam (starting at 1).
+        :type beam: int
+        :return: coupling coefficients of shape (nulls, 2, wavelengths).
+        :rtype: array
+        """
+        spectra = np.asarray(spectra, dtype=float)
+        coupling = np.array(np.broadcast_to(self.coupling, (self.nb_nulls, 2, spectra.shape[-1])))
+        photometric = spectra[self._photometric]
+        nulls = spectra[self._nulls]
+        for k, null in enumerate(self.null_ids):
+            beams = self.null_beams[null]
+            if beam in beams:
+                side = beams.index(beam)
+                coupling[k, side] = np.divide(nulls[k], photometric[k, side], out=np.ones_like(nulls[k]),
+                                              where=photometric[k, side] > 0)
+        self.coupling = coupling
+        self._update_min_peak()
+        return coupling
+
+    def _buffer(self, name, shape, dtype):
+        """Work array reused while the shape and the type of the spectra do not change.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    @staticmethod
+    def _dtype(spectra):
+        return spectra.dtype if spectra.dtype.kind == 'f' else np.dtype(float)
+
+    def peaks(self, spectra, out=None):
+        """Flux of the nulls at constructive interference, from the photometric outputs.
+
+        :param spectra: spectra of shape (..., outputs, wavelengths).
+        :type spectra: array
+        :param out: array of shape (..., nulls, wavelengths) in which the peaks are written, defaults to None
+        :type out: array, optional
+        :return: peaks of shape (..., nulls, wavelengths).
+        :rtype: array
+        """
+        spectra = np.asarray(spectra)
+        dtype = self._dtype(spectra)
+        leading, nb_wavelengths = spectra.shape[:-2], spectra.shape[-1]
+        # Beams before nulls, so that the two halves added are contiguous
+        photometric = self._buffer('photometric', leading + (2, self.nb_nulls, nb_wavelengths), dtype)
+        coupling = self._buffer('coupling', (2, self.nb_nulls, nb_wavelengths), dtype)
+        np.copyto(coupling, self.coupling.transpose(1, 0, 2), casting='unsafe')
+        if out is None:
+            out = np.zeros(leading + (self.nb_nulls, nb_wavelengths), dtype=dtype)
+
+        np.take(spectra, self._photometric.T, axis=-2, out=photometric, mode='clip')
+        np.multiply(photometric, coupling, out=photometric)
+        np.maximum(photometric, 0, out=photometric)
+        np.sqrt(photometric, out=photometric)
+        np.add(photometric[..., 0, :, :], photometric[..., 1, :, :], out=out)
+        return np.square(out, out=out)
+
+    def compute(self, spectra, depths=None, peaks=None):
+        """Null depths of all the nulls at all the wavelengths.
+
+        Nothing is allocated when the output arrays are given, e.g. for each frame.
+
+        :param spectra: spectra of shape (..., outputs, wavelengths).
+        :type spectra: array
+        :param depths: array of shape (..., nulls, wavelengths) in which the null depths are written, defaults to None
+        :type depths: array, optional
+        :param peaks: array of shape (..., nulls, wavelengths) in which the peaks are written, defaults to None
+        :type peaks: array, optional
+        :return: tuple of the null depths and the peaks, of shape (..., nulls, wavelengths).
+                The null depth is NaN where the peak is not above its noise (see ``set_noise``).
+        :rtype: tuple
+        """
+        spectra = np.asarray(spectra)
+        peaks = self.peaks(spectra, peaks)
+        nulls = self._buffer('nulls', peaks.shape, peaks.dtype)
+        valid = self._buffer('valid', peaks.shape, bool)
+        min_peak = self._buffer('min_peak', peaks.shape[-2:], peaks.dtype)
+        np.copyto(min_peak, self.min_peak, casting='unsafe')
+        np.take(spectra, self._nulls, axis=-2, out=nulls, mode='clip')
+        if depths is None:
+            depths = np.zeros(peaks.shape, dtype=peaks.dtype)
+        depths.fill(np.nan)
+        np.greater(peaks, min_peak, out=valid)
+        with np.errstate(over='ignore'):
+            np.divide(nulls, peaks, out=depths, where=valid)
+        self._reject_infinite(depths, valid)
+        return depths, peaks
+
+    @staticmethod
+    def _reject_infinite(values, mask):
+        """Replace the infinite values by NaN, ``mask`` is a work array.
+        """
+        np.isinf(values, out=mask)
+        np.copyto(values, np.nan, where=mask)
+
+    def broadband(self, spectra, out=None):
+        """Null depths integrated over the wavelengths.
+
+        :param spectra: spectra of shape (..., outputs, wavelengths).
+        :type spectra: array
+        :param out: array of shape (..., nulls) in which the null depths are written, defaults to None
+        :type out: array, optional
+        :return: null depths of shape (..., nulls), NaN where the peak is not above its noise.
+        :rtype: array
+        """
+        spectra = np.asarray(spectra)
+        peaks = self.peaks(spectra, self._buffer('broadband_peaks', spectra.shape[:-2] + (self.nb_nulls, spectra.shape[-1]),
+                                                 self._dtype(spectra)))
+        nulls = self._buffer('nulls', peaks.shape, peaks.dtype)
+        np.take(spectra, self._nulls, axis=-2, out=nulls, mode='clip')
+        total_nulls = self._buffer('total_nulls', peaks.shape[:-1], peaks.dtype)
+        total_peaks = self._buffer('total_peaks', peaks.shape[:-1], peaks.dtype)
+        positive = self._buffer('total_positive', peaks.shape[:-1], bool)
+        np.sum(nulls, -1, out=total_nulls)
+        np.sum(peaks, -1, out=total_peaks)
+        if out is None:
+            out = np.zeros(peaks.shape[:-1], dtype=peaks.dtype)
+        min_peak = self._buffer('min_broadband_peak', peaks.shape[-2:-1], peaks.dtype)
+        np.copyto(min_peak, self.min_broadband_peak, casting='unsafe')
+        out.fill(np.nan)
+        np.greater(total_peaks, min_peak, out=positive)
+        with np.errstate(over='ignore'):
+            np.divide(total_nulls, total_peaks, out=out, where=positive)
+        self._reject_infinite(out, positive)
+        return out
+
+    def antinull_ratio(self, spectra):
+        """Ratio of the flux of the nulls to the sum of the null and the antinull.
+
+        :param spectra: spectra of shape (..., outputs, wavelengths).
+        :type spectra: array
+        :return: ratios of shape (..., nulls, wavelengths).
+        :rtype: array
+        """
+        spectra = np.asarray(spectra)
+        nulls = np.take(spectra, self._nulls, axis=-2)
+        total = nulls + np.take(spectra, self._antinulls, axis=-2)
+        ratios = np.full(total.shape, np.nan, dtype=total.dtype)
+        np.divide(nulls, total, out=ratios, where=total > 0)
+        return ratios
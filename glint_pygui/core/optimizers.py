@@ -0,0 +1,141 @@
+import numpy as np
+from scipy.optimize import minimize
+from .fringes import fit_fringe, fringe_minimum
+
+
+class _SearchAborted(Exception):
+    pass
+
+
+def search_null(measure, center, period, nb_initial=4, tol=0.01, max_moves=15, bounds=None):
+    """Converge on the minimum of a fringe with as few moves of the segment as possible.
+
+    The fringe is first sampled with ``nb_initial`` points over one period around ``center``.
+    Then the fringe model is fitted on all the measured points and the segment is moved
+    to the predicted minimum, until the prediction moves by less than ``tol``.
+
+    :param measure: function moving the segment to a position and returning the tuple of
+                    the position actually reached and the measured flux,
+                    or `None` to abort the search.
+    :type measure: callable
+    :param center: position around which the null is searched.
+    :type center: float
+    :param period: period of the fringe in the unit of the positions.
+    :type period: float
+    :param nb_initial: number of points sampling the first period, at least 3, defaults to 4
+    :type nb_initial: int, optional
+    :param tol: convergence tolerance on the position of the null, defaults to 0.01
+    :type tol: float, optional
+    :param max_moves: maximum number of moves of the segment, defaults to 15
+    :type max_moves: int, optional
+    :param bounds: (min, max) positions of the segment, defaults to None
+    :type bounds: tuple, optional
+    :return: tuple of the position of the null (`None` if aborted), the measured positions,
+            the measured fluxes, the coefficients of the fringe model and
+            whether the search converged.
+    :rtype: tuple
+    :raises ValueError: if too few fluxes are valid (not NaN) to fit the fringe.
+    """
+    positions = []
+    fluxes = []
+    coefs = None
+    initial = center + period * (np.arange(nb_initial) / nb_initial - 0.5)
+    if bounds is not None:
+        initial = np.clip(initial, *bounds)
+
+    for x in initial:
+        result = measure(x)
+        if result is None:
+            return None, positions, fluxes, coefs, False
+        positions.append(result[0])
+        fluxes.append(result[1])
+
+    best = None
+    converged = False
+    while len(positions) < max_moves:
+        coefs = _fit_valid_fringe(positions, fluxes, period)
+        estimate = fringe_minimum(coefs, period, center)
+        if bounds is not None:
+            estimate = np.clip(estimate, *bounds)
+        if best is not None and abs(estimate - best) < tol:
+            converged = True
+            break
+        best = estimate
+        result = measure(best)
+        if result is None:
+            return None, positions, fluxes, coefs, False
+        positions.append(result[0])
+        fluxes.append(result[1])
+
+    coefs = _fit_valid_fringe(positions, fluxes, period)
+    best = fringe_minimum(coefs, period, center)
+    if bounds is not None:
+        best = np.clip(best, *bounds)
+    return best, positions, fluxes, coefs, converged
+
+
+def _fit_valid_fringe(positions, fluxes, period):
+    """Fit the fringe on the valid fluxes, raise a ValueError if there are too few.
+    """
+    coefs = fit_fringe(positions, fluxes, period)
+    if np.any(np.isnan(coefs)):
+        raise ValueError('Only %s valid fluxes out of %s, the fringe cannot be fitted' %
+                         (np.sum(np.isfinite(fluxes)), len(fluxes)))
+    return coefs
+
+
+def search_tt_max(measure, bounds, coarse_points=5, xatol=0.05, max_moves=60):
+    """Find the tip/tilt of a segment maximising the injected flux with few moves.
+
+    A coarse grid of ``coarse_points`` x ``coarse_points`` positions is scanned first,
+    then the best point is refined with a Nelder-Mead simplex whose initial size
+    is half the step of the coarse grid.
+
+    :param measure: function moving the segment to a (tip, tilt) position and returning the tuple of
+                    the tip and tilt actually reached and the measured flux,
+                    or `None` to abort the search.
+    :type measure: callable
+    :param bounds: (min, max) of the tip and tilt.
+    :type bounds: tuple
+    :param coarse_points: number of points per axis of the coarse grid, defaults to 5
+    :type coarse_points: int, optional
+    :param xatol: convergence tolerance on the tip and tilt, defaults to 0.05
+    :type xatol: float, optional
+    :param max_moves: maximum number of moves of the segment, defaults to 60
+    :type max_moves: int, optional
+    :return: tuple of the best (tip, tilt) (`None` if aborted),
+            the measured positions of shape (moves, 2) and the measured fluxes.
+    :rtype: tuple
+    :raises ValueError: if no flux of the coarse grid is valid (not NaN).
+    """
+    positions = []
+    fluxes = []
+
+    def flux_at(point):
+        point = np.clip(point, *bounds)
+        result = measure(*point)
+        if result is None:
+            raise _SearchAborted
+        positions.append(result[:2])
+        fluxes.append(result[2])
+        return result[2]
+
+    grid = np.linspace(bounds[0], bounds[1], coarse_points)
+    coarse_step = grid[1] - grid[0]
+    try:
+        for x in grid:
+            for y in grid:
+                flux_at((x, y))
+        if not np.any(np.isfinite(fluxes)):
+            raise ValueError('No valid flux on the coarse grid')
+        start = np.array(positions[int(np.nanargmax(fluxes))], dtype=float)
+        simplex = np.array([start, start + [coarse_step / 2, 0], start + [0, coarse_step / 2]])
+        # Only the tolerance on the position stops the simplex, the flux unit is unknown.
+        # A point without valid flux is the worst one.
+        result = minimize(lambda point: np.nan_to_num(-flux_at(point), nan=np.inf), start, method='Nelder-Mead',
+                          options={'xatol': xatol, 'fatol': np.inf, 'initial_simplex': simplex,
+                                   'maxfev': max(1, max_moves - len(positions))})
+    except _SearchAborted:
+        return None, np.array(positions), np.array(fluxes)
+
+    return np.clip(result.x, *bounds), np.array(positions), np.array(fluxes)
@@ -0,0 +1,133 @@
+import collections
+
+
+def int_parser(minimum=None, maximum=None):
+    """Parser of an integer field, optionally bounded.
+
+    :param minimum: smallest accepted value, defaults to None
+    :type minimum: int, optional
+    :param maximum: largest accepted value, defaults to None
+    :type maximum: int, optional
+    :return: function converting a text into an integer, raising ``ValueError`` if invalid.
+    :rtype: callable
+    """
+    def parse(text):
+        value = int(text)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError('%s is out of [%s, %s]' % (value, minimum, maximum))
+        return value
+    return parse
+
+
+def float_parser(minimum=None, maximum=None):
+    """Parser of a float field, optionally bounded.
+
+    :param minimum: smallest accepted value, defaults to None
+    :type minimum: float, optional
+    :param maximum: largest accepted value, defaults to None
+    :type maximum: float, optional
+    :return: function converting a text into a float, raising ``ValueError`` if invalid.
+    :rtype: callable
+    """
+    def parse(text):
+        value = float(text)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError('%s is out of [%s, %s]' % (value, minimum, maximum))
+        return value
+    return parse
+
+
+def limit_parser(text):
+    """Parser of a display limit: empty, 'inf' or '-inf' give `None` (automatic limit).
+
+    :param text: text of the field.
+    :type text: string
+    :rtype: float
+    """
+    text = text.strip()
+    if text in ['', 'inf', '-inf']:
+        return None
+    return float(text)
+
+
+def optional_parser(parser):
+    """Parser giving `None` instead of raising an error for an invalid text.
+
+    :param parser: parser of the valid texts.
+    :type parser: callable
+    :rtype: callable
+    """
+    def parse(text):
+        try:
+            return parser(text)
+        except ValueError:
+            return None
+    return parse
+
+
+class ParameterStore(object):
+    """Typed values of the fields of the GUI.
+
+    Each field is parsed and validated once, when it is edited, and the frame loop
+    reads an immutable snapshot of the values instead of parsing texts at every frame.
+    An invalid text keeps the last valid value of the field and is listed in ``errors``.
+    """
+    def __init__(self):
+        self._parsers = collections.OrderedDict()
+        self._values = {}
+        self._snapshot_type = None
+        self._snapshot = None
+        self.errors = {}
+
+    def add(self, name, parser, default, text=None):
+        """Declare a parameter.
+
+        :param name: name of the parameter, it is the attribute of the snapshots.
+        :type name: string
+        :param parser: function converting the text of the field, raising ``ValueError`` if invalid.
+        :type parser: callable
+        :param default: value until a valid text is given.
+        :param text: current text of the field, defaults to None
+        :type text: string, optional
+        """
+        self._parsers[name] = parser
+        self._values[name] = default
+        self._snapshot_type = collections.namedtuple('Parameters', list(self._parsers))
+        self._snapshot = None
+        if text is not None:
+            self.set_text(name, text)
+
+    def set_text(self, name, text):
+        """Parse the new text of a field.
+
+        :param name: name of the parameter.
+        :type name: string
+        :param text: text of the field.
+        :type text: string
+        :return: `False` if the text is invalid, the previous value is kept.
+        :rtype: bool
+        """
+        try:
+            value = self._parsers[name](text)
+        except ValueError:
+            self.errors[name] = text
+            return False
+        self.errors.pop(name, None)
+        if value != self._values[name]:
+            self._values[name] = value
+            self._snapshot = None
+        return True
+
+    def snapshot(self):
+        """Current values of all the parameters.
+
+        The snapshot is rebuilt only after a change, so it is free to call it at every frame.
+
+        :rtype: namedtuple
+        """
+        if self._snapshot is None:
+            self._snapshot = self._snapshot_type(**self._values)
+        return self._snapshot
+
+    def __getitem__(self, name):
+        return self._values[name]
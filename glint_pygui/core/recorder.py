@@ -0,0 +1,223 @@
+import os
+import queue
+import threading
+import time
+import datetime
+import numpy as np
+from astropy.io import fits
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class FrameRecorder(object):
+    """Stream the acquired frames to disk.
+
+    The frames, their timestamps and the positions of the mirror are queued
+    and written by a background thread in chunks of ``chunk_size`` frames, so
+    recording never blocks the acquisition or the display.
+    The queue is bounded: if the disk does not keep up, the new frames are dropped
+    and counted in ``nb_dropped``.
+
+    A new file is started when the current one exceeds ``max_file_size``
+    or ``max_file_duration``.
+    In FITS format, each chunk is appended to the file as an image cube followed by
+    the cube of the spectra, if any, and a binary table of the timestamps and the positions of the mirror.
+    The wavelengths of the spectra are in the extension ``WAVELENGTHS`` after the primary HDU.
+    In HDF5 format (requires h5py), the datasets ``frames``, ``spectra``, ``timestamps``
+    and ``mems_values`` are extended at each chunk, the dataset ``wavelengths`` is written once.
+    """
+    def __init__(self, save_dir, file_name, fmt='fits', chunk_size=100, queue_size=500,
+                 max_file_size=None, max_file_duration=None, compress=False, wavelengths=None):
+        """
+        :param save_dir: directory where the files are saved, created if needed.
+        :type save_dir: string
+        :param file_name: prefix of the files.
+        :type file_name: string
+        :param fmt: format of the files, 'fits' or 'hdf5', defaults to 'fits'
+        :type fmt: string, optional
+        :param chunk_size: number of frames written at once, defaults to 100
+        :type chunk_size: int, optional
+        :param queue_size: maximum number of frames waiting to be written, defaults to 500
+        :type queue_size: int, optional
+        :param max_file_size: size in bytes above which a new file is started, defaults to None
+        :type max_file_size: int, optional
+        :param max_file_duration: duration in second above which a new file is started, defaults to None
+        :type max_file_duration: float, optional
+        :param compress: compress the frames (Rice for FITS, gzip for HDF5), defaults to False
+        :type compress: bool, optional
+        :param wavelengths: wavelengths of the recorded spectra, defaults to None
+        :type wavelengths: array, optional
+        """
+        if fmt not in ['fits', 'hdf5']:
+            raise ValueError('Unknown format %s' % fmt)
+        if fmt == 'hdf5' and h5py is None:
+            raise ImportError('h5py is required to record in HDF5 format')
+        self.save_dir = save_dir
+        self.file_name = file_name if file_name else 'glint'
+        self.fmt = fmt
+        self.chunk_size = int(chunk_size)
+        self.max_file_size = max_file_size
+        self.max_file_duration = max_file_duration
+        self.compress = compress
+        self.wavelengths = None if wavelengths is None else np.array(wavelengths, dtype=float)
+
+        # Backpressure statistics
+        self.nb_recorded = 0
+        self.nb_dropped = 0
+        self.max_queue_length = 0
+        self.bytes_written = 0
+        self.files = []
+        self.last_error = None
+
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._chunk = []
+        self._path = None
+        self._file_start = None
+        self._file_index = 0
+        self._run_name = None
+
+    @property
+    def is_recording(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the writing thread.
+        """
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+        self._run_name = self.file_name + '_' + datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write the queued frames and close the current file.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def record(self, frame, mems_values, timestamp=None, spectra=None):
+        """Queue a frame to be written.
+
+        It does not wait: if the queue is full, the frame is dropped.
+
+        :param frame: frame to record, it is copied.
+        :type frame: array
+        :param mems_values: positions (piston, tip, tilt) of the segments of the mirror, it is copied.
+        :type mems_values: array
+        :param timestamp: time of acquisition of the frame, defaults to now.
+        :type timestamp: float, optional
+        :param spectra: spectra of the outputs in the frame, it is copied, defaults to None
+        :type spectra: array, optional
+        :return: `False` if the frame was dropped.
+        :rtype: bool
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        try:
+            self._queue.put_nowait((np.array(frame), np.array(mems_values, dtype=float), timestamp,
+                                    None if spectra is None else np.array(spectra)))
+        except queue.Full:
+            self.nb_dropped += 1
+            return False
+        self.max_queue_length = max(self.max_queue_length, self._queue.qsize())
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._chunk.append(item)
+            if len(self._chunk) >= self.chunk_size:
+                self._write_chunk()
+        self._write_chunk()
+
+    def _write_chunk(self):
+        if len(self._chunk) == 0:
+            return
+        frames = np.array([elt[0] for elt in self._chunk])
+        mems_values = np.array([elt[1] for elt in self._chunk])
+        timestamps = np.array([elt[2] for elt in self._chunk])
+        spectra = None
+        if all(elt[3] is not None for elt in self._chunk):
+            spectra = np.array([elt[3] for elt in self._chunk])
+        self._chunk = []
+
+        try:
+            if self._path is None:
+                self._new_file()
+            if self.fmt == 'fits':
+                self._write_fits(frames, mems_values, timestamps, spectra)
+            else:
+                self._write_hdf5(frames, mems_values, timestamps, spectra)
+        except Exception as e:
+            self.last_error = e
+            self.nb_dropped += frames.shape[0]
+            return
+
+        self.nb_recorded += frames.shape[0]
+        file_size = os.path.getsize(self._path)
+        self.bytes_written += frames.nbytes + (0 if spectra is None else spectra.nbytes)
+        if (self.max_file_size is not None and file_size >= self.max_file_size) or \
+                (self.max_file_duration is not None and
+                 time.time() - self._file_start >= self.max_file_duration):
+            self._path = None
+
+    def _new_file(self):
+        extension = '.fits' if self.fmt == 'fits' else '.h5'
+        self._path = os.path.join(self.save_dir, '%s_%04d%s' % (self._run_name, self._file_index, extension))
+        self._file_index += 1
+        self._file_start = time.time()
+        self.files.append(self._path)
+
+    def _write_fits(self, frames, mems_values, timestamps, spectra=None):
+        if not os.path.isfile(self._path):
+            header = fits.Header()
+            header['DATE'] = datetime.datetime.now().isoformat()
+            header['NCHUNK'] = (self.chunk_size, 'Maximum number of frames per chunk')
+            hdul = fits.HDUList([fits.PrimaryHDU(header=header)])
+            if self.wavelengths is not None:
+                hdul.append(fits.ImageHDU(self.wavelengths, name='WAVELENGTHS'))
+            hdul.writeto(self._path)
+
+        if self.compress:
+            hdu_frames = fits.CompImageHDU(frames, compression_type='RICE_1', name='FRAMES')
+        else:
+            hdu_frames = fits.ImageHDU(frames, name='FRAMES')
+        columns = [fits.Column(name='TIME', format='D', array=timestamps),
+                   fits.Column(name='MEMS', format='%sD' % mems_values[0].size,
+                               dim='(%s,%s)' % mems_values.shape[:0:-1], array=mems_values)]
+        hdu_table = fits.BinTableHDU.from_columns(columns, name='META')
+        with fits.open(self._path, mode='append') as hdul:
+            hdul.append(hdu_frames)
+            if spectra is not None:
+                hdul.append(fits.ImageHDU(spectra, name='SPECTRA'))
+            hdul.append(hdu_table)
+
+    def _write_hdf5(self, frames, mems_values, timestamps, spectra=None):
+        with h5py.File(self._path, 'a') as f:
+            if 'frames' not in f:
+                compression = 'gzip' if self.compress else None
+                f.create_dataset('frames', shape=(0,) + frames.shape[1:], maxshape=(None,) + frames.shape[1:],
+                                 dtype=frames.dtype, chunks=(self.chunk_size,) + frames.shape[1:],
+                                 compression=compression)
+                f.create_dataset('mems_values', shape=(0,) + mems_values.shape[1:],
+                                 maxshape=(None,) + mems_values.shape[1:], dtype=float)
+                f.create_dataset('timestamps', shape=(0,), maxshape=(None,), dtype=float)
+                if self.wavelengths is not None:
+                    f.create_dataset('wavelengths', data=self.wavelengths)
+            datasets = [('frames', frames), ('mems_values', mems_values), ('timestamps', timestamps)]
+            if spectra is not None:
+                if 'spectra' not in f:
+                    f.create_dataset('spectra', shape=(0,) + spectra.shape[1:],
+                                     maxshape=(None,) + spectra.shape[1:], dtype=spectra.dtype)
+                datasets.append(('spectra', spectra))
+            for name, data in datasets:
+                dataset = f[name]
+                nb_written = dataset.shape[0]
+                dataset.resize(nb_written + data.shape[0], axis=0)
+                dataset[nb_written:] = data
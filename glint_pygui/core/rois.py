@@ -0,0 +1,147 @@
+import numpy as np
+
+
+class RoiIndex(object):
+    """Precomputed extraction of the fluxes of the outputs.
+
+    The outputs are fixed, axis-aligned rectangles so their pixels are gathered
+    with a single ``take`` of precomputed indices, in a buffer reused at each frame.
+    The spectra and the integrated fluxes of all the outputs are then
+    given by one reduction instead of one ``getArrayRegion`` per ROI.
+
+    The spectral dispersion is along the columns (x-axis) of the frame,
+    the rows (y-axis) of an output are averaged.
+    The bad pixels are left out of the averages.
+    """
+    def __init__(self, rects, frame_shape, bad_pixels=None):
+        """
+        :param rects: list of (x, y, width, height) of the outputs, in pixels,
+                    as given to ``pg.RectROI``: x is the column and y the row.
+        :type rects: list
+        :param frame_shape: shape (rows, columns) of the frames.
+        :type frame_shape: tuple
+        :param bad_pixels: mask of the pixels to ignore, defaults to None
+        :type bad_pixels: array of bool, optional
+        """
+        rects = np.around(np.array(rects, dtype=float)).astype(int)
+        self.rects = rects
+        self.frame_shape = tuple(frame_shape)
+        self.nb_outputs = rects.shape[0]
+
+        width = rects[:, 2].max()
+        height = rects[:, 3].max()
+        cols = rects[:, 0, None] + np.arange(width)
+        rows = rects[:, 1, None] + np.arange(height)
+
+        # Pixels outside a smaller ROI or outside the frame get a null weight
+        weights = (np.arange(height) < rects[:, 3, None])[:, :, None] * \
+                  (np.arange(width) < rects[:, 2, None])[:, None, :]
+        weights &= ((rows >= 0) & (rows < self.frame_shape[0]))[:, :, None]
+        weights &= ((cols >= 0) & (cols < self.frame_shape[1]))[:, None, :]
+        rows = np.clip(rows, 0, self.frame_shape[0] - 1)
+        cols = np.clip(cols, 0, self.frame_shape[1] - 1)
+        if bad_pixels is not None:
+            weights &= ~np.asarray(bad_pixels, dtype=bool)[rows[:, :, None], cols[:, None, :]]
+
+        self._indices = rows[:, :, None] * self.frame_shape[1] + cols[:, None, :]
+        # (outputs, rows, columns) of the gathered pixels
+        self.shape = self._indices.shape
+        self._cube = None
+        self._raw_cube = None
+        # Pixels of the outputs, for the counts
+        self._valid = None if weights.all() else weights
+        if weights.all():
+            self._weights = None
+            self._spectral_norm = float(height)
+            self._flux_norm = float(height * width)
+        else:
+            self._weights = weights.astype(float)
+            self._spectral_norm = np.maximum(self._weights.sum(1), 1.)
+            self._flux_norm = np.maximum(self._weights.sum((1, 2)), 1.)
+
+    def gather(self, frame, out=None):
+        """Pixels of all the outputs, padded to the size of the largest one.
+
+        :param frame: contiguous frame of shape ``frame_shape``.
+        :type frame: array
+        :param out: array of shape ``shape`` in which the pixels are written, defaults to None
+        :type out: array, optional
+        :return: pixels of shape (outputs, rows, columns).
+        :rtype: array
+        """
+        if out is None:
+            out = np.zeros(self.shape, dtype=frame.dtype)
+        # The indices are within the frame, 'clip' avoids the buffering of 'raise'
+        np.take(np.ascontiguousarray(frame).reshape(-1), self._indices, out=out, mode='clip')
+        return out
+
+    def extract(self, frame, spectra=None, fluxes=None):
+        """Extract the spectra and the fluxes of all the outputs.
+
+        :param frame: contiguous frame of shape ``frame_shape``.
+        :type frame: array
+        :param spectra: array of shape (outputs, width) in which the spectra are written, defaults to None
+        :type spectra: array, optional
+        :param fluxes: array of shape (outputs,) in which the fluxes are written, defaults to None
+        :type fluxes: array, optional
+        :return: tuple of the spectra (averaged over the rows of the output)
+                of shape (outputs, width) and the mean fluxes of shape (outputs,).
+        :rtype: tuple
+        """
+        frame = np.ascontiguousarray(frame)
+        if self._cube is None or self._cube.dtype != frame.dtype:
+            # Buffers in the type of the frames, so that no operation needs a casting buffer
+            self._cube = np.zeros(self._indices.shape, dtype=frame.dtype)
+            self._row_sums = np.zeros(self._indices.shape[::2], dtype=frame.dtype)
+            if self._weights is not None:
+                self._cube_weights = self._weights.astype(frame.dtype)
+        if spectra is None:
+            spectra = np.zeros(self._indices.shape[::2])
+        if fluxes is None:
+            fluxes = np.zeros(self.nb_outputs)
+
+        self.gather(frame, self._cube)
+        if self._weights is not None:
+            np.multiply(self._cube, self._cube_weights, out=self._cube)
+        np.sum(self._cube, 1, out=self._row_sums)
+        np.copyto(spectra, self._row_sums)
+        np.sum(spectra, 1, out=fluxes)
+        fluxes /= self._flux_norm
+        spectra /= self._spectral_norm
+        return spectra, fluxes
+
+    def count_above(self, frame, level, out=None):
+        """Count the pixels of each output at or above a level, e.g. the saturated ones.
+
+        It works on the raw frame, in its own type (e.g. 16-bit integers), with its own buffers
+        so that it can run in the acquisition thread while ``extract`` runs in the GUI thread.
+
+        :param frame: contiguous frame of shape ``frame_shape``.
+        :type frame: array
+        :param level: threshold, in the unit of the frame.
+        :type level: float
+        :param out: array of shape (outputs,) in which the counts are written, defaults to None
+        :type out: array, optional
+        :return: number of pixels of each output at or above ``level``.
+        :rtype: array
+        """
+        frame = np.ascontiguousarray(frame)
+        if self._raw_cube is None or self._raw_cube.dtype != frame.dtype:
+            self._raw_cube = np.zeros(self._indices.shape, dtype=frame.dtype)
+            self._above = np.zeros(self._indices.shape, dtype=bool)
+        if frame.dtype.kind in 'ui':
+            # Compare in the type of the frame, without conversion
+            info = np.iinfo(frame.dtype)
+            level = frame.dtype.type(min(max(np.ceil(level), info.min), info.max))
+        if out is None:
+            out = np.zeros(self.nb_outputs, dtype=int)
+
+        np.take(frame.reshape(-1), self._indices, out=self._raw_cube, mode='clip')
+        np.greater_equal(self._raw_cube, level, out=self._above)
+        if self._valid is not None:
+            np.logical_and(self._above, self._valid, out=self._above)
+        # A reduction of booleans into integers would need a casting buffer
+        above = self._above.reshape(self.nb_outputs, -1)
+        for k in range(self.nb_outputs):
+            out[k] = np.count_nonzero(above[k])
+        return out
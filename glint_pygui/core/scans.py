@@ -0,0 +1,535 @@
+import os
+import json
+import datetime
+import numpy as np
+
+AXIS_NAMES = ['piston', 'tip', 'tilt']
+
+
+class Axis(object):
+    """Direction of the mirror moved by a scan.
+
+    A value ``v`` of the axis moves the segments by ``v * weights``, added to
+    their base positions. A single piston, tip or tilt is a particular case of
+    a modal axis moving several segments together (e.g. a differential piston).
+    """
+    def __init__(self, segments, weights, name=None):
+        """
+        :param segments: segments (starting at 1) moved by the axis.
+        :type segments: list
+        :param weights: displacement (piston, tip, tilt) of each segment for a unit value, of shape (segments, 3).
+        :type weights: array
+        :param name: name of the axis, defaults to None
+        :type name: string, optional
+        """
+        self.segments = [int(elt) for elt in np.atleast_1d(segments)]
+        self.weights = np.array(weights, dtype=float).reshape(len(self.segments), 3)
+        self.name = name
+
+    @classmethod
+    def single(cls, axis, segments):
+        """Piston, tip or tilt of one or several segments moved together.
+
+        :param axis: 'piston', 'tip' or 'tilt'.
+        :type axis: string
+        :param segments: segments (starting at 1).
+        :type segments: int or list
+        :rtype: Axis
+        """
+        segments = np.atleast_1d(segments)
+        weights = np.zeros((segments.size, 3))
+        weights[:, AXIS_NAMES.index(axis)] = 1.
+        return cls(segments, weights, '%s %s' % (axis, ','.join(str(elt) for elt in segments)))
+
+    @classmethod
+    def from_dict(cls, description):
+        """Axis from a dictionary: ``{"axis": "tilt", "segments": [29]}`` or
+        ``{"name": ..., "segments": [29, 35], "weights": [[1, 0, 0], [-1, 0, 0]]}``.
+
+        :rtype: Axis
+        """
+        if 'axis' in description:
+            return cls.single(description['axis'], description['segments'])
+        return cls(description['segments'], description['weights'], description.get('name'))
+
+    def to_dict(self):
+        return {'name': self.name, 'segments': self.segments, 'weights': self.weights.tolist()}
+
+
+class PointSet(object):
+    """Values of the axes at the points of a scan, given batch by batch.
+
+    The fixed designs give all their points in the first batch.
+    The adaptive ones choose the next batch from the fluxes of the previous one.
+    """
+    def first(self):
+        """Points of the first batch, of shape (points, axes).
+
+        :rtype: array
+        """
+        raise NotImplementedError
+
+    def next(self, points, fluxes):
+        """Points of the next batch, `None` when the scan is complete.
+
+        :param points: points of the last batch.
+        :type points: array
+        :param fluxes: fluxes measured at these points, of shape (points, outputs).
+        :type fluxes: array
+        :rtype: array
+        """
+        return None
+
+
+class FixedPoints(PointSet):
+    """Any given list of points.
+    """
+    def __init__(self, points):
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+
+    def first(self):
+        return self.points
+
+
+class Grid(FixedPoints):
+    """N-D grid, the last axis varies the fastest.
+    """
+    def __init__(self, *values):
+        """
+        :param values: values of each axis.
+        :type values: arrays
+        """
+        self.values = [np.atleast_1d(np.asarray(elt, dtype=float)) for elt in values]
+        mesh = np.meshgrid(*self.values, indexing='ij')
+        super(Grid, self).__init__(np.stack([elt.ravel() for elt in mesh], 1))
+
+    @property
+    def shape(self):
+        return tuple(elt.size for elt in self.values)
+
+
+class Spiral(FixedPoints):
+    """Archimedean spiral in the plane of two axes, from its center outwards.
+    """
+    def __init__(self, center, step, nb_points):
+        """
+        :param center: values of the two axes at the center.
+        :type center: array
+        :param step: distance between two turns and between two successive points.
+        :type step: float
+        :param nb_points: number of points.
+        :type nb_points: int
+        """
+        # Arc length of the spiral r = step * theta / (2 pi) is ~ step * theta^2 / (4 pi)
+        theta = np.sqrt(4 * np.pi * np.arange(nb_points))
+        radius = step * theta / (2 * np.pi)
+        super(Spiral, self).__init__(np.asarray(center, dtype=float) +
+                                     np.stack([radius * np.cos(theta), radius * np.sin(theta)], 1))
+
+
+class LatinHypercube(FixedPoints):
+    """Random design with one point in each of the ``nb_points`` slices of each axis.
+    """
+    def __init__(self, bounds, nb_points, seed=None):
+        """
+        :param bounds: minimum and maximum of each axis, of shape (axes, 2).
+        :type bounds: array
+        :param nb_points: number of points.
+        :type nb_points: int
+        :param seed: seed of the design, defaults to None
+        :type seed: int, optional
+        """
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        rng = np.random.default_rng(seed)
+        slices = np.stack([rng.permutation(nb_points) for _ in range(bounds.shape[0])], 1)
+        unit = (slices + rng.uniform(size=slices.shape)) / nb_points
+        super(LatinHypercube, self).__init__(bounds[:, 0] + unit * (bounds[:, 1] - bounds[:, 0]))
+
+
+class AdaptiveGrid(PointSet):
+    """Grids zooming on the best point of the previous one.
+
+    Each iteration scans a grid of ``nb_points`` per axis, then the next grid is
+    centered on the point maximising (or minimising) the flux of an output,
+    its extent being reduced by ``shrink``.
+    """
+    def __init__(self, bounds, nb_points=5, nb_iterations=3, shrink=0.4, goal='max', output_index=0):
+        """
+        :param bounds: minimum and maximum of each axis, of shape (axes, 2).
+        :type bounds: array
+        :param nb_points: number of points per axis of each grid, defaults to 5
+        :type nb_points: int, optional
+        :param nb_iterations: number of grids, defaults to 3
+        :type nb_iterations: int, optional
+        :param shrink: ratio of the extents of two successive grids, defaults to 0.4
+        :type shrink: float, optional
+        :param goal: 'max' or 'min', defaults to 'max'
+        :type goal: string, optional
+        :param output_index: index, in the outputs of the scan, of the optimised output, defaults to 0
+        :type output_index: int, optional
+        """
+        if goal not in ['max', 'min']:
+            raise ValueError('Unknown goal %s' % goal)
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        self.nb_points = nb_points
+        self.nb_iterations = nb_iterations
+        self.shrink = shrink
+        self.goal = goal
+        self.output_index = output_index
+
+    def _grid(self, center, half_width):
+        values = [np.linspace(c - w, c + w, self.nb_points) for c, w in zip(center, half_width)]
+        return Grid(*values).points
+
+    def first(self):
+        self._iteration = 1
+        self._half_width = (self.bounds[:, 1] - self.bounds[:, 0]) / 2
+        return self._grid(self.bounds.mean(1), self._half_width)
+
+    def next(self, points, fluxes):
+        if self._iteration >= self.nb_iterations:
+            return None
+        objective = fluxes[:, self.output_index]
+        if np.all(np.isnan(objective)):
+            return None
+        best = points[np.nanargmax(objective) if self.goal == 'max' else np.nanargmin(objective)]
+        self._iteration += 1
+        self._half_width = self._half_width * self.shrink
+        center = np.clip(best, self.bounds[:, 0] + self._half_width, self.bounds[:, 1] - self._half_width)
+        return self._grid(center, self._half_width)
+
+
+def point_set_from_dict(description):
+    """Point set from a dictionary, e.g. ``{"type": "grid", "values": [[-1, 1, 11], [0, 2, 5]]}``
+    where each triple gives the arguments of ``np.linspace``.
+
+    The types are 'grid', 'points' ("values": list of points), 'spiral' ("center", "step", "nb_points"),
+    'latin_hypercube' ("bounds", "nb_points", "seed") and 'adaptive' (arguments of ``AdaptiveGrid``).
+
+    :rtype: PointSet
+    """
+    description = dict(description)
+    kind = description.pop('type')
+    if kind == 'grid':
+        return Grid(*[np.linspace(*elt) if len(elt) == 3 else elt for elt in description['values']])
+    if kind == 'points':
+        return FixedPoints(description['values'])
+    if kind == 'spiral':
+        return Spiral(**description)
+    if kind == 'latin_hypercube':
+        return LatinHypercube(**description)
+    if kind == 'adaptive':
+        return AdaptiveGrid(**description)
+    raise ValueError('Unknown point set %s' % kind)
+
+
+class ScanSpec(object):
+    """Description of a scan: what is moved, where, what is measured and how many times.
+    """
+    def __init__(self, axes, points, outputs, repeats=1, base=None, keep_frames=False, name='scan',
+                 keep_spectra=True):
+        """
+        :param axes: moved axes.
+        :type axes: list of Axis
+        :param points: values of the axes at the points.
+        :type points: PointSet
+        :param outputs: outputs (starting at 1) to measure.
+        :type outputs: list
+        :param repeats: number of repetitions of the scan, defaults to 1
+        :type repeats: int, optional
+        :param base: positions (piston, tip, tilt) of the moved segments at the value 0 of the axes,
+                    of shape (segments, 3) in the order of ``segments``, defaults to their positions
+                    when the scan starts.
+        :type base: array, optional
+        :param keep_frames: keep the averaged frame of each point, defaults to False
+        :type keep_frames: bool, optional
+        :param name: name of the scan, prefix of the saved files, defaults to 'scan'
+        :type name: string, optional
+        :param keep_spectra: keep the calibrated spectra of all the outputs and the null depths
+                            at each point, defaults to True
+        :type keep_spectra: bool, optional
+        """
+        self.axes = list(axes)
+        self.points = points
+        self.outputs = [int(elt) for elt in np.atleast_1d(outputs)]
+        self.repeats = int(repeats)
+        self.base = base
+        self.keep_frames = keep_frames
+        self.name = name
+        self.keep_spectra = keep_spectra
+
+    @property
+    def segments(self):
+        """Segments moved by the axes, in increasing order.
+        """
+        return sorted(set(seg for axis in self.axes for seg in axis.segments))
+
+    def validate(self, nb_segments=None, nb_outputs=None):
+        """Check that the scan moves at least one segment and measures at least one output,
+        all of them existing.
+
+        :param nb_segments: number of segments of the mirror, defaults to None (no upper bound)
+        :type nb_segments: int, optional
+        :param nb_outputs: number of outputs, defaults to None (no upper bound)
+        :type nb_outputs: int, optional
+        :raises ValueError: if the scan is not valid.
+        """
+        segments = self.segments
+        if len(segments) == 0:
+            raise ValueError('The scan moves no segment')
+        if len(self.outputs) == 0:
+            raise ValueError('The scan measures no output')
+        wrong = [seg for seg in segments if seg < 1 or (nb_segments is not None and seg > nb_segments)]
+        if wrong:
+            raise ValueError('Unknown segment %s' % ', '.join(str(seg) for seg in wrong))
+        wrong = [out for out in self.outputs if out < 1 or (nb_outputs is not None and out > nb_outputs)]
+        if wrong:
+            raise ValueError('Unknown output %s' % ', '.join(str(out) for out in wrong))
+
+    def positions(self, base, points):
+        """Positions of the moved segments at points.
+
+        :param base: positions of the segments at the value 0 of the axes, of shape (segments, 3).
+        :type base: array
+        :param points: values of the axes, of shape (points, axes).
+        :type points: array
+        :return: positions of shape (points, segments, 3).
+        :rtype: array
+        """
+        segments = self.segments
+        # Displacement of all the segments for a unit value of each axis
+        modes = np.zeros((len(self.axes), len(segments), 3))
+        for k, axis in enumerate(self.axes):
+            for seg, weights in zip(axis.segments, axis.weights):
+                modes[k, segments.index(seg)] += weights
+        return base + np.tensordot(points, modes, 1)
+
+    @classmethod
+    def from_dict(cls, description, output_names=None):
+        """Scan from a dictionary (e.g. read from a JSON file)::
+
+            {"name": "piston_vs_tilt",
+             "axes": [{"axis": "piston", "segments": [29]}, {"axis": "tilt", "segments": [29]}],
+             "points": {"type": "grid", "values": [[-1.5, 1.5, 31], [-0.5, 0.5, 5]]},
+             "outputs": ["N1", "N7"], "repeats": 2}
+
+        :param description: description of the scan.
+        :type description: dict
+        :param output_names: names of the outputs, to give the outputs by name
+                            (e.g. ``RoiLayout.names``), defaults to None
+        :type output_names: list, optional
+        :rtype: ScanSpec
+        :raises ValueError: if an output is given by an unknown name, or by name without ``output_names``,
+                        or if the scan is not valid (see ``validate``).
+        """
+        outputs = description['outputs']
+        by_name = outputs == 'all' or any(isinstance(elt, str) for elt in outputs)
+        if by_name and output_names is None:
+            raise ValueError('The names of the outputs are needed to give the outputs by name')
+        if outputs == 'all':
+            outputs = list(range(1, len(output_names) + 1))
+        output_names = [] if output_names is None else list(output_names)
+        unknown = [elt for elt in outputs if isinstance(elt, str) and elt not in output_names]
+        if unknown:
+            raise ValueError('Unknown output %s' % ', '.join(unknown))
+        outputs = [output_names.index(elt) + 1 if isinstance(elt, str) else elt for elt in outputs]
+        base = description.get('base')
+        spec = cls([Axis.from_dict(elt) for elt in description['axes']],
+                   point_set_from_dict(description['points']), outputs,
+                   description.get('repeats', 1), None if base is None else np.array(base, dtype=float),
+                   description.get('keep_frames', False), description.get('name', 'scan'),
+                   description.get('keep_spectra', True))
+        spec.validate(nb_outputs=len(output_names) if output_names else None)
+        return spec
+
+    @classmethod
+    def load(cls, path, output_names=None):
+        """Read a scan from a JSON file, see ``from_dict``.
+
+        :rtype: ScanSpec
+        """
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f), output_names)
+
+
+class ScanResult(object):
+    """Measurements of a scan, filled point by point.
+    """
+    def __init__(self, spec, segments, base, wavelengths=None, null_estimator=None):
+        self.spec = spec
+        self.segments = segments
+        self.base = base
+        self.wavelengths = wavelengths
+        self.null_estimator = null_estimator
+        self.date = datetime.datetime.now()
+        # One list per repetition, concatenated by ``points``, ``reached`` and ``fluxes``
+        self._points = []
+        self._reached = []
+        self._fluxes = []
+        self._frames = []
+        self._spectra = []
+        self._null_depths = None
+
+    def _add(self, repeat, points, reached, fluxes, frames, spectra=None):
+        self._null_depths = None
+        if repeat == len(self._points):
+            for elt in (self._points, self._reached, self._fluxes, self._frames, self._spectra):
+                elt.append([])
+        self._points[repeat].append(points)
+        self._reached[repeat].append(reached)
+        self._fluxes[repeat].append(fluxes)
+        if frames is not None:
+            self._frames[repeat].append(frames)
+        if spectra is not None:
+            self._spectra[repeat].append(spectra)
+
+    @staticmethod
+    def _stack(batches):
+        """Concatenate the batches of each repetition and stack the repetitions.
+
+        The repetitions may have different numbers of points (e.g. ``AdaptiveGrid``),
+        the missing points are NaN.
+        """
+        repeats = [np.concatenate(elt) for elt in batches if len(elt) > 0]
+        if len(repeats) == 0:
+            return np.zeros((0, 0))
+        nb_points = max(len(elt) for elt in repeats)
+        if all(len(elt) == nb_points for elt in repeats):
+            return np.array(repeats)
+        stacked = np.full((len(repeats), nb_points) + repeats[0].shape[1:], np.nan,
+                          dtype=np.result_type(repeats[0].dtype, np.float32))
+        for k, elt in enumerate(repeats):
+            stacked[k, :len(elt)] = elt
+        return stacked
+
+    @property
+    def points(self):
+        """Values of the axes, of shape (repeats, points, axes).
+        """
+        return self._stack(self._points)
+
+    @property
+    def reached(self):
+        """Reached positions of the segments, of shape (repeats, points, segments, 3).
+        """
+        return self._stack(self._reached)
+
+    @property
+    def fluxes(self):
+        """Fluxes of the outputs, of shape (repeats, points, outputs).
+        """
+        return self._stack(self._fluxes)
+
+    @property
+    def frames(self):
+        """Frames of shape (repeats, points, rows, columns), `None` if they are not kept.
+        """
+        if not self.spec.keep_frames:
+            return None
+        return self._stack(self._frames)
+
+    @property
+    def spectra(self):
+        """Calibrated spectra of all the outputs, of shape (repeats, points, outputs, wavelengths),
+        `None` if they are not kept.
+        """
+        if not self.spec.keep_spectra:
+            return None
+        return self._stack(self._spectra)
+
+    @property
+    def null_depths(self):
+        """Null depths of all the nulls, of shape (repeats, points, nulls, wavelengths),
+        `None` without spectra or nulls (see ``NullDepthEstimator``).
+        """
+        if not self.spec.keep_spectra or self.null_estimator is None:
+            return None
+        if self._null_depths is None:
+            self._null_depths = self.null_estimator.compute(self.spectra)[0]
+        return self._null_depths
+
+    def save(self, directory='.'):
+        """Save the measurements and the description of the scan in a npz file.
+
+        :param directory: directory of the file, created if needed, defaults to '.'
+        :type directory: string, optional
+        :return: path of the file.
+        :rtype: string
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%s_%s.npz' % (self.spec.name, self.date.strftime('%Y%m%dT%H%M%S')))
+        arrays = {'points': self.points, 'reached': self.reached, 'fluxes': self.fluxes,
+                  'segments': self.segments, 'outputs': self.spec.outputs, 'base': self.base,
+                  'axes': json.dumps([axis.to_dict() for axis in self.spec.axes])}
+        if self.spec.keep_frames:
+            arrays['frames'] = self.frames
+        if self.spec.keep_spectra:
+            arrays['spectra'] = self.spectra
+            arrays['wavelengths'] = self.wavelengths
+        null_depths = self.null_depths
+        if null_depths is not None:
+            arrays['null_depths'] = null_depths
+        np.savez(path, **arrays)
+        return path
+
+
+class ScanExecutor(object):
+    """Run any ``ScanSpec`` on an engine.
+
+    The points of each batch are measured by a ``ScanScheduler`` (moves overlapped with
+    the processing, frames of the settled mirror), with the background acquisition
+    running during the whole scan. The scan stops at the next point when ``engine.abort``
+    is called.
+    """
+    def __init__(self, engine, scan_wait=0.):
+        """
+        :param engine: engine owning the mirror and the frames.
+        :type engine: GlintEngine
+        :param scan_wait: settling time of the mirror after each move, in second, defaults to 0.
+        :type scan_wait: float, optional
+        """
+        self.engine = engine
+        self.scan_wait = scan_wait
+
+    def run(self, spec, on_point=None, on_repeat=None):
+        """Run a scan.
+
+        :param spec: the scan.
+        :type spec: ScanSpec
+        :param on_point: function called with the index of the repetition, the values of the axes
+                        and the fluxes of each measured point, defaults to None
+        :type on_point: callable, optional
+        :param on_repeat: function called with the index of each repetition before it starts, defaults to None
+        :type on_repeat: callable, optional
+        :return: the measurements, `None` if aborted.
+        :rtype: ScanResult
+        :raises ValueError: if the scan is not valid for the mirror and the outputs (see ``ScanSpec.validate``).
+        """
+        engine = self.engine
+        spec.validate(engine.nb_segments, engine.roi_index.nb_outputs)
+        engine._aborted = False
+        segments = np.array(spec.segments)
+        base = engine.mems_values[segments - 1].copy() if spec.base is None else np.asarray(spec.base, dtype=float)
+        outputs = np.array(spec.outputs)
+        result = ScanResult(spec, segments, base, engine.wavelengths.copy(), engine.null_estimator)
+        scheduler = engine.scheduler(self.scan_wait)
+
+        with engine.scan_acquisition():
+            for repeat in range(spec.repeats):
+                if on_repeat is not None:
+                    on_repeat(repeat)
+                points = spec.points.first()
+                while points is not None:
+                    if on_point is not None:
+                        batch_points = points
+                        callback = lambda i, reached, fluxes: on_point(repeat, batch_points[i], fluxes)
+                    else:
+                        callback = None
+                    measures = scheduler.run(segments, spec.positions(base, points), outputs,
+                                             spec.keep_frames, callback, spec.keep_spectra)
+                    if measures is None:
+                        return None
+                    reached, fluxes, frames, spectra = measures
+                    result._add(repeat, points, reached, fluxes, frames, spectra)
+                    points = spec.points.next(points, fluxes)
+        return result
@@ -0,0 +1,243 @@
+import time
+import concurrent.futures
+import numpy as np
+
+
+class ScanScheduler(object):
+    """Measure the outputs at a sequence of mirror positions, at the rate of the camera.
+
+    The frames acquired in the background are tagged with the epoch of the last command
+    of the mirror (see ``FrameRingBuffer``). After a move, the scheduler keeps only the
+    frames of the new epoch acquired ``settle_time`` after the command, instead of sleeping
+    a fixed time and reading new frames.
+    With ``settle_tolerance``, the mirror is also considered settled only once the fluxes of
+    ``settle_frames`` successive frames agree within this relative tolerance.
+
+    The move to the next point is sent as soon as the frames of the current point
+    are collected: the dark subtraction and the extraction of the current point
+    are done while the mirror moves and settles.
+    """
+    def __init__(self, engine, settle_time=0., nb_frames=None, settle_tolerance=None, settle_frames=3,
+                 timeout=2., pipeline=True):
+        """
+        :param engine: engine owning the mirror and the frames.
+        :type engine: GlintEngine
+        :param settle_time: time after a command before the frames are kept, in second.
+                        It includes the exposure time of the camera, defaults to 0.
+        :type settle_time: float, optional
+        :param nb_frames: number of settled frames averaged per point, defaults to ``engine.nb_averaged``.
+        :type nb_frames: int, optional
+        :param settle_tolerance: largest relative change of the fluxes between frames of a settled mirror,
+                            `None` to rely on ``settle_time`` only, defaults to None
+        :type settle_tolerance: float, optional
+        :param settle_frames: number of successive frames compared to detect the settling, defaults to 3
+        :type settle_frames: int, optional
+        :param timeout: longest time waiting for the frames of a point once the mirror is settled,
+                    in addition to the time the camera needs to acquire them, in second.
+                    The fluxes of the point are then NaN and the error is reported
+                    (see ``GlintEngine.pop_scan_errors``), defaults to 2.
+        :type timeout: float, optional
+        :param pipeline: send the next move before processing the current point, defaults to True
+        :type pipeline: bool, optional
+        """
+        self.engine = engine
+        self.settle_time = settle_time
+        self.nb_frames = max(1, int(engine.nb_averaged if nb_frames is None else nb_frames))
+        self.settle_tolerance = settle_tolerance
+        self.settle_frames = max(2, int(settle_frames))
+        self.timeout = timeout
+        self.pipeline = pipeline
+        self.poll_interval = 1e-3
+        # Points without settled frames in the last run
+        self.nb_timeouts = 0
+        self.timed_out = []
+
+        self._frame = np.zeros(engine.frame_shape, dtype=engine.img_data.dtype)
+        self._sum = np.zeros(engine.frame_shape, dtype=engine.img_data.dtype)
+        self._spectra = None
+        self._fluxes = None
+        self._next_index = 0
+
+    def run(self, segments, positions, outputs, keep_frames=False, on_point=None, keep_spectra=False):
+        """Move the segments through a sequence of positions and measure the outputs at each one.
+
+        The background acquisition is started for the duration of the run if needed.
+
+        :param segments: segments (starting at 1) to move.
+        :type segments: array
+        :param positions: positions of shape (points, 3) given to all the segments
+                        or (points, segments, 3) given to each segment.
+        :type positions: array
+        :param outputs: outputs (starting at 1) to measure.
+        :type outputs: array
+        :param keep_frames: return the averaged dark-subtracted frame of each point, defaults to False
+        :type keep_frames: bool, optional
+        :param on_point: function called with the index, the reached positions and the fluxes
+                        of each point once it is measured, defaults to None
+        :type on_point: callable, optional
+        :param keep_spectra: return the calibrated spectra of all the outputs at each point, defaults to False
+        :type keep_spectra: bool, optional
+        :return: tuple of the reached positions of shape (points, segments, 3), the fluxes of shape
+                (points, outputs), the frames of shape (points, rows, columns) or `None` and the spectra
+                of shape (points, all outputs, wavelengths) or `None`; `None` if aborted.
+        :rtype: tuple
+        """
+        engine = self.engine
+        segments = np.atleast_1d(segments)
+        outputs = np.atleast_1d(outputs)
+        positions = np.asarray(positions, dtype=float)
+        if positions.ndim == 2:
+            positions = np.repeat(positions[:, None, :], segments.size, 1)
+        nb_points = positions.shape[0]
+
+        reached = np.zeros((nb_points, segments.size, 3))
+        fluxes = np.full((nb_points, outputs.size), np.nan)
+        frames = np.zeros((nb_points,) + engine.frame_shape, dtype=self._frame.dtype) if keep_frames else None
+        spectra = None
+        if keep_spectra:
+            # Own buffers: the GUI thread may refresh with the extractor of the engine
+            extractor = engine.spectral_extractor.copy()
+            spectra = np.full((nb_points, extractor.nb_outputs, extractor.nb_wavelengths), np.nan,
+                              dtype=self._frame.dtype)
+        self.nb_timeouts = 0
+        self.timed_out = []
+        if nb_points == 0:
+            return reached, fluxes, frames, spectra
+
+        own_acquisition = engine.acquisition is None
+        if own_acquisition:
+            engine.start_acquisition()
+        executor = concurrent.futures.ThreadPoolExecutor(1) if self.pipeline else None
+        try:
+            self._next_index = engine.frame_buffer.count
+            move = self._move(segments, positions[0])
+            for i in range(nb_points):
+                epoch, command_time, fuses = move
+                reached[i] = engine.mems_positions[segments - 1]
+                if engine.on_move is not None:
+                    engine.on_move(*fuses)
+
+                nb_frames = self._collect(epoch, command_time + self.settle_time, outputs)
+                if nb_frames is None:
+                    return None
+
+                # The next move runs while the current point is processed
+                future = None
+                if i + 1 < nb_points:
+                    if executor is not None:
+                        future = executor.submit(self._move, segments, positions[i + 1])
+                    else:
+                        move = self._move(segments, positions[i + 1])
+
+                if nb_frames == 0:
+                    self.nb_timeouts += 1
+                    self.timed_out.append(i)
+                    engine.scan_errors.append(TimeoutError(
+                        'No frame of the settled mirror at point %s of the scan (positions %s)' %
+                        (i, np.round(positions[i], 3).tolist())))
+                else:
+                    self._reduce(nb_frames)
+                    fluxes[i] = self._fluxes[outputs - 1]
+                    if keep_frames:
+                        frames[i] = self._sum
+                    if keep_spectra:
+                        extractor.extract(self._sum, spectra[i])
+                if future is not None:
+                    move = future.result()
+                if on_point is not None:
+                    on_point(i, reached[i], fluxes[i])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            if own_acquisition:
+                engine.stop_acquisition()
+        return reached, fluxes, frames, spectra
+
+    def _move(self, segments, positions):
+        """Command the mirror without calling ``on_move`` (it may run in the worker thread).
+        """
+        engine = self.engine
+        engine.mems_values[segments - 1] = positions
+        fuses = engine.move_mirror(notify=False)
+        return engine.command_epoch, engine.command_time, fuses
+
+    def _collect(self, epoch, ready_time, outputs):
+        """Sum the settled frames of an epoch in ``_sum``.
+
+        The timeout starts once the mirror is settled and is extended by the time the camera
+        needs to acquire the frames of the point.
+
+        :return: number of summed frames (0 after a timeout), `None` if aborted.
+        """
+        engine = self.engine
+        buffer = engine.frame_buffer
+        settled = self.settle_tolerance is None
+        history = []
+        nb_frames = 0
+        nb_needed = self.nb_frames + (0 if settled else self.settle_frames)
+        deadline = max(time.time(), ready_time) + self.timeout + nb_needed * self.frame_interval()
+        while nb_frames < self.nb_frames:
+            if engine._aborted:
+                return None
+            if time.time() > deadline:
+                return 0
+            if self._next_index >= buffer.count:
+                engine.wait(self.poll_interval)
+                continue
+            result = buffer.read_frame(self._next_index, self._frame)
+            self._next_index += 1
+            if result is None:
+                # Overwritten, the scheduler is late: jump to the oldest kept frame
+                self._next_index = max(self._next_index, buffer.count - buffer.nb_slots + 1)
+                continue
+            _, timestamp, frame_epoch = result
+            if frame_epoch != epoch or timestamp < ready_time:
+                continue
+
+            if not settled:
+                history.append(self._frame_fluxes(outputs))
+                history = history[-self.settle_frames:]
+                if len(history) == self.settle_frames:
+                    history_array = np.array(history)
+                    scale = np.maximum(np.abs(history_array.mean(0)), np.finfo(float).tiny)
+                    settled = np.all(np.ptp(history_array, 0) <= self.settle_tolerance * scale)
+                continue
+
+            if nb_frames == 0:
+                self._sum[:] = self._frame
+            else:
+                self._sum += self._frame
+            nb_frames += 1
+        return nb_frames
+
+    def frame_interval(self):
+        """Time between two frames: the period of the camera, or of the acquisition if it is slower.
+
+        :rtype: float
+        """
+        interval = 1. / abs(self.engine.acquisition_fps)
+        measured = self.engine.frame_buffer.frame_interval()
+        return interval if measured is None else max(interval, measured)
+
+    def _frame_fluxes(self, outputs):
+        """Fluxes of outputs in the last read frame, to detect the settling.
+        """
+        if self.engine.subtract_dark:
+            np.subtract(self._frame, self.engine.dark, out=self._frame)
+        self._extract(self._frame)
+        return self._fluxes[outputs - 1].copy()
+
+    def _reduce(self, nb_frames):
+        """Average, subtract the dark and extract the outputs of the summed frames.
+        """
+        self._sum *= self._sum.dtype.type(1. / nb_frames)
+        if self.engine.subtract_dark:
+            np.subtract(self._sum, self.engine.dark, out=self._sum)
+        self._extract(self._sum)
+
+    def _extract(self, frame):
+        roi_index = self.engine.roi_index
+        if self._fluxes is None or self._fluxes.size != roi_index.nb_outputs:
+            self._spectra, self._fluxes = roi_index.extract(frame)
+        else:
+            roi_index.extract(frame, self._spectra, self._fluxes)
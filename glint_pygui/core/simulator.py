@@ -0,0 +1,214 @@
+import threading
+import time
+import numpy as np
+from .layout import RoiLayout, BEAM_SEGMENTS, NULL_BEAMS
+
+
+class SimulatedIrisAO(object):
+    """Stand-in for the IrisAO python API, without hardware.
+
+    It provides the functions used by ``MemsControl`` so that
+    ``MemsControl(SimulatedIrisAO(37), None, 37)`` behaves like a connected mirror.
+    Like the real mirror, the positions set with ``SetMirrorPositionArray`` are applied
+    only when ``MirrorCommand`` is called with ``MirrorSendSettings``.
+    Each command and each reading of the positions waits ``latency`` seconds.
+    """
+    MirrorSendSettings = 'send'
+    MirrorInitSettings = 'init'
+
+    def __init__(self, nb_segments, latency=0., stroke=2.5):
+        """
+        :param nb_segments: number of segments of the mirror.
+        :type nb_segments: int
+        :param latency: time in second taken by a command or a reading, defaults to 0.
+        :type latency: float, optional
+        :param stroke: maximum absolute piston/tip/tilt in um/mrad/mrad, the positions
+                    beyond it are flagged as not reachable, defaults to 2.5
+        :type stroke: float, optional
+        """
+        self.nb_segments = nb_segments
+        self.latency = latency
+        self.stroke = stroke
+        self.positions = np.zeros((nb_segments, 3), dtype=np.float32)
+        self.nb_commands = 0
+        self._pending = np.zeros((nb_segments, 3), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def SetMirrorPositionArray(self, mirror, Segments, PTT):
+        Segments = np.asarray(Segments, dtype=np.uint32)
+        PTT = np.asarray(PTT, dtype=np.float32)
+        if PTT.shape != (Segments.size, 3):
+            raise ValueError('PTT must be of shape (%s, 3)' % Segments.size)
+        with self._lock:
+            self._pending[Segments.astype(int) - 1] = PTT
+
+    def GetMirrorPositionArray(self, mirror, Segments, PTT=None):
+        self._wait()
+        Segments = np.asarray(Segments, dtype=np.uint32).astype(int)
+        with self._lock:
+            positions = self.positions[Segments - 1]
+        if PTT is not None:
+            PTT[:] = positions
+            positions = PTT
+        locked = np.ones(Segments.size, dtype=bool)
+        reachable = np.all(np.abs(positions) <= self.stroke, axis=1)
+        return positions, locked, reachable
+
+    def MirrorCommand(self, mirror, command):
+        self._wait()
+        with self._lock:
+            if command == self.MirrorSendSettings:
+                self.positions[:] = self._pending
+            elif command == self.MirrorInitSettings:
+                self._pending[:] = 0.
+                self.positions[:] = 0.
+            else:
+                raise ValueError('Unknown command %s' % command)
+            self.nb_commands += 1
+
+    def MirrorRelease(self, mirror):
+        return 0
+
+    def get_state(self):
+        """Copy of the positions currently applied on the mirror.
+
+        :rtype: array
+        """
+        with self._lock:
+            return self.positions.copy()
+
+
+class FrameSimulator(object):
+    """Synthetic frames of the chip, driven by a simulated mirror.
+
+    The 16 outputs are dispersed traces laid out as in ``RoiLayout``.
+    The injection of a beam is a Gaussian function of the tip/tilt of its segment
+    around an optimum, the photometric output Pk sees the injection of the beam k.
+    The null Nk and its antinull N(k+6) see the fringes of their two beams,
+    of period the wavelength of the column in piston units, around a chromatic offset.
+    Photon and read noises are added.
+
+    It has the ``read`` and ``close`` methods of a ``FrameSource``,
+    each reading gives a new frame.
+    """
+    def __init__(self, mirror, layout=None, frame_shape=(344, 96), flux=2000., bias=200.,
+                 read_noise=10., photon_noise=True, wavelength_range=(1.4, 1.7), tt_width=0.8,
+                 visibility=0.98, seed=None):
+        """
+        :param mirror: simulated mirror, its applied positions are given by ``get_state()``.
+        :type mirror: SimulatedIrisAO
+        :param layout: geometry of the outputs, defaults to the default ``RoiLayout``.
+        :type layout: RoiLayout, optional
+        :param frame_shape: shape (rows, columns) of the frames, defaults to (344, 96)
+        :type frame_shape: tuple, optional
+        :param flux: peak count of a photometric output at full injection, defaults to 2000.
+        :type flux: float, optional
+        :param bias: offset of the detector, defaults to 200.
+        :type bias: float, optional
+        :param read_noise: standard deviation of the read noise, defaults to 10.
+        :type read_noise: float, optional
+        :param photon_noise: add the photon noise, defaults to True
+        :type photon_noise: bool, optional
+        :param wavelength_range: wavelengths (um) at the edges of the traces, defaults to (1.4, 1.7)
+        :type wavelength_range: tuple, optional
+        :param tt_width: standard deviation in mrad of the injection versus tip/tilt, defaults to 0.8
+        :type tt_width: float, optional
+        :param visibility: visibility of the fringes, defaults to 0.98
+        :type visibility: float, optional
+        :param seed: seed of the optima, the offsets and the noise, defaults to None
+        :type seed: int, optional
+        """
+        self.mirror = mirror
+        self.layout = RoiLayout() if layout is None else layout
+        self.frame_shape = tuple(frame_shape)
+        self.flux = flux
+        self.bias = bias
+        self.read_noise = read_noise
+        self.photon_noise = photon_noise
+        self.tt_width = tt_width
+        self.visibility = visibility
+        self.frame_count = 0
+        self._rng = np.random.default_rng(seed)
+
+        # Unknown optima the scans have to find
+        self.tt_optimum = self._rng.uniform(-1., 1., (len(BEAM_SEGMENTS), 2))
+        self.piston_offset = self._rng.uniform(-0.5, 0.5, len(BEAM_SEGMENTS))
+
+        # Spatial templates of the traces
+        rects = np.array(self.layout.rects, dtype=float)
+        rows = np.arange(self.frame_shape[0])
+        cols = np.arange(self.frame_shape[1])
+        centers = rects[:, 1] + rects[:, 3] / 2.
+        self._row_profiles = np.exp(-0.5 * ((rows[:, None] - centers[None, :]) / (rects[None, :, 3] / 6.))**2)
+        position = (cols[None, :] - rects[:, 0, None]) / np.maximum(rects[:, 2, None] - 1, 1)
+        inside = (position >= 0) & (position <= 1)
+        self._envelopes = np.where(inside, np.sin(np.pi * np.clip(position, 0, 1))**0.5, 0.)
+        self.wavelengths = wavelength_range[0] + np.clip(position, 0, 1) * (wavelength_range[1] - wavelength_range[0])
+
+        names = self.layout.names
+        self._photometric = np.array([names.index('P%s' % (k + 1)) for k in range(len(BEAM_SEGMENTS))])
+        self._nulls = np.array([names.index('N%s' % k) for k in sorted(NULL_BEAMS)])
+        self._antinulls = np.array([names.index('N%s' % (k + 6)) for k in sorted(NULL_BEAMS)])
+        self._pairs = np.array([NULL_BEAMS[k] for k in sorted(NULL_BEAMS)]) - 1
+
+    def injections(self, positions):
+        """Injection of the beams for given positions of the mirror.
+
+        :param positions: positions (piston, tip, tilt) of all the segments.
+        :type positions: array
+        :return: injection between 0 and 1 of each beam.
+        :rtype: array
+        """
+        tt = positions[np.array(BEAM_SEGMENTS) - 1, 1:]
+        return np.exp(-0.5 * np.sum((tt - self.tt_optimum)**2, 1) / self.tt_width**2)
+
+    def spectra(self, positions):
+        """Noiseless spectra of all the outputs for given positions of the mirror.
+
+        :param positions: positions (piston, tip, tilt) of all the segments.
+        :type positions: array
+        :return: spectra of shape (outputs, columns).
+        :rtype: array
+        """
+        eta = self.injections(positions)
+        pistons = positions[np.array(BEAM_SEGMENTS) - 1, 0] + self.piston_offset
+        spectra = np.zeros_like(self._envelopes)
+
+        spectra[self._photometric] = eta[:, None]
+        beam1, beam2 = self._pairs[:, 0], self._pairs[:, 1]
+        phases = 2 * np.pi * (pistons[beam1] - pistons[beam2])[:, None] / self.wavelengths[self._nulls]
+        mean = (eta[beam1] + eta[beam2])[:, None] / 2.
+        fringes = self.visibility * np.sqrt(eta[beam1] * eta[beam2])[:, None] * np.cos(phases)
+        spectra[self._nulls] = mean - fringes
+        spectra[self._antinulls] = mean + fringes
+
+        spectra *= self.flux * self._envelopes
+        return spectra
+
+    def read(self, force=False):
+        """Generate the frame for the current positions of the mirror.
+
+        :param force: unused, for compatibility with ``FrameSource``.
+        :type force: bool, optional
+        :rtype: array of uint16
+        """
+        frame = self._row_profiles @ self.spectra(self.mirror.get_state().astype(float))
+        if self.photon_noise:
+            frame += np.sqrt(frame) * self._rng.standard_normal(self.frame_shape)
+        frame += self.bias + self.read_noise * self._rng.standard_normal(self.frame_shape)
+        self.frame_count += 1
+        return np.clip(np.around(frame), 0, 2**16 - 1).astype(np.uint16)
+
+    def settings(self):
+        """Settings of the simulated camera, for compatibility with ``FrameSource``.
+
+        :rtype: dict
+        """
+        return {'simulation': True, 'bias': self.bias, 'read_noise': self.read_noise}
+
+    def close(self):
+        pass
@@ -0,0 +1,256 @@
+import json
+import numpy as np
+
+# Wavelengths (um) at the edges of the traces, without calibration
+DEFAULT_WAVELENGTH_RANGE = (1.4, 1.7)
+
+
+class WavelengthSolution(object):
+    """Wavelength of each column of the detector, for each output.
+
+    The wavelength of an output is a polynomial of the column of the detector.
+    It is saved in and loaded from a JSON file so that a new spectral calibration
+    does not require to edit the code.
+    """
+    def __init__(self, coefficients):
+        """
+        :param coefficients: polynomial coefficients of each output, highest degree first
+                            (as given by ``np.polyfit``), the wavelengths are in um.
+        :type coefficients: list
+        """
+        self.coefficients = [list(np.atleast_1d(np.asarray(elt, dtype=float))) for elt in coefficients]
+
+    @classmethod
+    def linear(cls, rects, wavelength_range=DEFAULT_WAVELENGTH_RANGE):
+        """Wavelengths varying linearly from one edge of each output to the other.
+
+        :param rects: list of (x, y, width, height) of the outputs.
+        :type rects: list
+        :param wavelength_range: wavelengths at the first and the last columns of the outputs,
+                                defaults to ``DEFAULT_WAVELENGTH_RANGE``
+        :type wavelength_range: tuple, optional
+        :rtype: WavelengthSolution
+        """
+        coefficients = []
+        for x, _, width, _ in rects:
+            slope = (wavelength_range[1] - wavelength_range[0]) / max(width - 1, 1)
+            coefficients.append([slope, wavelength_range[0] - slope * x])
+        return cls(coefficients)
+
+    @classmethod
+    def fit(cls, columns, wavelengths, degree=2):
+        """Fit the solution on the columns of known spectral lines.
+
+        :param columns: columns of the lines in each output.
+        :type columns: list of arrays
+        :param wavelengths: wavelengths of the lines in each output.
+        :type wavelengths: list of arrays
+        :param degree: degree of the polynomials, defaults to 2
+        :type degree: int, optional
+        :rtype: WavelengthSolution
+        """
+        return cls([np.polyfit(x, y, degree) for x, y in zip(columns, wavelengths)])
+
+    @classmethod
+    def load(cls, path):
+        """Load a solution from a JSON file.
+
+        :param path: path to the file.
+        :type path: string
+        :rtype: WavelengthSolution
+        """
+        with open(path, 'r') as f:
+            return cls(json.load(f)['coefficients'])
+
+    def save(self, path):
+        """Save the solution in a JSON file.
+
+        :param path: path to the file.
+        :type path: string
+        """
+        with open(path, 'w') as f:
+            json.dump({'coefficients': self.coefficients}, f, indent=4)
+
+    def evaluate(self, columns):
+        """Wavelengths of columns of each output.
+
+        :param columns: columns of shape (outputs, n).
+        :type columns: array
+        :return: wavelengths of shape (outputs, n).
+        :rtype: array
+        """
+        if len(self.coefficients) != len(columns):
+            raise ValueError('%s outputs but %s polynomials' % (len(columns), len(self.coefficients)))
+        return np.array([np.polyval(coefs, cols) for coefs, cols in zip(self.coefficients, columns)])
+
+
+class SpectralExtractor(object):
+    """Spectra of all the outputs on a common wavelength grid, in one pass per frame.
+
+    The pixels of the outputs are gathered with the index of a ``RoiIndex``, then each
+    column is reduced with optimal-extraction weights (Horne 1986): for a spatial profile
+    P (normalised over the rows of the output) and a pixel variance V, the flux of a column is
+    ``sum(P * D / V) / sum(P**2 / V)``. The variance is that of the dark (read noise) and
+    does not depend on the signal, so the weights are computed once and a frame costs a product
+    and a sum. Without profile, the rows are weighted uniformly: this is the sum of the column.
+    The column spectra are then interpolated on the wavelength grid with indices and
+    coefficients also computed once.
+
+    The buffers are reused: one extractor is used by one thread (see ``copy``).
+    """
+    def __init__(self, roi_index, solution, wavelengths=None, profiles=None, noise=None):
+        """
+        :param roi_index: extraction index of the outputs.
+        :type roi_index: RoiIndex
+        :param solution: wavelength of the columns of each output.
+        :type solution: WavelengthSolution
+        :param wavelengths: common wavelength grid, defaults to the range covered by all the outputs,
+                            with as many points as the widest one.
+        :type wavelengths: array, optional
+        :param profiles: spatial profiles of the outputs, of shape (outputs, rows), defaults to None
+        :type profiles: array, optional
+        :param noise: standard deviation of each pixel of the frame in the dark, defaults to None
+        :type noise: array, optional
+        """
+        self.roi_index = roi_index
+        self.solution = solution
+        rects = roi_index.rects
+        shape = roi_index.shape
+        columns = rects[:, 0, None] + np.arange(shape[2])
+        in_output = np.arange(shape[2]) < rects[:, 2, None]
+        column_wavelengths = np.where(in_output, solution.evaluate(columns), np.nan)
+        self.column_wavelengths = column_wavelengths
+
+        if wavelengths is None:
+            start = np.max(np.nanmin(column_wavelengths, 1))
+            stop = np.min(np.nanmax(column_wavelengths, 1))
+            wavelengths = np.linspace(start, stop, rects[:, 2].max())
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self._interpolation(column_wavelengths)
+
+        self.profiles = None
+        self.noise = None
+        self.set_weights(profiles, noise)
+        self._cube = None
+
+    @property
+    def nb_outputs(self):
+        return self.roi_index.nb_outputs
+
+    @property
+    def nb_wavelengths(self):
+        return self.wavelengths.size
+
+    def _interpolation(self, column_wavelengths):
+        """Flat indices and coefficients of the linear interpolation on the wavelength grid.
+        """
+        nb_outputs, width = column_wavelengths.shape
+        positions = np.zeros((nb_outputs, self.wavelengths.size))
+        for k, wl in enumerate(column_wavelengths):
+            valid = np.flatnonzero(~np.isnan(wl))
+            order = np.argsort(wl[valid])
+            # Fractional column of each wavelength, clipped to the output
+            positions[k] = np.interp(self.wavelengths, wl[valid][order], valid[order].astype(float))
+        lower = np.clip(np.floor(positions).astype(int), 0, width - 2 if width > 1 else 0)
+        self._lower = lower + np.arange(nb_outputs)[:, None] * width
+        self._upper = np.minimum(lower + 1, width - 1) + np.arange(nb_outputs)[:, None] * width
+        self._fraction = (positions - lower).astype(np.float32)
+
+    def set_weights(self, profiles=None, noise=None):
+        """Compute the extraction weights.
+
+        :param profiles: spatial profiles of the outputs, of shape (outputs, rows), `None` for uniform profiles.
+        :type profiles: array, optional
+        :param noise: standard deviation of each pixel of the frame in the dark, `None` for a uniform noise.
+        :type noise: array, optional
+        """
+        roi_index = self.roi_index
+        valid = np.ones(roi_index.shape, dtype=bool) if roi_index._valid is None else roi_index._valid
+        if profiles is None:
+            profile = np.ones(roi_index.shape)
+        else:
+            profile = np.repeat(np.asarray(profiles, dtype=float)[:, :, None], roi_index.shape[2], 2)
+        if noise is None:
+            inverse_variance = np.ones(roi_index.shape)
+        else:
+            variance = np.asarray(noise, dtype=float).reshape(-1)[roi_index._indices]**2
+            inverse_variance = 1. / np.maximum(variance, np.finfo(np.float32).tiny)
+        profile = np.where(valid, np.maximum(profile, 0.), 0.)
+        # Profile normalised over the valid pixels of each column
+        profile /= np.maximum(profile.sum(1, keepdims=True), np.finfo(float).tiny)
+        norm = np.sum(profile**2 * inverse_variance, 1, keepdims=True)
+        self._weights = (profile * inverse_variance / np.maximum(norm, np.finfo(float).tiny)).astype(np.float32)
+        self.profiles = None if profiles is None else np.array(profiles, dtype=float)
+        self.noise = noise
+        self._cube = None
+
+    def spectral_noise(self):
+        """Standard deviation of the extracted spectra due to the noise of the pixels in the dark.
+
+        :return: noise of shape (outputs, wavelengths), `None` without noise.
+        :rtype: array
+        """
+        if self.noise is None:
+            return None
+        variance = np.asarray(self.noise, dtype=float).reshape(-1)[self.roi_index._indices]**2
+        columns = np.sum(self._weights.astype(float)**2 * variance, 1).reshape(-1)
+        fraction = self._fraction.astype(float)
+        # The interpolated columns are independent
+        return np.sqrt((1 - fraction)**2 * columns[self._lower] + fraction**2 * columns[self._upper])
+
+    def fit_profiles(self, frame):
+        """Measure the spatial profiles of the outputs on a bright dark-subtracted frame and use them.
+
+        The traces are straight along the columns: the profile of an output is the sum of its columns.
+
+        :param frame: dark-subtracted frame with all outputs illuminated.
+        :type frame: array
+        :return: profiles of shape (outputs, rows).
+        :rtype: array
+        """
+        cube = self.roi_index.gather(np.asarray(frame, dtype=float))
+        profiles = np.maximum(cube.sum(2), 0.)
+        self.set_weights(profiles, self.noise)
+        return self.profiles
+
+    def copy(self):
+        """Extractor sharing the weights and the wavelengths, with its own buffers, e.g. for another thread.
+
+        :rtype: SpectralExtractor
+        """
+        other = object.__new__(SpectralExtractor)
+        other.__dict__.update(self.__dict__)
+        other._cube = None
+        return other
+
+    def extract(self, frame, out=None):
+        """Spectra of all the outputs.
+
+        :param frame: contiguous dark-subtracted frame.
+        :type frame: array
+        :param out: array of shape (outputs, wavelengths) in which the spectra are written, defaults to None
+        :type out: array, optional
+        :return: spectra of shape (outputs, wavelengths), flux per spectral channel.
+        :rtype: array
+        """
+        frame = np.ascontiguousarray(frame)
+        if self._cube is None or self._cube.dtype != frame.dtype:
+            self._cube = np.zeros(self.roi_index.shape, dtype=frame.dtype)
+            self._cube_weights = self._weights.astype(frame.dtype)
+            self._columns = np.zeros((self.nb_outputs, self.roi_index.shape[2]), dtype=frame.dtype)
+            self._lower_values = np.zeros(self._lower.shape, dtype=frame.dtype)
+            self._upper_values = np.zeros(self._lower.shape, dtype=frame.dtype)
+            self._cube_fraction = self._fraction.astype(frame.dtype)
+        if out is None:
+            out = np.zeros((self.nb_outputs, self.nb_wavelengths), dtype=frame.dtype)
+
+        self.roi_index.gather(frame, self._cube)
+        np.multiply(self._cube, self._cube_weights, out=self._cube)
+        np.sum(self._cube, 1, out=self._columns)
+        np.take(self._columns.reshape(-1), self._lower, out=self._lower_values, mode='clip')
+        np.take(self._columns.reshape(-1), self._upper, out=self._upper_values, mode='clip')
+        # lower + fraction * (upper - lower)
+        np.subtract(self._upper_values, self._lower_values, out=self._upper_values)
+        np.multiply(self._upper_values, self._cube_fraction, out=self._upper_values)
+        np.add(self._lower_values, self._upper_values, out=out)
+        return out
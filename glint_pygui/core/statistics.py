@@ -0,0 +1,273 @@
+import time
+import numpy as np
+
+
+class RollingSeries(object):
+    """Last values of several time series, in a circular buffer, with their rolling statistics.
+
+    A new sample of all the series costs the same whatever the width of the window:
+    it overwrites the oldest one and the mean and the variance of the window are updated
+    with the difference between the two (Welford's update for a sliding window).
+    The minimum and the maximum are computed when they are asked, in one vectorized pass,
+    i.e. at the rate of the display and not of the frames.
+    """
+    def __init__(self, nb_series, width):
+        """
+        :param nb_series: number of series, e.g. the outputs of the chip.
+        :type nb_series: int
+        :param width: number of samples in the window.
+        :type width: int
+        """
+        self.nb_series = nb_series
+        self._allocate(width)
+
+    def _allocate(self, width):
+        self.width = max(1, int(width))
+        self.data = np.zeros((self.width, self.nb_series))
+        # Index of the next sample since the creation of the buffer
+        self.count = 0
+        self._mean = np.zeros(self.nb_series)
+        self._m2 = np.zeros(self.nb_series)
+        self._pushes_since_sync = 0
+
+    def __len__(self):
+        return min(self.count, self.width)
+
+    def clear(self):
+        """Forget all the samples.
+        """
+        self._allocate(self.width)
+
+    def push(self, values):
+        """Add a sample of all the series.
+
+        :param values: values of the series, of shape (nb_series,).
+        :type values: array
+        """
+        values = np.asarray(values, dtype=float)
+        idx = self.count % self.width
+        if self.count < self.width:
+            # Window not full yet: usual Welford's update
+            n = self.count + 1
+            delta = values - self._mean
+            self._mean += delta / n
+            self._m2 += delta * (values - self._mean)
+        else:
+            old = self.data[idx]
+            mean = self._mean + (values - old) / self.width
+            self._m2 += (values - old) * (values - mean + old - self._mean)
+            self._mean = mean
+        self.data[idx] = values
+        self.count += 1
+
+        # Get rid of the rounding errors accumulated by the updates
+        self._pushes_since_sync += 1
+        if self._pushes_since_sync >= 64 * self.width:
+            filled = self.data[:len(self)]
+            self._mean = filled.mean(0)
+            self._m2 = ((filled - self._mean)**2).sum(0)
+            self._pushes_since_sync = 0
+
+    def resize(self, width):
+        """Change the width of the window, the most recent samples are kept.
+
+        :param width: new number of samples in the window.
+        :type width: int
+        """
+        width = max(1, int(width))
+        if width == self.width:
+            return
+        kept = self.values()[-width:]
+        self._allocate(width)
+        for values in kept:
+            self.push(values)
+
+    def values(self, series=None):
+        """Samples of the window, from the oldest to the newest.
+
+        :param series: index of the series, all of them if `None`, defaults to None
+        :type series: int, optional
+        :return: array of shape (samples,) or (samples, nb_series).
+        :rtype: array
+        """
+        columns = slice(None) if series is None else series
+        if self.count <= self.width:
+            return self.data[:self.count, columns].copy()
+        idx = self.count % self.width
+        return np.concatenate((self.data[idx:, columns], self.data[:idx, columns]))
+
+    def last(self):
+        """Most recent sample of all the series, `None` if empty.
+
+        :rtype: array
+        """
+        if self.count == 0:
+            return None
+        return self.data[(self.count - 1) % self.width].copy()
+
+    def mean(self):
+        """Mean of each series over the window.
+
+        :rtype: array
+        """
+        return self._mean.copy()
+
+    def std(self):
+        """Standard deviation of each series over the window.
+
+        :rtype: array
+        """
+        if self.count == 0:
+            return np.zeros(self.nb_series)
+        return np.sqrt(np.maximum(self._m2, 0.) / len(self))
+
+    def minimum(self):
+        """Minimum of each series over the window.
+
+        :rtype: array
+        """
+        if self.count == 0:
+            return np.zeros(self.nb_series)
+        return self.data[:len(self)].min(0)
+
+    def maximum(self):
+        """Maximum of each series over the window.
+
+        :rtype: array
+        """
+        if self.count == 0:
+            return np.zeros(self.nb_series)
+        return self.data[:len(self)].max(0)
+
+
+class DecimatedHistory(object):
+    """Long history of several time series in a fixed memory, at several resolutions.
+
+    Level 0 keeps the last ``level_size`` samples, level k keeps ``level_size`` bins of
+    ``factor**k`` samples each with their mean time, mean, minimum and maximum.
+    The coarsest level covers ``level_size * factor**(nb_levels - 1)`` samples, e.g. about
+    46 hours at 50 Hz with the default values, in 4 MB for 16 series.
+
+    A plot asks for the finest level giving at most ``max_points`` points over its window,
+    so a window of hours costs the same to display as a window of seconds.
+    """
+    def __init__(self, nb_series, level_size=2048, factor=8, nb_levels=5):
+        """
+        :param nb_series: number of series, e.g. the outputs of the chip.
+        :type nb_series: int
+        :param level_size: number of bins kept at each level, defaults to 2048
+        :type level_size: int, optional
+        :param factor: number of bins of a level gathered in one bin of the next level, defaults to 8
+        :type factor: int, optional
+        :param nb_levels: number of levels, defaults to 5
+        :type nb_levels: int, optional
+        """
+        self.nb_series = nb_series
+        self.level_size = level_size
+        self.factor = factor
+        self.nb_levels = nb_levels
+        self.times = np.zeros((nb_levels, level_size))
+        self.means = np.zeros((nb_levels, level_size, nb_series))
+        self.minima = np.zeros((nb_levels, level_size, nb_series))
+        self.maxima = np.zeros((nb_levels, level_size, nb_series))
+        # Number of bins written in each level since the creation
+        self.counts = np.zeros(nb_levels, dtype=int)
+
+        # Bins of the levels 1 and more being filled
+        self._pending_nb = np.zeros(nb_levels, dtype=int)
+        self._pending_time = np.zeros(nb_levels)
+        self._pending_sum = np.zeros((nb_levels, nb_series))
+        self._pending_min = np.zeros((nb_levels, nb_series))
+        self._pending_max = np.zeros((nb_levels, nb_series))
+
+    @property
+    def nb_samples(self):
+        """Number of samples pushed since the creation.
+        """
+        return int(self.counts[0])
+
+    def push(self, values, timestamp=None):
+        """Add a sample of all the series.
+
+        The cost is that of a few copies of the sample on average, whatever the length of the history.
+
+        :param values: values of the series, of shape (nb_series,).
+        :type values: array
+        :param timestamp: time of the sample in second, defaults to now.
+        :type timestamp: float, optional
+        """
+        values = np.asarray(values, dtype=float)
+        timestamp = time.time() if timestamp is None else timestamp
+        self._write(0, timestamp, values, values, values)
+
+    def _write(self, level, timestamp, mean, minimum, maximum):
+        idx = self.counts[level] % self.level_size
+        self.times[level, idx] = timestamp
+        self.means[level, idx] = mean
+        self.minima[level, idx] = minimum
+        self.maxima[level, idx] = maximum
+        self.counts[level] += 1
+
+        upper = level + 1
+        if upper == self.nb_levels:
+            return
+        if self._pending_nb[upper] == 0:
+            self._pending_time[upper] = 0.
+            self._pending_sum[upper] = 0.
+            self._pending_min[upper] = minimum
+            self._pending_max[upper] = maximum
+        else:
+            np.minimum(self._pending_min[upper], minimum, out=self._pending_min[upper])
+            np.maximum(self._pending_max[upper], maximum, out=self._pending_max[upper])
+        self._pending_time[upper] += timestamp
+        self._pending_sum[upper] += mean
+        self._pending_nb[upper] += 1
+        if self._pending_nb[upper] == self.factor:
+            self._pending_nb[upper] = 0
+            self._write(upper, self._pending_time[upper] / self.factor, self._pending_sum[upper] / self.factor,
+                        self._pending_min[upper].copy(), self._pending_max[upper].copy())
+
+    def choose_level(self, nb_samples, max_points=1000):
+        """Finest level showing ``nb_samples`` samples in at most ``max_points`` bins.
+
+        :rtype: int
+        """
+        for level in range(self.nb_levels):
+            nb_bins = -(-nb_samples // self.factor**level)
+            if nb_bins <= min(max_points, self.level_size):
+                return level
+        return self.nb_levels - 1
+
+    def select(self, nb_samples, series=None, max_points=1000):
+        """Last ``nb_samples`` samples, decimated to at most ``max_points`` bins.
+
+        The bin being filled at the chosen level is included, so the most recent samples are shown.
+
+        :param nb_samples: number of samples covered by the window.
+        :type nb_samples: int
+        :param series: index of the series, all of them if `None`, defaults to None
+        :type series: int, optional
+        :param max_points: maximum number of bins returned, defaults to 1000
+        :type max_points: int, optional
+        :return: tuple of the times, means, minima and maxima of the bins from the oldest to
+                the newest, and the number of samples per bin.
+        :rtype: tuple
+        """
+        level = self.choose_level(nb_samples, max_points)
+        columns = slice(None) if series is None else series
+        nb_bins = min(-(-nb_samples // self.factor**level), self.counts[level], self.level_size)
+        slots = np.arange(self.counts[level] - nb_bins, self.counts[level]) % self.level_size
+        times = self.times[level, slots]
+        means = self.means[level, slots][:, columns]
+        minima = self.minima[level, slots][:, columns]
+        maxima = self.maxima[level, slots][:, columns]
+
+        nb_pending = self._pending_nb[level] if level > 0 else 0
+        if nb_pending > 0:
+            times = np.append(times, self._pending_time[level] / nb_pending)
+            means = np.concatenate((means, [self._pending_sum[level, columns] / nb_pending]))
+            minima = np.concatenate((minima, [self._pending_min[level, columns]]))
+            maxima = np.concatenate((maxima, [self._pending_max[level, columns]]))
+            if 0 < nb_bins < times.size:
+                times, means, minima, maxima = times[1:], means[1:], minima[1:], maxima[1:]
+        return times, means, minima, maxima, self.factor**level
@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.interpolate import RectBivariateSpline, griddata
+
+
+def mean_tt_map(tt_maps):
+    """Average of TT maps ignoring the NaN fluxes (e.g. points of a scan without frame).
+
+    :param tt_maps: maps of shape (loops, tips, tilts).
+    :type tt_maps: array
+    :return: map of shape (tips, tilts), NaN where no loop has a valid flux.
+    :rtype: array
+    """
+    tt_maps = np.asarray(tt_maps, dtype=float)
+    valid = np.isfinite(tt_maps)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, tt_maps, 0.).sum(0) / valid.sum(0)
+
+
+def interp_tt_map(ttx, tty, tt_map, ttx_interp, tty_interp, min_valid=0.5):
+    """Interpolate a TT map on a finer grid and locate its maximum.
+
+    The map is interpolated with a bicubic spline (of lower degree if there are fewer
+    than 4 points along an axis), like the former ``scipy.interpolate.interp2d(kind='cubic')``.
+    The NaN fluxes (e.g. points of a scan without frame) are replaced by the nearest valid flux.
+
+    :param ttx: tips of the scanned grid, increasing.
+    :type ttx: array
+    :param tty: tilts of the scanned grid, increasing.
+    :type tty: array
+    :param tt_map: fluxes of shape (tips, tilts).
+    :type tt_map: array
+    :param ttx_interp: tips of the interpolated map.
+    :type ttx_interp: array
+    :param tty_interp: tilts of the interpolated map.
+    :type tty_interp: array
+    :param min_valid: smallest fraction of valid fluxes in the map, defaults to 0.5
+    :type min_valid: float, optional
+    :return: tuple of the interpolated map of shape (tilts, tips) and the (tip, tilt) of its maximum.
+    :rtype: tuple
+    :raises ValueError: if the fraction of valid fluxes is below ``min_valid``.
+    """
+    ttx = np.asarray(ttx, dtype=float)
+    tty = np.asarray(tty, dtype=float)
+    tt_map = np.array(tt_map, dtype=float)
+    valid = np.isfinite(tt_map)
+    if valid.sum() == 0 or valid.mean() < min_valid:
+        raise ValueError('Only %s valid fluxes out of %s in the TT map' % (valid.sum(), valid.size))
+    if not valid.all():
+        grid = np.stack(np.meshgrid(ttx, tty, indexing='ij'), -1)
+        tt_map[~valid] = griddata(grid[valid], tt_map[valid], grid[~valid], method='nearest')
+    spline = RectBivariateSpline(ttx, tty, tt_map,
+                                 kx=min(3, ttx.size - 1), ky=min(3, tty.size - 1))
+    map_interp = spline(ttx_interp, tty_interp).T
+    idx_max = np.unravel_index(np.argmax(map_interp), map_interp.shape)
+    return map_interp, (ttx_interp[idx_max[1]], tty_interp[idx_max[0]])
@@ -14,6 +14,7 @@
 # Import C++ boolean type
 from libcpp cimport bool
 from cpython.ref cimport PyObject
+cimport cython
 
 # Create a mirror handle integer type (cython does not manage 
 # c++ pointer type  void*, an integer will be used instead when
@@ -55,8 +56,8 @@ cdef extern from "irisao.mirrors.h":
     # Import functions
     cdef MirrorHandle MirrorConnect (SerialNumber, SerialNumber, HardwareDisabled) except +raise_python_error
     cdef MirrorHandle MirrorRelease(MirrorHandle) except +raise_python_error
-    cdef void SetMirrorPosition(MirrorHandle, SegmentNumber, float, float, float) except +raise_python_error
-    cdef void GetMirrorPosition(MirrorHandle, SegmentNumber, MirrorPosition*) except +raise_python_error
+    cdef void SetMirrorPosition(MirrorHandle, SegmentNumber, float, float, float) except +raise_python_error nogil
+    cdef void GetMirrorPosition(MirrorHandle, SegmentNumber, MirrorPosition*) except +raise_python_error nogil
     cdef void SetModalPosition (MirrorHandle, CoefficientNumber, float) except +raise_python_error
     cdef void MirrorCommand (MirrorHandle, MirrorCommands) except +raise_python_error
 
@@ -106,6 +107,45 @@ def _getMirrorPosition(MirrorHandleInt mirror, list SegmentList, int nbSegments)
         del ptrPosition
         
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _setPositionArray(MirrorHandleInt mirror, const unsigned int[::1] SegmentArray, const float[:, ::1] PTTArray):
+    # Batch version of _setPosition: no Python object per segment, the GIL is released
+    cdef Py_ssize_t i
+    cdef Py_ssize_t nbSegments = SegmentArray.shape[0]
+    cdef MirrorHandle handle = <MirrorHandle>mirror
+    if PTTArray.shape[0] != nbSegments or PTTArray.shape[1] != 3:
+        raise ValueError("PTT array must have the shape (number of segments, 3)")
+    with nogil:
+        for i in range(nbSegments):
+            SetMirrorPosition(handle, SegmentArray[i],
+                              PTTArray[i, 0], PTTArray[i, 1], PTTArray[i, 2])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _getPositionArray(MirrorHandleInt mirror, const unsigned int[::1] SegmentArray,
+                      float[:, ::1] PTTArray, unsigned char[::1] LockedArray, unsigned char[::1] ReachableArray):
+    # Batch version of _getMirrorPosition: the results are written in the given arrays
+    cdef Py_ssize_t i
+    cdef Py_ssize_t nbSegments = SegmentArray.shape[0]
+    cdef MirrorHandle handle = <MirrorHandle>mirror
+    cdef MirrorPosition *ptrPosition
+    if PTTArray.shape[0] != nbSegments or PTTArray.shape[1] != 3 or \
+            LockedArray.shape[0] != nbSegments or ReachableArray.shape[0] != nbSegments:
+        raise ValueError("Output arrays do not match the number of segments")
+    ptrPosition = new MirrorPosition()
+    try:
+        with nogil:
+            for i in range(nbSegments):
+                GetMirrorPosition(handle, SegmentArray[i], ptrPosition)
+                PTTArray[i, 0] = ptrPosition.z
+                PTTArray[i, 1] = ptrPosition.xgrad
+                PTTArray[i, 2] = ptrPosition.ygrad
+                LockedArray[i] = ptrPosition.locked
+                ReachableArray[i] = ptrPosition.reachable
+    finally:
+        del ptrPosition
+
 def _setModalPosition(MirrorHandleInt mirror, list CoefficientValueCouples , int nbCoefficients):
     try:  
         for i in range(nbCoefficients):
@@ -11,6 +11,8 @@
 # - MirrorRelease
 # - SetMirrorPosition
 # - GetMirrorPosition
+# - SetMirrorPositionArray
+# - GetMirrorPositionArray
 # - SetModalPosition
 # - MirrorCommand (supported commands: MirrorInitSettings and MirrorSendSettings)
 #--------------------------------------------------------------
@@ -103,6 +105,44 @@ def GetMirrorPosition(mirror,Segments):
     except:
         raise
   
+def SetMirrorPositionArray(mirror, Segments, PTT):
+    """Function SetMirrorPositionArray
+    Batch version of SetMirrorPosition: the positions are given as arrays
+    and sent without creating any Python object per segment.
+    Arguments:
+    - mirror: mirror handle (int)
+    - Segments: array of segment numbers, converted to contiguous uint32
+    - PTT: array of shape (number of segments, 3) of (z, xgrad, ygrad),
+           converted to contiguous float32"""
+    # numpy is imported here: C-based libraries must be loaded after MirrorConnect
+    import numpy as np
+    Segments = np.ascontiguousarray(Segments, dtype=np.uint32).reshape(-1)
+    PTT = np.ascontiguousarray(PTT, dtype=np.float32).reshape(-1, 3)
+    IAOW._setPositionArray(mirror, Segments, PTT)
+
+def GetMirrorPositionArray(mirror, Segments, PTT=None):
+    """Function GetMirrorPositionArray
+    Batch version of GetMirrorPosition returning arrays.
+    Arguments:
+    - mirror: mirror handle (int)
+    - Segments: array of segment numbers, converted to contiguous uint32
+    - PTT: optional contiguous float32 array of shape (number of segments, 3)
+           in which the positions are written
+    Return: tuple (PTT, locked, reachable)
+    - PTT: float32 array of shape (number of segments, 3) of (z, xgrad, ygrad)
+    - locked: boolean array, one for each segment given
+    - reachable: boolean array, one for each segment given
+    """
+    # numpy is imported here: C-based libraries must be loaded after MirrorConnect
+    import numpy as np
+    Segments = np.ascontiguousarray(Segments, dtype=np.uint32).reshape(-1)
+    if PTT is None:
+        PTT = np.empty((Segments.size, 3), dtype=np.float32)
+    locked = np.empty(Segments.size, dtype=np.uint8)
+    reachable = np.empty(Segments.size, dtype=np.uint8)
+    IAOW._getPositionArray(mirror, Segments, PTT, locked, reachable)
+    return (PTT, locked.view(bool), reachable.view(bool))
+
 def SetModalPosition(mirror,CoefficientValueCouples):
     """Function SetModalPosition
     Arguments:
@@ -12,6 +12,12 @@ DRIVER_NUM = '05160023' # Hardware driver file name
 MEMS_PATH = 'mems/' # Path where the hardware driver and the configuration files are located
 MEMS_NB_SEGMENT = 37 # 37 for PTT111, 169 for PTT489
 PATH_TO_FRAMES = '/mnt/96980F95980F72D3/glintData/rt_test/new.fits'
+PATH_TO_LAYOUT = 'roi_layout.json' # Geometry of the outputs, the default one is used if the file does not exist
+PATH_TO_WAVELENGTHS = 'wavelengths.json' # Wavelength calibration of the outputs, a linear one is used if the file does not exist
+PATH_TO_DARKS = 'darks/' # Master darks and bad-pixel masks, one file per set of detector settings
+PATH_TO_SCANS = 'scans/' # Results of the scans run from a scan file (menu Scans)
+SIMULATION = False # If True, the mirror and the camera are simulated, no hardware nor frame file is needed
+SIMULATION_LATENCY = 0.005 # Time taken by a command of the simulated mirror, in second
 sys.path.append(os.path.abspath(MEMS_PATH))
 """
 End of customization
@@ -22,56 +28,30 @@ MEMS_MAX = 2.5
 MEMS_MIN = -2.5
 TARGET_FPS = 10.
 SCAN_WAIT = 0.1
+SCAN_SETTLE_TOLERANCE = None # Relative change of the fluxes between frames of a settled mirror, None to rely on SCAN_WAIT only
 TTX_MIN, TTX_MAX = -2.5, 2.5
 TTY_MIN, TTY_MAX = -2.5, 2.5
+TT_COARSE_POINTS = 5
 NUM_LOOPS = 1
 SEG_TO_MOVE = 1
 NULL_TO_SCAN = 1
 NULL_RANGE_MIN = -2.5
 NULL_RANGE_MAX = 2.5
 NULL_RANGE_STEP = 0.5
-WAVELENGTH = 1.6
 NUM_DARK_FRAMES = 1
 STEP_SEG = 0
 SEGMENT_ID = 0
-
-def display_error(err_code):
-    """Gather all the hand-made error code which may rise because of MEMS or camera.
-
-    Hand-made error codes to help debugging the software if any issue with the Camera
-    or the MEMS raise.
-    The syntax for the error code for the mirror is MX: M for *mirror* and X the ID of the error.
-
-    Similarly, the syntax for the error code for the camera is CX with C for *Camera*.
-
-    :param err_code: Code of the error.
-    :type err_code: string
-    :return: tuple of messages to return respectively in the history in the GUI and
-            in the terminal.
-    :rtype: tuple
-    """
-    prefix = 'Err '+err_code+': '
-    if err_code == 'M1':
-        history_msg = prefix + 'MEMS connection error'
-        terminal_msg = prefix + 'MEMS initialization failed.'+\
-                        'Restart the GUI and choose to disable HW.'
-    elif err_code == 'M2':
-        history_msg = prefix + 'Flattening failed'
-        terminal_msg = prefix + 'There was an error while'+\
-                        'flattenning the mirror'
-    elif err_code == 'M3':
-        history_msg = prefix + "Error reading position"
-        terminal_msg = prefix + "There was an error reading from the mirror"
-    elif err_code == 'M4':
-        history_msg = prefix + 'Mirror not released'
-        terminal_msg = prefix + 'There was a problem releasing the connection with the mirror'
-    elif err_code == 'M5':
-        history_msg = prefix + 'Error sending positions'
-        terminal_msg = prefix + 'There was a problem sending positions.'
-    else:
-        history_msg = terminal_msg = 'No error code!'
-
-    return (history_msg, terminal_msg)
+FRAME_SHAPE = (344, 96)
+SATURATION_LEVEL = 2**14
+ACQUISITION_FPS = 50.
+RING_BUFFER_SLOTS = 32
+TIME_FLUX_MAX_POINTS = 1000 # Points drawn in the time-flux plot, longer windows are decimated
+RECORD_FORMAT = 'fits' # 'fits' or 'hdf5'
+RECORD_CHUNK_SIZE = 100
+RECORD_QUEUE_SIZE = 500
+RECORD_MAX_FILE_SIZE = 2**31 # bytes
+RECORD_MAX_FILE_DURATION = 3600. # seconds
+RECORD_COMPRESS = False
 
 class WarmUpMems(object):
     def __init__(self, disableHW):
@@ -94,6 +74,11 @@ class WarmUpMems(object):
         # Stay True if there is no issue with the MEMS connection and library
         self.mems_fuse = True
 
+        if SIMULATION:
+            print("Simulated mirror and camera")
+            self.mirror = None
+            return
+
         try:
             self.mirror = IrisAO_API.MirrorConnect(
                 path + mirror_num, path + driver_num, disableHW)
@@ -108,20 +93,25 @@ class WarmUpMems(object):
      
 
 disableHw = True
-resp = input("\nDisable hardware? [Y/n]\n")
-if resp in ['n', 'N']:
-    disableHw = False
+if not SIMULATION:
+    resp = input("\nDisable hardware? [Y/n]\n")
+    if resp in ['n', 'N']:
+        disableHw = False
 warmup_mems = WarmUpMems(disableHw)
 
 import numpy as np
 from matplotlib.backends.backend_qt5agg import (
     NavigationToolbar2QT as NavigationToolbar)
 import matplotlib.pyplot as plt
-from scipy.interpolate import interp2d
-from scipy.optimize import curve_fit
+from scipy.interpolate import griddata
 import pyqtgraph as pg
-from astropy.io import fits
 import datetime
+import threading
+from core import FitsFrameSource, RoiLayout, GlintEngine, DarkLibrary, ScanSpec, NULL_BEAMS
+from core import WavelengthSolution
+from core import ParameterStore, int_parser, limit_parser, optional_parser
+from core import fit_fringes, fringe_model, fringe_minimum, fringe_minimum_error, interp_tt_map, mean_tt_map
+from core import MemsControl, display_error, SimulatedIrisAO, FrameSimulator
 
 plt.ion()
 
@@ -130,10 +120,20 @@ class TableModel(QtCore.QAbstractTableModel):
     The methods are a compilation of what was found on the internet, I don't know how they work but they do.
     """
 
-    def __init__(self, data, mems_comm):
+    def __init__(self, data, mems_comm, positions=None):
+        """
+        :param data: commanded positions of the segments, shape (segments, 3).
+        :type data: array
+        :param mems_comm: worker sending the positions to the mirror.
+        :type mems_comm: MemsWorker
+        :param positions: read-back positions of the segments shown in the tooltips, NaN if unknown,
+                        defaults to None
+        :type positions: array, optional
+        """
         super(TableModel, self).__init__()
         self._data = data
         self._mems = mems_comm
+        self._positions = positions
 
     def data(self, index, role):
         """
@@ -143,6 +143,11 @@ class TableModel(QtCore.QAbstractTableModel):
             value = self._data[index.row(), index.column()]
             # return str(value)
             return '{:.4f}'.format(round(value, 4))
+        if role == Qt.ToolTipRole and self._positions is not None:
+            value = self._positions[index.row(), index.column()]
+            if np.isnan(value):
+                return 'Not read back yet'
+            return 'Read back: {:.4f}'.format(value)
 
     def rowCount(self, index):
         """
@@ -183,104 +188,91 @@ class TableModel(QtCore.QAbstractTableModel):
         return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
 
     def _comm_with_mems(self, row):
-        seg_list = [row + 1]
-        pos_list = [list(self._data[row])]
-        
-        fuse_send = self._mems.send_command(seg_list, pos_list)
-
-        if fuse_send == False:
-            msg = display_error('M5')
-            popup = DisplayPopUp('Error', msg[1])
-        positions, fuse_get_positions = self._mems.get_positions(seg_list)
-        self._data[row] = positions
-        if fuse_get_positions == False:
-            popup = DisplayPopUp('Error', display_error('M3')[1])    
+        # The mirror worker sends the changed row and returns its position through a signal
+        self._mems.request(self._data)
 
 
-class MemsControl(object):
-    """Control the MEMS
+class MemsWorker(QtCore.QObject):
+    """Send the commands of the buttons and of the table to the mirror in a background thread.
 
-    This class regroups command to send command to the mirror and receive its feedback.
+    Only the last requested positions are kept: if the mirror is still busy when
+    new positions are requested, they replace the waiting ones so rapid clicks
+    are merged in one command.
+    The commands go through the engine (``command_mirror``) so the frames acquired before them
+    are not mistaken for frames of the new positions.
+    The read-back positions are returned to the GUI through the signals ``moved`` and ``flattened``.
     """
-    def __init__(self, mirror_handle):
-        self.mirror = mirror_handle
+    # Moved segments (starting at 1), their read-back positions, fuse_send, fuse_get_positions
+    moved = QtCore.pyqtSignal(object, object, bool, bool)
+    # Read-back positions of all the segments, fuse_flatten, fuse_get_positions
+    flattened = QtCore.pyqtSignal(object, bool, bool)
 
-    def flatten_mirror(self):
-        """Flatten the mirror
+    def __init__(self, engine):
         """
-        print( "*** Flatten the mirror")
-        try:
-            IrisAO_API.MirrorCommand(self.mirror, IrisAO_API.MirrorInitSettings)
-            fuse_flatten = True
-        except Exception as e:
-            print(e)
-            print(display_error('M2')[1])
-            fuse_flatten = False
-        return fuse_flatten
-
-    def send_command(self, segment_list, pos_list):
-        """Send a list of positions to the mirror
-
-        Send a command to move a list of segments to a given position (piston, tip and tilt).
-
-        :param segment_list: list of segments to move. Segment ID starst at 1.
-        :type segment_list: list
-        :param pos_list: list of list/tuple of piston/tip/tilt in um/mrad/mrad.
-        :type pos_list: list
-        :return: if `False`, triggers an error message depending on the success of sending the command.
-        :rtype: bool
+        :param engine: engine owning the mirror.
+        :type engine: GlintEngine
         """
-        print("*** Set mirror position")
-        segment_list = list(segment_list)
-        try:
-            IrisAO_API.SetMirrorPosition(self.mirror, segment_list, pos_list)
-            IrisAO_API.MirrorCommand(self.mirror, IrisAO_API.MirrorSendSettings)
-            fuse_send = True
-        except Exception as e:
-            print(e)
-            print(display_error('M5')[1])
-            fuse_send = False
-
-        return fuse_send
-
+        super(MemsWorker, self).__init__()
+        self.engine = engine
+        self._target = None
+        self._flatten = False
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, mems_values):
+        """Queue the positions of all the segments, replacing the ones not sent yet.
+
+        :param mems_values: positions (piston, tip, tilt) of all the segments, it is copied.
+        :type mems_values: array
+        """
+        with self._condition:
+            self._target = np.array(mems_values, dtype=float)
+            self._condition.notify()
 
-    def get_positions(self, segments_list):
-        """Get positions of a list of segments
+    def request_flatten(self):
+        """Queue the flattening of the mirror, the positions not sent yet are discarded.
+        """
+        with self._condition:
+            self._target = None
+            self._flatten = True
+            self._condition.notify()
 
-        :param segments_list: segments one wants to know the position.
-        :type segments_list: list
-        :return: tuple of the list of positions (piston/tip/tilt) and the error-message trigger.
-        :rtype: tuple
+    def discard(self):
+        """Discard the commands not sent yet, e.g. before a scan moves the mirror itself.
         """
-        segments_list = list(segments_list)
-        try:
-            positions, locked, reachable = \
-                IrisAO_API.GetMirrorPosition(self.mirror, segments_list)
-            positions = np.array(positions)
-            fuse_get_positions = True
-        except Exception as e:
-            print(e)
-            print(display_error('M3')[1])
-            positions = np.zeros((len(segments_list), 3))
-            fuse_get_positions = False
-            
-        return positions, fuse_get_positions
+        with self._condition:
+            self._target = None
+            self._flatten = False
 
-    def release_mirror(self):
-        """Terminate connection with the mirror.
+    def stop(self, timeout=1.):
+        """Stop the thread once the current command is sent.
 
-        :return: equal to 0 if the termination is successfull, it throws an error otherwise.
-        :rtype: int
+        :param timeout: maximum waiting time in second, defaults to 1.
+        :type timeout: float, optional
         """
-        try:
-            released = IrisAO_API.MirrorRelease(self.mirror)
-            print("*** Mirror released")
-        except Exception as e:
-            print(e)
-            print(display_error('M4')[1])
-            released = self.mirror
-        
-        return released
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._target is None and not self._flatten:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                target, flatten = self._target, self._flatten
+                self._target, self._flatten = None, False
+
+            if flatten:
+                positions, fuse_flatten, fuse_get_positions = self.engine.command_flatten()
+                self.flattened.emit(positions, fuse_flatten, fuse_get_positions)
+            if target is not None:
+                seg_list, positions, fuse_send, fuse_get_positions = self.engine.command_mirror(target)
+                self.moved.emit(seg_list, positions, fuse_send, fuse_get_positions)
 
 
 class DisplayPopUp():
@@ -312,7 +304,11 @@ class MainWindow(QtWidgets.QMainWindow):
         # Init MEMS hardware
         self.nb_segments = mems_nb_segments
         if mems_fuse:
-            self.mems = MemsControl(mirror_handle)
+            if SIMULATION:
+                self.mems_api = SimulatedIrisAO(self.nb_segments, SIMULATION_LATENCY)
+            else:
+                self.mems_api = IrisAO_API
+            self.mems = MemsControl(self.mems_api, mirror_handle, self.nb_segments)
             self.addHistoryItem("Mirror connected")
         else:
             msgs = display_error('M1')
@@ -339,10 +335,30 @@ class MainWindow(QtWidgets.QMainWindow):
         self.null_scan_range_step.setText(str(NULL_RANGE_STEP)) # is created in *.ui file
         self.null_scan_range_max.setText(str(NULL_RANGE_MAX)) # is created in *.ui file
         self.num_dark_frames.setText(str(NUM_DARK_FRAMES)) # is created in *.ui file
+        self.refresh_rate.setText(str(TARGET_FPS)) # is created in *.ui file
+
+        # Init the processing engine: frames, dark, fluxes and scans
+        if SIMULATION:
+            frame_source = FrameSimulator(self.mems_api, frame_shape=FRAME_SHAPE)
+        else:
+            frame_source = FitsFrameSource(PATH_TO_FRAMES)
+        ## Frames are read in the background and stored in a ring buffer
+        self.engine = GlintEngine(self.mems, frame_source, self.nb_segments, FRAME_SHAPE,
+                                  buffer_slots=RING_BUFFER_SLOTS, saturation_level=SATURATION_LEVEL,
+                                  acquisition_fps=ACQUISITION_FPS, mems_range=(MEMS_MIN, MEMS_MAX),
+                                  dark_library=DarkLibrary(PATH_TO_DARKS),
+                                  wait=lambda t: QtTest.QTest.qWait(int(t * 1000)))
+        self.engine.on_move = self._engine_moved
+        ## The buttons and the table move the mirror through the engine, from a worker thread
+        self.mems_worker = MemsWorker(self.engine)
+        self.mems_worker.moved.connect(self._mems_moved)
+        self.mems_worker.flattened.connect(self._mems_flattened)
+        self.engine.settle_tolerance = SCAN_SETTLE_TOLERANCE
 
         # Init MEMS table
-        self.mems_values = np.zeros((self.nb_segments, 3))
-        self.model = TableModel(self.mems_values, self.mems)
+        ## The table shows the commanded positions owned by the engine, the read-back ones in tooltips
+        self.mems_values = self.engine.mems_values
+        self.model = TableModel(self.mems_values, self.mems_worker, self.engine.mems_positions)
         self.table_mems.setModel(self.model) # is created in *.ui file
 
 
@@ -355,8 +371,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
         # Init RT display
-        self.dk = np.zeros((344, 96), dtype=float)
-        self.rtd = np.zeros((344, 96), dtype=float)
+        self.alarm_record = False
 
         self.plots_refwg.setText("1") # is created in *.ui file
         self.plots_average.setText("1") # is created in *.ui file
@@ -365,6 +380,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.time_flux_max.setText("inf") # is created in *.ui file
         self.spectral_flux_min.setText("-inf") # is created in *.ui file
         self.spectral_flux_max.setText("inf") # is created in *.ui file
+        self.plots_spectralflux.setLabel('bottom', 'Wavelength (um)') # is created in *.ui file
 
         self.rt_img_view.hideAxis('left') # is created in *.ui file
         self.rt_img_view.hideAxis('bottom')
@@ -384,14 +400,41 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.rt_img_view.addItem(self.imv_data)
 
-        self.rois = self.define_rois()
-        for elt in self.rois:
-            self.rt_img_view.addItem(elt)
-
-        ## Built RT spectral flux plot
-        self.time_width = int(self.plots_width.text())
-        self.time_width_old = int(self.plots_width.text())
-        self.time_flux = np.zeros(self.time_width)
+        self.rois = []
+        if os.path.isfile(PATH_TO_LAYOUT):
+            self.set_layout(RoiLayout.load(PATH_TO_LAYOUT))
+            self.addHistoryItem('ROI layout loaded')
+        else:
+            self.set_layout(RoiLayout())
+        if os.path.isfile(PATH_TO_WAVELENGTHS):
+            self.load_wavelengths(PATH_TO_WAVELENGTHS)
+
+        # Master dark of the current detector settings, taken in a previous session
+        if not self._update_detector_settings():
+            self.addHistoryItem('Camera settings unknown, no dark loaded', False)
+        elif self.engine.load_dark():
+            self.addHistoryItem('Dark of %s loaded, %s bad pixels'%(self.engine.master_dark.date[:16],
+                                                                   self.engine.bad_pixels.sum()))
+
+        # Display parameters, parsed once when edited instead of at every frame
+        self.params = ParameterStore()
+        self.param_fields = {'nb_averaged': self.plots_average, 'refwg': self.plots_refwg,
+                             'time_width': self.plots_width,
+                             'display_vmin': self.display_vmin, 'display_vmax': self.display_vmax,
+                             'time_flux_min': self.time_flux_min, 'time_flux_max': self.time_flux_max,
+                             'spectral_flux_min': self.spectral_flux_min,
+                             'spectral_flux_max': self.spectral_flux_max}
+        self.params.add('nb_averaged', int_parser(1), 1)
+        # An invalid output selects no output, it is reported by the refresh
+        self.params.add('refwg', optional_parser(int_parser(1, len(self.engine.roi_layout.names))), None)
+        self.params.add('time_width', int_parser(2), 100)
+        for name in ['display_vmin', 'display_vmax', 'time_flux_min', 'time_flux_max',
+                     'spectral_flux_min', 'spectral_flux_max']:
+            self.params.add(name, limit_parser, None)
+        for name, field in self.param_fields.items():
+            self.params.set_text(name, field.text())
+            field.textChanged.connect(lambda text, name=name: self.params.set_text(name, text))
+            field.editingFinished.connect(lambda name=name: self._check_parameter(name))
 
         # Init TT map display
         self.tt_map_display.setAspectLocked(False)
@@ -431,8 +474,18 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tt_opt.clicked.connect(self.clickTtOpti)
         self.camera_command.returnPressed.connect(self.send_camera_command)
         self.push_button_save_dir.clicked.connect(self.browse_save_dir)
+        self.checkBox_record.toggled.connect(self.toggle_record)
+        self.checkBox_dark.toggled.connect(self._toggle_dark)
+        self._toggle_dark(self.checkBox_dark.isChecked())
         self.pushButton_startstop.clicked.connect(self.startstop_refresh)
         self.buttonDev.clicked.connect(self.debug)
+        self.action_load_layout.triggered.connect(self.load_layout)
+        self.action_save_layout.triggered.connect(self.save_layout)
+        self.action_fit_layout.triggered.connect(self.fit_layout)
+        self.action_load_wavelengths.triggered.connect(lambda: self.load_wavelengths())
+        self.action_fit_profiles.triggered.connect(self.fit_profiles)
+        self.action_sync_mems.triggered.connect(self.sync_mems)
+        self.action_run_scan_file.triggered.connect(self.clickRunScanFile)
 
         # Init label
         self.label_saturation.setText("")
@@ -454,6 +507,7 @@ class MainWindow(QtWidgets.QMainWindow):
     def exitapp(self):
         """Close the GUI and the connection with the mirror.
         """
+        self.mems_worker.stop()
         release = self.mems.release_mirror()
         if release == 0:
             self.addHistoryItem('Mirror released')
@@ -461,9 +515,18 @@ class MainWindow(QtWidgets.QMainWindow):
             self.addHistoryItem(display_error('M4')[0], False)
             msg = DisplayPopUp('Error', display_error('M4')[1])
         self.timer.stop()
+        self._stop_record()
+        self.engine.close()
         plt.close('all')
         self.close()
 
+    def _report_scan_errors(self):
+        """Display the errors of the last scans, e.g. points without frames.
+        """
+        for error in self.engine.pop_scan_errors():
+            print(error)
+            self.addHistoryItem('Scan: %s'%error, False)
+
     def addHistoryItem(self, text, colortext=True):
         """Display feedback on the actions made through the GUI.
 
@@ -509,12 +572,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def clickMemsToZero(self):
         """Flatten the mirror
+
+        The mirror worker flattens it, the table is updated in ``_mems_flattened``.
         """
-        fuse_flatten = self.mems.flatten_mirror()
+        self.mems_worker.request_flatten()
+
+    def _mems_flattened(self, positions, fuse_flatten, fuse_get_positions):
         if fuse_flatten:
             self.addHistoryItem("MEMS sets to 0")
-            positions, fuse_get_positions = self.mems.get_positions(np.arange(self.nb_segments)+1)
-            self.mems_values[:] = positions
+            self.mems_values[:] = 0.
             self.updateTable(0, 0)
             self.updateTable(0, 1)
             self.updateTable(0, 2)
@@ -523,6 +589,33 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.addHistoryItem(display_error('M2')[0], False)
 
+    def request_mems_move(self, column):
+        """Move the mirror without waiting for it.
+
+        The positions are sent by the mirror worker, the tooltips of the table are updated
+        with the read-back positions in ``_mems_moved``.
+
+        :param column: changed positions among *piston, tip, tilt*, all of them if not in [0, 1, 2].
+        :type column: int or str
+        """
+        self.mems_values = self._foolproof(self.mems_values)
+        self.mems_worker.request(self.mems_values)
+
+        if column not in [0, 1, 2]:
+            for it in range(3):
+                self.updateTable(self.segment_id, it)
+        else:
+            self.updateTable(self.segment_id, column)
+
+    def _mems_moved(self, seg_list, positions, fuse_send, fuse_get_positions):
+        if fuse_send == False:
+            self.addHistoryItem(display_error('M5')[0], False)
+        # The table keeps the commands, the read-back positions are in its tooltips
+        self.model.dataChanged.emit(self.model.index(0, 0),
+                                    self.model.index(self.mems_values.shape[0]-1, 2))
+        if fuse_get_positions == False:
+            self.addHistoryItem(display_error('M3')[0], False)
+
     def move_mems_and_updateTable(self, column):
         self._move_mems()
 
@@ -545,24 +638,32 @@ class MainWindow(QtWidgets.QMainWindow):
         self.step = float(self.mems_step.text())
         self.segment_id = int(self.segment_selection.text())
 
-    def _move_mems(self):
-        self.mems_values = self._foolproof(self.mems_values)
-        if self.segment_id == 0:
-            seg_list = list(np.arange(self.nb_segments) + 1)
-            pos_list = [list(elt) for elt in self.mems_values]
-        else:
-            seg_list = [self.segment_id]
-            pos_list = [self.mems_values[self.segment_id-1]]
-        
-        fuse_send = self.mems.send_command(seg_list, pos_list)
+    def _move_mems(self, force_sync=False):
+        # The positions set here supersede the ones waiting in the worker
+        self.mems_worker.discard()
+        # Only the segments which changed since the last command are sent
+        self.engine.move_mirror(force_sync)
 
+    def _engine_moved(self, fuse_send, fuse_get_positions):
+        """Called by the engine after each move of the mirror, including during the scans.
+        """
         if fuse_send == False:
             self.addHistoryItem(display_error('M5')[0], False)        
-        positions, fuse_get_positions = self.mems.get_positions(seg_list)
-        seg_list = list(np.array(seg_list) - 1)
-        self.mems_values[seg_list, :] = positions
         if fuse_get_positions == False:
             self.addHistoryItem(display_error('M3')[0], False)
+        self.model.dataChanged.emit(self.model.index(0, 0),
+                                    self.model.index(self.mems_values.shape[0]-1, 2))
+
+    def sync_mems(self):
+        """Send and read back the positions of all the segments.
+
+        Use it if the mirror may have been moved outside the GUI.
+        """
+        self._move_mems(force_sync=True)
+        self.updateTable(0, 0)
+        self.updateTable(0, 1)
+        self.updateTable(0, 2)
+        self.addHistoryItem("MEMS fully synchronised")
 
     def clickPistonUp(self):
         """Increase the piston of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -580,7 +681,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
                 'Piston Up (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
 
-        self.move_mems_and_updateTable(0)
+        self.request_mems_move(0)
 
     def clickPistonDown(self):
         """Decrease the piston of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -598,7 +699,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
             'Piston Down (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
         
-        self.move_mems_and_updateTable(0)
+        self.request_mems_move(0)
 
     def clickTipUp(self):
         """Increase the tip of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -616,7 +717,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
             'Tip Up (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
 
-        self.move_mems_and_updateTable(1)
+        self.request_mems_move(1)
 
     def clickTipDown(self):
         """Decrease the tip of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -632,7 +733,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
             'Tip Down (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
 
-        self.move_mems_and_updateTable(1)
+        self.request_mems_move(1)
 
     def clickTiltUp(self):
         """Increase the tilt of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -650,7 +751,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
             'Tilt Up (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
 
-        self.move_mems_and_updateTable(2)
+        self.request_mems_move(2)
 
     def clickTiltDown(self):
         """Decrease the tilt of the selected segment (field *Segment*) by the value in the field *Step*.
@@ -668,7 +769,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addHistoryItem(
             'Tilt Down (Seg: '+str(self.segment_id)+'/Step:'+str(self.step)+')')
 
-        self.move_mems_and_updateTable(2)
+        self.request_mems_move(2)
 
     # =============================================================================
     #   Presets
@@ -693,21 +794,21 @@ class MainWindow(QtWidgets.QMainWindow):
         """Restore the positions of the mirror from a *npz* file in the *Off* preset.
         """
         self.mems_values[:] = self.mems_off[:].copy()
-        self.move_mems_and_updateTable('all')
+        self.request_mems_move('all')
         self.addHistoryItem("Profile 'Off' restored")
 
     def clickOnRestore(self):
         """Restore the positions of the mirror from a *npz* file in the *On* preset.
         """        
         self.mems_values[:] = self.mems_on[:].copy()
-        self.move_mems_and_updateTable('all')
+        self.request_mems_move('all')
         self.addHistoryItem("Profile 'On' restored")
 
     def clickFlatRestore(self):
         """Restore the positions of the mirror from a *npz* file in the *Flat* preset.
         """        
         self.mems_values[:] = self.mems_flat[:].copy()
-        self.move_mems_and_updateTable('all')
+        self.request_mems_move('all')
         self.addHistoryItem("Profile 'Flat' restored")
 
     def clickSave(self):
@@ -761,65 +862,138 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.timer.isActive():
             self.pushButton_startstop.setText('Start video')
             self.timer.stop()
+            self.engine.stop_acquisition()
         else:
             self.pushButton_startstop.setText('Stop video')
             self.target_fps = self.str2float(self.refresh_rate.text(), TARGET_FPS)
             self.target_fps = abs(self.target_fps)
             self.addHistoryItem('Refresh rate = %s Hz'%self.target_fps)
             self.refresh_rate.setText(str(self.target_fps))
+            self._check_dark_settings()
 
             self.timer.setInterval(int(np.around(1000. / self.target_fps)))
             self.timer.timeout.connect(self.refresh)
+            self.engine.start_acquisition()
             self.timer.start()        
 
-    def define_rois(self):
-        self.roi_p1 = pg.RectROI([35, 323], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n9 = pg.RectROI([35, 303], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_p2 = pg.RectROI([35, 283], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n8 = pg.RectROI([35, 263], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n1 = pg.RectROI([35, 244], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n12 = pg.RectROI([35, 224], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n7 = pg.RectROI([35, 204], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n6 = pg.RectROI([35, 184], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n11 = pg.RectROI([35, 165], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n4 = pg.RectROI([35, 145], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n5 = pg.RectROI([35, 125], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n10 = pg.RectROI([35, 105], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n2 = pg.RectROI([35, 85], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_p3 = pg.RectROI([35, 66], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_n3 = pg.RectROI([35, 46], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-        self.roi_p4 = pg.RectROI([35, 26], [61, 15], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
-
-        rois = [self.roi_p4, self.roi_n3, self.roi_p3, self.roi_n2,
-                self.roi_n10, self.roi_n5, self.roi_n4, self.roi_n11,
-                self.roi_n6, self.roi_n7, self.roi_n12, self.roi_n1,
-                self.roi_n8, self.roi_p2, self.roi_n9, self.roi_p1]
-
-        idx = np.arange(len(rois))
-
-        for elt in rois:
-            elt.setAcceptedMouseButtons(QtCore.Qt.MouseButton.LeftButton)
-        
+    def define_rois(self, layout):
+        """Build the ROIs of the outputs displayed on the RT image.
+
+        Clicking on a ROI selects its output in the plots.
 
-        self.roi_p4.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_p4)+1)))
-        self.roi_n3.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n3)+1)))
-        self.roi_p3.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_p3)+1)))
-        self.roi_n2.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n2)+1)))
-        self.roi_n10.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n10)+1)))
-        self.roi_n5.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n5)+1)))
-        self.roi_n4.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n4)+1)))
-        self.roi_n11.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n11)+1)))
-        self.roi_n6.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n6)+1)))
-        self.roi_n7.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n7)+1)))
-        self.roi_n12.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n12)+1)))
-        self.roi_n1.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n1)+1)))
-        self.roi_n8.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n8)+1)))
-        self.roi_p2.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_p2)+1)))
-        self.roi_n9.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_n9)+1)))
-        self.roi_p1.sigClicked.connect(lambda x: self.plots_refwg.setText(str(rois.index(self.roi_p1)+1)))
+        :param layout: geometry of the outputs.
+        :type layout: RoiLayout
+        :return: list of ROIs, ordered like the outputs.
+        :rtype: list
+        """
+        rois = []
+        for k, rect in enumerate(layout.rects):
+            roi = pg.RectROI(rect[:2], rect[2:], pen=(255, 0, 0), movable=False, resizable=False, rotatable=False)
+            roi.setAcceptedMouseButtons(QtCore.Qt.MouseButton.LeftButton)
+            roi.sigClicked.connect(lambda x, wg=k+1: self.plots_refwg.setText(str(wg)))
+            rois.append(roi)
 
         return rois
 
+    def set_layout(self, layout):
+        """Apply a new geometry of the outputs.
+
+        The ROIs are displayed again and the engine extracts the new outputs.
+
+        :param layout: geometry of the outputs.
+        :type layout: RoiLayout
+        """
+        for elt in self.rois:
+            self.rt_img_view.removeItem(elt)
+        self.rois = self.define_rois(layout)
+        for elt in self.rois:
+            self.rt_img_view.addItem(elt)
+
+        self.engine.set_layout(layout)
+
+    def load_layout(self):
+        path = QtWidgets.QFileDialog.getOpenFileName(filter='*.json')[0]
+        if path == '':
+            return
+        try:
+            self.set_layout(RoiLayout.load(path))
+            self.addHistoryItem('ROI layout loaded')
+        except (OSError, ValueError, KeyError) as e:
+            print(e)
+            self.addHistoryItem('!!! ROI layout NOT loaded !!!', False)
+
+    def save_layout(self):
+        path = QtWidgets.QFileDialog.getSaveFileName(directory=PATH_TO_LAYOUT, filter='*.json')[0]
+        if path == '':
+            return
+        if not '.json' in path:
+            path = path+'.json'
+        self.engine.roi_layout.save(path)
+        self.addHistoryItem('ROI layout saved')
+
+    def load_wavelengths(self, path=None):
+        """Use the wavelength calibration of a JSON file (see ``WavelengthSolution``).
+
+        :param path: path of the file, asked if `None`, defaults to None
+        :type path: string, optional
+        """
+        if path is None:
+            path = QtWidgets.QFileDialog.getOpenFileName(directory=PATH_TO_WAVELENGTHS, filter='*.json')[0]
+            if path == '':
+                return
+        try:
+            self.engine.set_wavelength_solution(WavelengthSolution.load(path))
+            self.addHistoryItem('Wavelength calibration loaded')
+        except (OSError, ValueError, KeyError) as e:
+            print(e)
+            self.addHistoryItem('!!! Wavelength calibration NOT loaded !!!', False)
+
+    def fit_profiles(self):
+        """Measure the profiles of the outputs on the displayed frame, for the optimal extraction.
+
+        All the outputs must be illuminated and the dark subtracted.
+        """
+        self.engine.fit_trace_profiles()
+        self.addHistoryItem('Profiles of the outputs fitted')
+
+    def fit_layout(self):
+        """Fit the position of the outputs on the displayed frame.
+
+        All the outputs must be illuminated and the dark subtracted.
+        The fitted layout is applied but not saved.
+        """
+        try:
+            self.set_layout(self.engine.roi_layout.fit(self.engine.img_data))
+            self.addHistoryItem('ROI layout fitted')
+        except ValueError as e:
+            print(e)
+            self.addHistoryItem('ROI layout fit failed', False)
+
+    def _update_detector_settings(self):
+        """Key the master darks with the settings of the camera and the refresh rate.
+
+        :return: `False` if the frame source does not give the settings of the camera,
+                the key then only depends on the refresh rate.
+        :rtype: bool
+        """
+        camera_settings = self.engine.frame_source.settings()
+        settings = {} if camera_settings is None else dict(camera_settings)
+        settings['refresh_rate'] = abs(self.str2float(self.refresh_rate.text(), TARGET_FPS))
+        self.engine.set_detector_settings(settings)
+        return camera_settings is not None
+
+    def _check_dark_settings(self):
+        """Load the dark of new detector settings, or warn that the dark in use does not match them.
+        """
+        known = self._update_detector_settings()
+        if self.engine.dark_matches_settings():
+            return
+        if known and self.engine.load_dark():
+            self.addHistoryItem('Dark of %s loaded for the new settings, %s bad pixels' %
+                                (self.engine.master_dark.date[:16], self.engine.bad_pixels.sum()))
+        else:
+            self.addHistoryItem('The dark was taken with other detector settings, take a new one', False)
+
     def click_dark_button(self):
         if self.pushButton_dark.text() == 'Take dark':
             self._grab_dark()
@@ -831,28 +1005,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.pushButton_dark.setText('Abort Dark')
         self.pushButton_dark.setStyleSheet('color: red')
         self.checkBox_dark.setEnabled(False)
-        self.old_dk = self.dk.copy()
 
-        path_to_dk = PATH_TO_FRAMES
-        self.dk = []
         nb_dark = int(self.str2float(self.num_dark_frames.text(), NUM_DARK_FRAMES))
+        # The dark is saved under the current settings
+        self._update_detector_settings()
+        self.addHistoryItem('Acquiring dark, the source must be blocked')
         exp_time = 1/self.str2float(self.refresh_rate.text(), TARGET_FPS)
 
-        for k in range(nb_dark):
-            if self.abortDark:
-                break
-            dark_frame = fits.open(path_to_dk)[0].data.astype(float)
-            self.addHistoryItem('Acquiring dark %s/%s'%(k+1, nb_dark))
-            self.dk.append(dark_frame)
-            QtTest.QTest.qWait(int(exp_time * 1000))
+        done = self.engine.take_dark(nb_dark, exp_time,
+                                     lambda k: self.addHistoryItem('Acquiring dark %s/%s'%(k+1, nb_dark)))
 
-        if self.abortDark:
+        self._report_scan_errors()
+        if not done:
             self.addHistoryItem('Acquiring dark aborted')
-            self.dk = self.old_dk.copy()
         else:
-            self.addHistoryItem('Acquiring dark done')
-            self.dk = np.array(self.dk)
-            self.dk = np.mean(self.dk, 0)
+            self.addHistoryItem('Acquiring dark done, %s bad pixels'%self.engine.bad_pixels.sum())
 
         self.checkBox_dark.setEnabled(True)
 
@@ -862,99 +1029,147 @@ class MainWindow(QtWidgets.QMainWindow):
     
     def _abort_grab_dark(self):
         self.abortDark = True
+        self.engine.abort()
         self.pushButton_dark.setText('Take dark')
         self.pushButton_dark.setStyleSheet('color: black')
 
-    def refresh(self):
-        self.img_data = np.zeros_like(self.rtd)
-        for k in range(int(self.plots_average.text())):
-            path_to_rtd = PATH_TO_FRAMES
-            self.rtd = fits.open(path_to_rtd)[0].data.astype(float)
-            if np.any(self.rtd >= 2**14):
-                self.label_saturation.setText("Saturation")
-                self.label_saturation.setStyleSheet("background-color: red;\
-                                                    border: 1px solid black;\
-                                                    color: white;")                                                  
+    def _check_parameter(self, name):
+        """Report an invalid field once, when its edition is finished.
+        """
+        if name in self.params.errors:
+            self.addHistoryItem('Invalid value %s, %s kept'%(self.params.errors[name], self.params[name]), False)
 
-            if self.checkBox_dark.isChecked():
-                self.rtd -= self.dk
-            # self.rtd += np.random.normal(0, 5, self.rtd.shape)
-            self.img_data += self.rtd
+    def _toggle_dark(self, checked):
+        self.engine.subtract_dark = checked
 
-        self.img_data /= max(1., int(self.plots_average.text()))
+    def refresh(self):
+        params = self.params.snapshot()
+        self.engine.nb_averaged = params.nb_averaged
+        error = self.engine.pop_acquisition_error()
+        if error is not None:
+            self.addHistoryItem('Frame not read: %s'%error, False)
+        self._report_scan_errors()
+
+        recorder = self.engine.recorder
+        if recorder is not None and recorder.nb_dropped > 0 and not self.alarm_record:
+            self.addHistoryItem('Recorder too slow, frames dropped', False)
+            self.alarm_record = True
+
+        # Without background acquisition (e.g. scans), the engine reads fresh frames
+        self.engine.refresh()
+        self.update_saturation()
 
         if self.checkBox_update_display.isChecked():
-            self.imv_data.setImage(self.img_data.T)
-            vmin, vmax = self.change_display_dynamic(self.img_data, self.display_vmin.text(), self.display_vmax.text())
+            self.imv_data.setImage(self.engine.img_data.T)
+            vmin, vmax = self.change_display_dynamic(self.engine.img_data, params.display_vmin, params.display_vmax)
             self.imv_data.setLevels([vmin, vmax])
 
             self.update_fluxes()
 
-            try:
-                int(self.plots_refwg.text())
-                if int(self.plots_refwg.text()) >= 1 and int(self.plots_refwg.text()) <= 16:
-                    self.plot_spectral_flux()
-                    self.plot_time_flux()
-                    if self.alarm_refwg:
-                        self.addHistoryItem('Ref WG OK')                    
-                    self.alarm_refwg = False
-                else:
-                    if not self.alarm_refwg:
-                        self.addHistoryItem('No WG selected', False)
-                        self.alarm_refwg = True
-            except ValueError:
+            if params.refwg is not None:
+                self.plot_spectral_flux(params)
+                self.plot_time_flux(params)
+                if self.alarm_refwg:
+                    self.addHistoryItem('Ref WG OK')                    
+                self.alarm_refwg = False
+            else:
                 if not self.alarm_refwg:
                     self.addHistoryItem('No WG selected', False)
                     self.alarm_refwg = True
-                pass
 
-    def change_display_dynamic(self, data, vmin, vmax):
-        if vmin == 'inf' or vmin == '-inf' or vmin is None or vmin == '':
-            vmin = data.min()
+    def update_saturation(self):
+        """Show the saturation alarm of the engine and the saturated outputs.
+
+        The alarm is cleared by the engine once no output has been saturated for a few refreshes.
+        """
+        counts = self.engine.saturation_counts
+        saturated = ['%s (%s px)'%(name, nb) for name, nb in zip(self.engine.roi_layout.names, counts) if nb > 0]
+        if self.engine.saturation_changed:
+            if self.engine.saturation_alarm.active:
+                self.label_saturation.setText("Saturation")
+                self.label_saturation.setStyleSheet("background-color: red;\
+                                                    border: 1px solid black;\
+                                                    color: white;")
+                self.addHistoryItem('Saturation in '+', '.join(saturated), False)
+            else:
+                self.label_saturation.setText("")
+                self.label_saturation.setStyleSheet("")
+                self.addHistoryItem('Saturation cleared')
+        if self.engine.saturation_alarm.active:
+            self.label_saturation.setToolTip('\n'.join(saturated))
         else:
-            try:
-                vmin = float(vmin)
-            except ValueError:
-                vmin = data.min()
+            self.label_saturation.setToolTip('')
 
-        if vmax == 'inf' or vmax == '-inf' or vmax is None or vmax == '':
+    def change_display_dynamic(self, data, vmin, vmax):
+        """Limits of a display.
+
+        :param vmin: lower limit, the minimum of ``data`` if `None`.
+        :type vmin: float
+        :param vmax: upper limit, the maximum of ``data`` if `None`.
+        :type vmax: float
+        :rtype: tuple
+        """
+        if vmin is None:
+            vmin = data.min()
+        if vmax is None:
             vmax = data.max()
-        else:
-            try:
-                vmax = float(vmax)
-            except ValueError:
-                vmax = data.max()
 
         return vmin, vmax
 
-    def plot_spectral_flux(self):
-        spectral_flux = self.rois[int(self.plots_refwg.text())-1].getArrayRegion(self.img_data, self.imv_data, axes=(1, 0))
-        spectral_flux = spectral_flux.mean(1)
-        vmin, vmax = self.change_display_dynamic(spectral_flux, self.spectral_flux_min.text(), self.spectral_flux_max.text())
+    def plot_spectral_flux(self, params):
+        # Spectra extracted by the engine for all the outputs, on a common wavelength grid
+        wavelengths = self.engine.wavelengths
+        spectra = self.engine.calibrated_spectra
+        name = self.engine.roi_layout.names[params.refwg-1]
+        estimator = self.engine.null_estimator
+        if self.action_null_depth.isChecked() and estimator is not None and \
+                name in ['N%s'%k for k in estimator.null_ids]:
+            # Null depth of the selected null, normalised by the photometric outputs
+            null_depth = self.engine.null_depths[estimator.null_ids.index(int(name[1:]))]
+            finite = null_depth[np.isfinite(null_depth)]
+            vmin, vmax = self.change_display_dynamic(finite if finite.size else np.zeros(1),
+                                                     params.spectral_flux_min, params.spectral_flux_max)
+            self.plots_spectralflux.plot(wavelengths, null_depth, clear=True, connect='finite')
+        elif self.action_all_spectra.isChecked():
+            vmin, vmax = self.change_display_dynamic(spectra, params.spectral_flux_min, params.spectral_flux_max)
+            self.plots_spectralflux.clear()
+            for k in range(spectra.shape[0]):
+                if k != params.refwg-1:
+                    self.plots_spectralflux.plot(wavelengths, spectra[k], pen=pg.intColor(k, spectra.shape[0], alpha=120))
+            self.plots_spectralflux.plot(wavelengths, spectra[params.refwg-1], pen=pg.mkPen('w', width=2))
+        else:
+            spectral_flux = spectra[params.refwg-1]
+            vmin, vmax = self.change_display_dynamic(spectral_flux, params.spectral_flux_min, params.spectral_flux_max)
+            self.plots_spectralflux.plot(wavelengths, spectral_flux, clear=True)
         self.plots_spectralflux.setYRange(vmin, vmax)
-        self.plots_spectralflux.plot(spectral_flux, clear=True)
-
-    def plot_time_flux(self):
-        instant_flux = self.rois[int(self.plots_refwg.text())-1].getArrayRegion(self.img_data, self.imv_data, axes=(1, 0))
-        instant_flux = instant_flux.mean()
-        if int(self.plots_width.text()) != self.time_width_old:
-            self.time_flux = np.zeros(int(self.plots_width.text()))
-            self.time_width_old = int(self.plots_width.text())
-        self.time_flux[:-1] = self.time_flux[1:]
-        self.time_flux[-1] = instant_flux
-        vmin, vmax = self.change_display_dynamic(self.time_flux, self.time_flux_min.text(), self.time_flux_max.text())
+
+    def plot_time_flux(self, params):
+        # The engine keeps the fluxes of all the outputs since the start, decimated for the long windows.
+        # The width is a number of refreshes, the x-axis is the time in second before the last one.
+        times, means, minima, maxima, samples_per_bin = \
+            self.engine.flux_archive.select(params.time_width, params.refwg-1, TIME_FLUX_MAX_POINTS)
+        if times.size == 0:
+            return
+        vmin, vmax = params.time_flux_min, params.time_flux_max
+        if vmin is None:
+            vmin = minima.min()
+        if vmax is None:
+            vmax = maxima.max()
+        times = times - times[-1]
         self.plots_time_flux.setYRange(vmin, vmax)
-        self.plots_time_flux.plot(self.time_flux, clear=True)
+        self.plots_time_flux.plot(times, means, clear=True)
+        if samples_per_bin > 1:
+            # Envelope of the bins
+            self.plots_time_flux.plot(times, minima, pen=(100, 100, 100))
+            self.plots_time_flux.plot(times, maxima, pen=(100, 100, 100))
 
     def update_fluxes(self):
         labels = [self.flux_p4, self.flux_n3, self.flux_p3, self.flux_n2,
                   self.flux_n10, self.flux_n5, self.flux_n4, self.flux_n11,
                   self.flux_n6, self.flux_n7, self.flux_n12, self.flux_n1,
                   self.flux_n8, self.flux_p2, self.flux_n9, self.flux_p1]
-        fluxes = [elt.getArrayRegion(self.img_data, self.imv_data, axes=(1, 0)).mean() for elt in self.rois]
-        
         for k in range(len(labels)):
-            labels[k].setText("%.3f"%fluxes[k])
+            labels[k].setText("%.3f"%self.engine.fluxes[k])
 
     # =============================================================================
     # TT opti
@@ -974,11 +1189,14 @@ class MainWindow(QtWidgets.QMainWindow):
             reactivate_timer = True
             self.pushButton_startstop.setText('Start video')
             self.timer.stop()
+            self.engine.stop_acquisition()
         else:
             reactivate_timer = False
 
         self.mems_value_old = self.mems_values.copy()
-        self.clickMemsToZero()
+        # The scans need a flat mirror right now, not after the worker's queue
+        self.mems_worker.discard()
+        self._mems_flattened(self.mems_values, *self.engine.flatten_mirror())
 
         scan_wait = self.str2float(self.scan_wait.text(), SCAN_WAIT)
 
@@ -987,75 +1205,74 @@ class MainWindow(QtWidgets.QMainWindow):
         step = 0.5
         ttx = np.arange(TTX_MIN, TTX_MAX + step, step)
         tty = np.arange(TTY_MIN, TTY_MAX + step, step)
-        seg_tt = [[29], [35], [26], [24]]
-        wg_table = {29: 16, 35: 14, 26: 3, 24: 1}
+        seg_tt = [[seg] for seg in self.engine.roi_layout.beam_segments]
+        wg_table = self.engine.roi_layout.segment_outputs
         colours = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]
+        fast = self.action_fast_tt.isChecked()
 
         old_segment_id = self.segment_selection.text()
 
-        for seg in seg_tt:
-            if self.abortTT:
-                break  
-            self.tt_map = []
-            self.segment_id = seg[0]
-            self.segment_selection.setText(str(self.segment_id)) # Defined in ui file
-            for k in range(num_loops):
-                self.addHistoryItem('Scanning TT seg %s %s/%s'%(seg[0], k+1, num_loops))
-                cum_map = []
-                for x in ttx:
-                    y_fill = []
-                    for y in tty:
-                        if self.abortTT:
-                            break
-                        self.mems_values[self.segment_id-1] = [0, x, y]
-                        self.move_mems_and_updateTable('all')
-                        QtTest.QTest.qWait(int(scan_wait * 1000))
-                        self.refresh()
-                        flux = self.rois[wg_table[self.segment_id]-1].getArrayRegion(self.img_data, self.imv_data, axes=(1, 0))
-                        flux = flux.mean()
-                        y_fill.append(flux)
-                    cum_map.append(y_fill)
-                self.tt_map.append(cum_map)
-
-            self.mems_values[self.segment_id-1] = self.mems_value_old[self.segment_id-1]
-            self.move_mems_and_updateTable('all')
+        if self.action_multiplexed_tt.isChecked():
+            self._do_multiplexed_tt_scan(seg_tt, wg_table, ttx, tty, step, num_loops, scan_wait, colours)
+        else:
+            for seg in seg_tt:
+                if self.abortTT:
+                    break  
+                self.tt_map = []
+                self.segment_id = seg[0]
+                self.segment_selection.setText(str(self.segment_id)) # Defined in ui file
+                if fast:
+                    coord_max, positions, fluxes = self.engine.search_tt(
+                        self.segment_id, wg_table[self.segment_id], (TTX_MIN, TTX_MAX), TT_COARSE_POINTS,
+                        num_loops, scan_wait,
+                        lambda k: self.addHistoryItem('Optimising TT seg %s %s/%s'%(seg[0], k+1, num_loops)))
+                else:
+                    tt_maps = self.engine.scan_tt_grid(
+                        [self.segment_id], [wg_table[self.segment_id]], ttx, tty, num_loops, scan_wait,
+                        lambda k: self.addHistoryItem('Scanning TT seg %s %s/%s'%(seg[0], k+1, num_loops)))
+                    if tt_maps is not None:
+                        self.tt_map = tt_maps[:, 0]
 
-            if not self.abortTT:
-                self.addHistoryItem('Scanning TT seg %s done'%(seg[0]))
-
-                self.tt_map = np.array(self.tt_map)
-                self.tt_map = np.mean(self.tt_map, 0)
-                ttx_interp = np.arange(TTX_MIN, TTX_MAX + step/10, step/10)
-                tty_interp = np.arange(TTY_MIN, TTY_MAX + step/10, step/10)
-                interp_function = interp2d(ttx, tty, self.tt_map.T, kind='cubic')
-                self.tt_map_interp = interp_function(ttx_interp, tty_interp)
-                idx_max = np.unravel_index(np.argmax(self.tt_map_interp), self.tt_map_interp.shape)
-                coord_max = (ttx_interp[idx_max[1]], tty_interp[idx_max[0]])
-                print('TT max seg %s:'%seg[0], coord_max)
-                self.tt_max.append(coord_max)
-                rect = QtCore.QRectF(ttx_interp[0], tty_interp[0],
-                                    (ttx_interp[-1]-ttx_interp[0]), (tty_interp[-1]-tty_interp[0]))
-                self.imv_tt.setImage(self.tt_map_interp.T)
-                self.imv_tt.setRect(rect)
-                try:
-                    self.tt_map_display.removeItem(self.tt_crosshair)
-                except AttributeError:
-                    pass
-                self.tt_crosshair = pg.CrosshairROI(coord_max, [0., 0.5], pen=colours[seg_tt.index(seg)], movable=False, resizable=False, rotatable=False)
-                self.tt_map_display.addItem(self.tt_crosshair)
-                self.mems_values[self.segment_id-1] = [0, coord_max[0], coord_max[1]]
+                self.mems_values[self.segment_id-1] = self.mems_value_old[self.segment_id-1]
                 self.move_mems_and_updateTable('all')
-                np.savez('tt_map_seg%s_%s'%(seg[0], datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')),
-                            x=ttx_interp, y=tty_interp, z=self.tt_map_interp.T)
-                QtTest.QTest.qWait(500)
-            else:
-                self.addHistoryItem('Scanning TT aborted', False)
-                print('Scanning TT aborted')
-                # self.mems_values[self.segment_id-1] = self.mems_value_old[self.segment_id-1].copy()
-                self.segment_id = 0
-                self.move_mems_and_updateTable('all') 
 
+                if not self.abortTT:
+                    self.addHistoryItem('Scanning TT seg %s done'%(seg[0]))
+
+                    ttx_interp = np.arange(TTX_MIN, TTX_MAX + step/10, step/10)
+                    tty_interp = np.arange(TTY_MIN, TTY_MAX + step/10, step/10)
+                    try:
+                        if fast:
+                            if coord_max is None:
+                                raise ValueError('no valid flux')
+                            # Map of the measured points, for display only
+                            valid = np.isfinite(fluxes)
+                            self.tt_map_interp = griddata(positions[valid], fluxes[valid],
+                                                          tuple(np.meshgrid(ttx_interp, tty_interp)),
+                                                          method='linear' if valid.sum() > 3 else 'nearest',
+                                                          fill_value=np.min(fluxes[valid]))
+                            coord_max = tuple(coord_max)
+                            self.addHistoryItem('TT seg %s: %s moves instead of %s'%(seg[0], len(fluxes), num_loops*ttx.size*tty.size))
+                        else:
+                            coord_max = self._interp_tt_map(ttx, tty, mean_tt_map(self.tt_map), ttx_interp, tty_interp)
+                    except ValueError as e:
+                        # The segment stays where it was
+                        self.addHistoryItem('TT seg %s not optimised: %s'%(seg[0], e), False)
+                        continue
+                    self._show_tt_map(seg[0], ttx_interp, tty_interp, coord_max, colours[seg_tt.index(seg)])
+                    self.mems_values[self.segment_id-1] = [0, coord_max[0], coord_max[1]]
+                    self.move_mems_and_updateTable('all')
+                    QtTest.QTest.qWait(500)
+                else:
+                    self.addHistoryItem('Scanning TT aborted', False)
+                    print('Scanning TT aborted')
+                    # self.mems_values[self.segment_id-1] = self.mems_value_old[self.segment_id-1].copy()
+                    self.segment_id = 0
+                    self.move_mems_and_updateTable('all') 
+
+        self._report_scan_errors()
         if reactivate_timer:
+            self.engine.start_acquisition()
             self.timer.start()
             self.pushButton_startstop.setText('Stop video')
         self.pushButton_startstop.setEnabled(True)
@@ -1066,8 +1283,78 @@ class MainWindow(QtWidgets.QMainWindow):
             self.tt_opt.setText('Do TT optimisation')
             self.tt_opt.setStyleSheet('color: black')            
 
+    def _interp_tt_map(self, ttx, tty, tt_map, ttx_interp, tty_interp):
+        """Interpolate a TT map and locate its maximum.
+
+        The interpolated map is stored in ``tt_map_interp``.
+
+        :return: (tip, tilt) of the maximum of the interpolated map.
+        :rtype: tuple
+        """
+        self.tt_map_interp, coord_max = interp_tt_map(ttx, tty, tt_map, ttx_interp, tty_interp)
+        return coord_max
+
+    def _show_tt_map(self, seg, ttx_interp, tty_interp, coord_max, colour):
+        """Display the TT map ``tt_map_interp`` of a segment with its maximum and save it.
+        """
+        print('TT max seg %s:'%seg, coord_max)
+        self.tt_max.append(coord_max)
+        rect = QtCore.QRectF(ttx_interp[0], tty_interp[0],
+                            (ttx_interp[-1]-ttx_interp[0]), (tty_interp[-1]-tty_interp[0]))
+        self.imv_tt.setImage(self.tt_map_interp.T)
+        self.imv_tt.setRect(rect)
+        try:
+            self.tt_map_display.removeItem(self.tt_crosshair)
+        except AttributeError:
+            pass
+        self.tt_crosshair = pg.CrosshairROI(coord_max, [0., 0.5], pen=colour, movable=False, resizable=False, rotatable=False)
+        self.tt_map_display.addItem(self.tt_crosshair)
+        np.savez('tt_map_seg%s_%s'%(seg, datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')),
+                    x=ttx_interp, y=tty_interp, z=self.tt_map_interp.T)
+
+    def _do_multiplexed_tt_scan(self, seg_tt, wg_table, ttx, tty, step, num_loops, scan_wait, colours):
+        """Scan the TT of all the segments at once.
+
+        The injection of each segment is read on a different output, so all
+        the segments are moved in the same command and one frame gives the fluxes of all of them.
+        The TT maps of the four segments are built in a single pass.
+        """
+        segments = [seg[0] for seg in seg_tt]
+        seg_rows = np.array(segments) - 1
+        outputs = [wg_table[seg] for seg in segments]
+
+        self.segment_id = 0
+        self.segment_selection.setText(str(self.segment_id)) # Defined in ui file
+        tt_maps = self.engine.scan_tt_grid(
+            segments, outputs, ttx, tty, num_loops, scan_wait,
+            lambda k: self.addHistoryItem('Scanning TT seg %s %s/%s'%(', '.join(str(seg) for seg in segments), k+1, num_loops)))
+
+        self.mems_values[seg_rows] = self.mems_value_old[seg_rows]
+        self.move_mems_and_updateTable('all')
+
+        if self.abortTT:
+            self.addHistoryItem('Scanning TT aborted', False)
+            print('Scanning TT aborted')
+            return
+
+        self.addHistoryItem('Scanning TT seg %s done'%(', '.join(str(seg) for seg in segments)))
+        ttx_interp = np.arange(TTX_MIN, TTX_MAX + step/10, step/10)
+        tty_interp = np.arange(TTY_MIN, TTY_MAX + step/10, step/10)
+        tt_maps = mean_tt_map(tt_maps)
+        for seg, tt_map, colour in zip(segments, tt_maps, colours):
+            try:
+                coord_max = self._interp_tt_map(ttx, tty, tt_map, ttx_interp, tty_interp)
+            except ValueError as e:
+                # The segment stays where it was
+                self.addHistoryItem('TT seg %s not optimised: %s'%(seg, e), False)
+                continue
+            self._show_tt_map(seg, ttx_interp, tty_interp, coord_max, colour)
+            self.mems_values[seg-1] = [0, coord_max[0], coord_max[1]]
+        self.move_mems_and_updateTable('all')
+
     def _abort_tt(self):
         self.abortTT = True
+        self.engine.abort()
         self.tt_opt.setText('Do TT optimisation')
         self.tt_opt.setStyleSheet('color: black')
 
@@ -1089,6 +1376,7 @@ class MainWindow(QtWidgets.QMainWindow):
             reactivate_timer = True
             self.pushButton_startstop.setText('Start video')
             self.timer.stop()
+            self.engine.stop_acquisition()
         else:
             reactivate_timer = False
 
@@ -1105,73 +1393,77 @@ class MainWindow(QtWidgets.QMainWindow):
 
         scan_range = np.arange(self.scan_begin, self.scan_end + self.scan_step, self.scan_step)
 
-        if self.segment_to_move == 2:
-            self.segment_id = 35
-        elif self.segment_to_move == 3:
-            self.segment_id = 26
-        elif self.segment_to_move == 4:
-            self.segment_id = 24
-        else:  # By default, segment 29 is scanned
-            self.segment_id = 29
+        beam_segments = self.engine.roi_layout.beam_segments
+        if 1 <= self.segment_to_move <= len(beam_segments):
+            self.segment_id = beam_segments[self.segment_to_move-1]
+        else:  # By default, the segment of the first beam is scanned
+            self.segment_id = beam_segments[0]
 
         self.segment_selection.setText(str(self.segment_id)) # Defined in ui file
 
-        wg_table = {1: 12, 2: 4, 3: 2, 4: 7, 5: 6, 6: 9}
+        wg_table = self.engine.roi_layout.null_outputs
 
         tt_pos = self.mems_values[self.segment_id-1, 1:].copy()
+        period = self.engine.effective_wavelength(wg_table[self.scanning_null])
+
+        self.mems_worker.discard()
+        adaptive = self.action_adaptive_null.isChecked()
+        # Spectrally resolved null depths of all the nulls, only measured by the grid scan
+        self.null_depths = None
+        # Too few valid fluxes to locate the null
+        failed = False
+        if adaptive:
+            best_null_pos, coefs = self._search_null(scan_wait, tt_pos, wg_table[self.scanning_null], period)
+            failed = best_null_pos is None and not self.abortNull
+        else:
+            result = self.engine.scan_null_grid(
+                self.segment_id, wg_table[self.scanning_null], scan_range, tt_pos, num_loops, scan_wait,
+                lambda k: self.addHistoryItem("Scan N%s (Seg %s) %s/%s" %
+                                              (self.scanning_null, self.segment_id, k+1, num_loops)))
+            if result is not None:
+                self.real_piston, self.scanned_valued, self.full_frames, self.null_depths = result
+
+        # Optimal piston of all the nulls at all the wavelengths
+        chromatic_null = chromatic_null_error = chromatic_best = None
+        if not self.abortNull and not adaptive:
+            # The points of all the loops are fitted together, the minimum is analytic.
+            # The flux summed over the wavelengths is a fringe of period the effective wavelength of the output
+            pistons = self.real_piston
+            coefs, covariance = fit_fringes(pistons.reshape(-1), self.scanned_valued.reshape(-1), period)
+            best_null_pos = np.clip(fringe_minimum(coefs, period, (self.scan_begin + self.scan_end) / 2),
+                                    self.scan_begin, self.scan_end)
+            print('Uncertainty on the null:', fringe_minimum_error(coefs, covariance, period))
+            if np.any(np.isnan(coefs)):
+                failed = True
+                self.addHistoryItem('Only %s valid fluxes out of %s, the fringe cannot be fitted' %
+                                    (np.sum(np.isfinite(self.scanned_valued)), self.scanned_valued.size), False)
+            elif self.null_depths is not None:
+                chromatic_null, chromatic_null_error, _ = self.engine.fit_null_scan(pistons, self.null_depths,
+                                                                                    best_null_pos)
+                null_index = self.engine.null_estimator.null_ids.index(self.scanning_null) \
+                    if self.scanning_null in self.engine.null_estimator.null_ids else None
+                valid = np.isfinite(chromatic_null[null_index]) & (chromatic_null_error[null_index] > 0) \
+                    if null_index is not None else np.zeros(1, dtype=bool)
+                if np.any(valid):
+                    # Shown next to the broadband null, which is the applied position
+                    weights = chromatic_null_error[null_index][valid]**-2
+                    chromatic_best = np.sum(weights * chromatic_null[null_index][valid]) / np.sum(weights)
+                    print('Weighted mean of the nulls over the wavelengths:', chromatic_best)
+                    self.addHistoryItem('Null N%s from %.3f to %.3f um over the wavelengths, mean %.3f um' %
+                                        (self.scanning_null, np.min(chromatic_null[null_index][valid]),
+                                         np.max(chromatic_null[null_index][valid]), chromatic_best))
 
-        self.scanned_valued = []
-        self.real_piston = []
-        self.full_frames = []
-
-        for k in range(num_loops):
-            if self.abortNull:
-                break            
-            temp = []
-            temp_piston = []
-            temp_frame = []
-            self.addHistoryItem("Scan N%s (Seg %s) %s/%s" %
-                                (self.scanning_null, self.segment_id, k+1, num_loops))
-            for piston in scan_range:
-                if self.abortNull:
-                    break
-                self.mems_values[self.segment_id-1] = [piston, *tt_pos]
-                self.move_mems_and_updateTable('all')
-                QtTest.QTest.qWait(int(scan_wait * 1000))
-                self.refresh()
-                flux = self.rois[wg_table[self.scanning_null]-1].getArrayRegion(self.img_data, self.imv_data, axes=(1, 0))
-                flux = flux.mean()         
-                temp.append(flux)
-                temp_piston.append(self.mems_values[self.segment_id-1, 0])
-                temp_frame.append(self.img_data)
-            self.scanned_valued.append(temp)
-            self.real_piston.append(temp_piston)
-            self.full_frames.append(temp_frame)
-            
-            if not self.abortNull:
-                plt.figure(1)
-                plt.clf()
-                plt.plot(temp_piston, temp)
-                plt.xlabel('Positions of segment %s'%self.segment_id)
-                plt.title('Scan of Null %s'%self.scanning_null)
-
-        if not self.abortNull:
-            self.scanned_valued = np.array(self.scanned_valued)
             self.scanned_valued = np.mean(self.scanned_valued, 0)
-            self.real_piston = np.array(self.real_piston)
             self.real_piston = np.mean(self.real_piston, 0)
-            self.full_frames = np.array(self.full_frames)
             self.full_frames = np.transpose(self.full_frames, axes=(2, 3, 1, 0))
             self.addHistoryItem("Scan N%s (Seg %s) done" %
                                 (self.scanning_null, self.segment_id))
-            null_model = lambda x, amp, freq, phase, offset: amp * np.sin(freq*x + phase) + offset
 
-            init_guess = [(self.scanned_valued.max()-self.scanned_valued.min())/2, 
-                            2*np.pi/WAVELENGTH, 0, self.scanned_valued.mean()]
-            popt = curve_fit(null_model, self.real_piston, self.scanned_valued, p0=init_guess)[0]
+        if not self.abortNull and not failed:
             x = np.arange(self.scan_begin, self.scan_end, self.scan_step/100)
+            popt = coefs
+            null_model = lambda x, *popt: fringe_model(x, popt, period)
             fit = null_model(x, *popt)
-            best_null_pos = x[np.argmin(fit)]
 
             print('')
             print('Fit results:', popt)
@@ -1189,11 +1481,14 @@ class MainWindow(QtWidgets.QMainWindow):
             plt.plot(x, fit)
             plt.plot(best_null_pos, null_model(best_null_pos, *popt), '+', c='r',
                     markersize=15, markeredgewidth=3, label=r'%.4f $\mu$m'%(best_null_pos))
+            if chromatic_best is not None:
+                plt.axvline(chromatic_best, ls='--', c='g',
+                            label=r'Mean over the wavelengths %.4f $\mu$m'%(chromatic_best))
             plt.xlabel('Real positions of segment %s'%self.segment_id)
             plt.title('Scan of Null %s'%self.scanning_null)
             plt.legend(loc='best')
 
-            self._define_save_name()
+            self.ref_segment = self._reference_segment()
             ref_segment_pos = self.mems_values[self.ref_segment-1, 0]
             if ref_segment_pos > 0:
                 ref_segment_pos = '%.2f'%ref_segment_pos
@@ -1204,15 +1499,24 @@ class MainWindow(QtWidgets.QMainWindow):
                     x=self.real_piston, y=self.scanned_valued, seg=self.segment_id, nullId=self.scanning_null)
             np.savez('null%s_%sat%s_fullIms_%s'%(self.scanning_null, self.ref_segment, ref_segment_pos, datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')),
                     x=self.real_piston, y=self.scanned_valued, seg=self.segment_id, nullId=self.scanning_null,
-                    darkframe=self.dk, fullScanAllImages=self.full_frames)
+                    darkframe=self.engine.dark, fullScanAllImages=self.full_frames)
+            if self.null_depths is not None:
+                np.savez('null%s_%sat%s_depths_%s'%(self.scanning_null, self.ref_segment, ref_segment_pos, datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')),
+                        x=pistons, seg=self.segment_id, nullId=self.scanning_null,
+                        wavelengths=self.engine.wavelengths, nullDepths=self.null_depths,
+                        optimalPistons=chromatic_null, optimalPistonErrors=chromatic_null_error,
+                        broadbandNull=best_null_pos, broadbandPeriod=period, chromaticNull=np.nan if chromatic_best is None else chromatic_best)
         else:
-            self.addHistoryItem('Scanning Null aborted', False)
-            print('Scanning Null aborted')
+            message = 'Scanning Null failed' if failed else 'Scanning Null aborted'
+            self.addHistoryItem(message, False)
+            print(message)
             self.mems_values[:] = self.mems_value_old
             self.segment_id = 0
             self.move_mems_and_updateTable('all') 
 
+        self._report_scan_errors()
         if reactivate_timer:
+            self.engine.start_acquisition()
             self.timer.start()
             self.pushButton_startstop.setText('Stop video')
         self.pushButton_startstop.setEnabled(True)
@@ -1222,45 +1526,133 @@ class MainWindow(QtWidgets.QMainWindow):
             self.null_opti.setText('Do Nuller optimisation')
             self.null_opti.setStyleSheet('color: black')          
 
+    def _search_null(self, scan_wait, tt_pos, wg, period):
+        """Adaptive search of the null of the scanned segment.
+
+        Instead of scanning the whole range, the segment is moved to the minimum of
+        the fringe model fitted on the points already measured (see ``search_null``).
+        The points of all the loops are fitted together to give the position of the null.
+
+        :param scan_wait: waiting time after each move, in second.
+        :type scan_wait: float
+        :param tt_pos: tip and tilt of the scanned segment.
+        :type tt_pos: array
+        :param wg: output (starting at 1) of the scanned null.
+        :type wg: int
+        :param period: period of the fringe, the effective wavelength of the output.
+        :type period: float
+        :return: tuple of the position of the null and the coefficients of the fringe model.
+        :rtype: tuple
+        """
+        num_loops = int(self.str2float(self.num_loops.text(), NUM_LOOPS))
+        nb_grid_moves = num_loops * np.arange(self.scan_begin, self.scan_end + self.scan_step, self.scan_step).size
+
+        result = self.engine.search_null(
+            self.segment_id, wg, tt_pos, (self.scan_begin, self.scan_end), period, num_loops, scan_wait,
+            lambda k: self.addHistoryItem("Adaptive scan N%s (Seg %s) %s/%s" %
+                                          (self.scanning_null, self.segment_id, k+1, num_loops)))
+        if result is None:
+            return None, None
+
+        best_null_pos, coefs, self.real_piston, self.scanned_valued, full_frames, converged = result
+        if not converged:
+            self.addHistoryItem('Null search did not converge', False)
+        self.full_frames = np.transpose(full_frames, axes=(1, 2, 0))
+        self.addHistoryItem("Scan N%s (Seg %s) done in %s moves instead of %s" %
+                            (self.scanning_null, self.segment_id, self.real_piston.size, nb_grid_moves))
+        return best_null_pos, coefs
+
     def _abort_nullscan(self):
         self.abortNull = True
+        self.engine.abort()
         self.null_opti.setText('Do Nuller optimisation')
         self.null_opti.setStyleSheet('color: black')
 
-    def _define_save_name(self):
-        if self.scanning_null == 1:
-            if self.segment_to_move == 1:
-                self.ref_segment = 35
-            else:
-                self.ref_segment = 29
-        elif self.scanning_null == 2:
-            if self.segment_to_move == 2:
-                self.ref_segment = 26
-            else:
-                self.ref_segment = 35
-        elif self.scanning_null == 3:
-            if self.segment_to_move == 1:
-                self.ref_segment = 24
-            else:
-                self.ref_segment = 29
-        elif self.scanning_null == 4:
-            if self.segment_to_move == 3:
-                self.ref_segment = 24
-            else:
-                self.ref_segment = 26
-        elif self.scanning_null == 5:
-            if self.segment_to_move == 3:
-                self.ref_segment = 29
-            else:
-                self.ref_segment = 26
-        elif self.scanning_null == 6:
-            if self.segment_to_move == 4:
-                self.ref_segment = 35
-            else:
-                self.ref_segment = 24
-        else:
+    def _reference_segment(self):
+        """Segment of the other beam of the scanned null, its position is in the name of the saved files.
+        """
+        beams = NULL_BEAMS.get(self.scanning_null)
+        if beams is None:
             self.addHistoryItem('No null selected', False)
-            self.ref_segment = 1
+            return 1
+        beam_segments = self.engine.roi_layout.beam_segments
+        other_beam = beams[1] if beam_segments[beams[0]-1] == self.segment_id else beams[0]
+        return beam_segments[other_beam-1]
+
+    # =============================================================================
+    # Scan files
+    # =============================================================================
+    def clickRunScanFile(self):
+        if self.action_run_scan_file.text() == 'Run scan file...':
+            self._run_scan_file()
+        else:
+            self._abort_scan_file()
+
+    def _run_scan_file(self):
+        """Run a scan described in a JSON file (see ``ScanSpec.from_dict``) and save its result.
+
+        Any segments, axes and outputs can be scanned without a new button, e.g.
+        a map of the null versus the piston and the tilt of a segment.
+        The mirror is set back to its positions before the scan.
+        """
+        path = QtWidgets.QFileDialog.getOpenFileName(filter='*.json')[0]
+        if path == '':
+            return
+        try:
+            spec = ScanSpec.load(path, self.engine.roi_layout.names)
+            spec.validate(self.nb_segments, len(self.engine.roi_layout.names))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(e)
+            self.addHistoryItem('!!! Scan file NOT loaded !!!', False)
+            DisplayPopUp('Error', 'Scan file %s not loaded:\n%s' % (path, e))
+            return
+
+        self.action_run_scan_file.setText('Abort scan file')
+        self.pushButton_startstop.setEnabled(False)
+        if self.timer.isActive():
+            reactivate_timer = True
+            self.pushButton_startstop.setText('Start video')
+            self.timer.stop()
+            self.engine.stop_acquisition()
+        else:
+            reactivate_timer = False
+
+        self.mems_value_old = self.mems_values.copy()
+        self.mems_worker.discard()
+        scan_wait = self.str2float(self.scan_wait.text(), SCAN_WAIT)
+        nb_points = [0]
+
+        def on_point(repeat, values, fluxes):
+            nb_points[0] += 1
+            if nb_points[0] % 10 == 0:
+                self.addHistoryItem('Scan %s: %s points' % (spec.name, nb_points[0]))
+
+        result = self.engine.run_scan(
+            spec, scan_wait, on_point,
+            lambda k: self.addHistoryItem('Scan %s %s/%s' % (spec.name, k+1, spec.repeats)))
+
+        if result is None:
+            self.addHistoryItem('Scan %s aborted' % spec.name, False)
+            print('Scan %s aborted' % spec.name)
+        else:
+            path = result.save(PATH_TO_SCANS)
+            self.addHistoryItem('Scan %s done, saved in %s' % (spec.name, path))
+            print('Scan %s saved in %s' % (spec.name, path))
+
+        self.mems_values[:] = self.mems_value_old
+        self.move_mems_and_updateTable('all')
+
+        self._report_scan_errors()
+        if reactivate_timer:
+            self.engine.start_acquisition()
+            self.timer.start()
+            self.pushButton_startstop.setText('Stop video')
+        self.pushButton_startstop.setEnabled(True)
+        self.action_run_scan_file.setText('Run scan file...')
+
+    def _abort_scan_file(self):
+        self.engine.abort()
+        self.action_run_scan_file.setText('Run scan file...')
 
     # =============================================================================
     # Camera Control
@@ -1272,6 +1664,41 @@ class MainWindow(QtWidgets.QMainWindow):
         dir_name = QtWidgets.QFileDialog.getExistingDirectory()
         self.line_edit_save_dir.setText(dir_name)
 
+    def toggle_record(self, checked):
+        if checked:
+            self._start_record()
+        else:
+            self._stop_record()
+
+    def _start_record(self):
+        """Record every acquired frame with its timestamp and the positions of the mirror.
+        """
+        save_dir = self.line_edit_save_dir.text()
+        if save_dir == '':
+            save_dir = os.getcwd()
+        try:
+            self.engine.start_record(save_dir, self.line_edit_file_name.text(), RECORD_FORMAT,
+                                     RECORD_CHUNK_SIZE, RECORD_QUEUE_SIZE, RECORD_MAX_FILE_SIZE,
+                                     RECORD_MAX_FILE_DURATION, RECORD_COMPRESS)
+        except (OSError, ImportError, ValueError) as e:
+            print(e)
+            self.addHistoryItem('!!! Recording NOT started !!!', False)
+            self.checkBox_record.setChecked(False)
+            return
+        self.alarm_record = False
+        self.addHistoryItem('Recording in '+save_dir)
+
+    def _stop_record(self):
+        recorder = self.engine.stop_record()
+        if recorder is None:
+            return
+        self.addHistoryItem('Recorded %s frames in %s files'%(recorder.nb_recorded, len(recorder.files)))
+        if recorder.nb_dropped > 0:
+            self.addHistoryItem('%s frames dropped (max queue: %s)'%(recorder.nb_dropped, recorder.max_queue_length), False)
+        if recorder.last_error is not None:
+            print(recorder.last_error)
+            self.addHistoryItem('!!! Error while recording !!!', False)
+
 app = QtWidgets.QApplication([])
 main = MainWindow(warmup_mems.mirror, warmup_mems.mems_fuse, warmup_mems.nb_segments)
 main.show()
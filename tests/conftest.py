@@ -0,0 +1,24 @@
+import pytest
+from core import GlintEngine, MemsControl, SimulatedIrisAO, FrameSimulator
+
+
+@pytest.fixture
+def make_engine():
+    """Factory of engines driving a simulated mirror and camera, closed after the test."""
+    engines = []
+
+    def make(acquisition_fps=500., read_noise=0., seed=2):
+        api = SimulatedIrisAO(37)
+        mems = MemsControl(api, None, 37)
+        simulator = FrameSimulator(api, photon_noise=False, read_noise=read_noise, seed=seed)
+        engines.append(GlintEngine(mems, simulator, 37, acquisition_fps=acquisition_fps))
+        return engines[-1]
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
@@ -0,0 +1,87 @@
+import time
+import numpy as np
+from core import FrameRingBuffer, AcquisitionThread
+
+
+def make_frames(nb_frames, shape=(6, 8), seed=0):
+    return np.random.default_rng(seed).integers(0, 2**16, (nb_frames,) + shape).astype(np.uint16)
+
+
+def test_ring_buffer_keeps_the_last_frames():
+    frames = make_frames(13)
+    buffer = FrameRingBuffer(5, frames.shape[1:])
+    assert buffer.latest()[1] == -1
+    for k, frame in enumerate(frames):
+        assert buffer.push(frame, timestamp=float(k), epoch=k // 4) == k
+    assert buffer.count == 13
+
+    frame, index = buffer.latest()
+    np.testing.assert_array_equal(frame, frames[-1])
+    assert index == 12
+    # The oldest slot is the next one to be written
+    assert buffer.read_frame(8) is None and buffer.read_frame(13) is None
+    frame, timestamp, epoch = buffer.read_frame(10)
+    np.testing.assert_array_equal(frame, frames[10])
+    assert timestamp == 10. and epoch == 2
+
+
+def test_ring_buffer_average():
+    frames = make_frames(9)
+    buffer = FrameRingBuffer(5, frames.shape[1:])
+    out = np.zeros(frames.shape[1:])
+    for frame in frames[:2]:
+        buffer.push(frame)
+    # Fewer frames than requested: all of them
+    average, nb_frames, saturated = buffer.average(3, out)
+    assert average is out and nb_frames == 2 and not saturated
+    np.testing.assert_allclose(average, frames[:2].mean(0))
+    for frame in frames[2:]:
+        buffer.push(frame)
+    # The slot being written is never read
+    average, nb_frames, saturated = buffer.average(10)
+    assert nb_frames == 4
+    np.testing.assert_allclose(average, frames[-4:].mean(0))
+
+
+def test_ring_buffer_frame_interval():
+    buffer = FrameRingBuffer(8, (2, 2))
+    assert buffer.frame_interval() is None
+    for k in range(12):
+        buffer.push(np.zeros((2, 2)), timestamp=0.1 * k)
+    assert abs(buffer.frame_interval() - 0.1) < 1e-9
+
+
+def test_acquisition_thread_feeds_the_buffer():
+    frames = iter(make_frames(1000))
+    buffer = FrameRingBuffer(4, (6, 8))
+    received = []
+    thread = AcquisitionThread(lambda: next(frames), buffer, 1000., on_frame=lambda frame, t: received.append(t),
+                               get_epoch=lambda: 7)
+    thread.start()
+    deadline = time.time() + 2.
+    while buffer.count < 10 and time.time() < deadline:
+        time.sleep(0.01)
+    thread.stop()
+    assert not thread.is_alive()
+    assert buffer.count >= 10 and len(received) == buffer.count
+    assert buffer.read_frame(buffer.count - 1)[2] == 7
+
+
+def test_acquisition_thread_survives_read_errors():
+    buffer = FrameRingBuffer(4, (2, 2))
+    calls = []
+
+    def read_frame():
+        calls.append(1)
+        if len(calls) % 2:
+            raise OSError('The camera is writing the file')
+        return None if len(calls) % 4 else np.ones((2, 2))
+
+    thread = AcquisitionThread(read_frame, buffer, 1000.)
+    thread.start()
+    deadline = time.time() + 2.
+    while buffer.count < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    thread.stop()
+    assert buffer.count >= 3 and thread.nb_errors > 0
+    assert isinstance(thread.last_error, OSError)
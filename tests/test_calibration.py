@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+from core import DarkAccumulator, DarkLibrary, MasterDark, find_bad_pixels, FitsFrameSource, RawFrameSource
+
+
+def dark_frames(nb_frames, shape=(20, 30), seed=0):
+    rng = np.random.default_rng(seed)
+    return 100. + rng.normal(0, 2., (nb_frames,) + shape)
+
+
+def test_accumulator_matches_numpy():
+    frames = dark_frames(50)
+    accumulator = DarkAccumulator(frames.shape[1:])
+    for frame in frames:
+        accumulator.add(frame)
+    dark = accumulator.result({'exposure_time': 0.01})
+    assert dark.nb_frames == 50
+    # A few genuine values beyond 3 sigma are clipped
+    np.testing.assert_allclose(dark.dark, frames.mean(0), atol=0.5)
+    assert np.median(np.abs(dark.dark - frames.mean(0))) < 1e-9
+    np.testing.assert_allclose(np.median(dark.noise), 2., rtol=0.1)
+    assert dark.bad_pixels.sum() == 0
+
+
+def test_accumulator_rejects_glitches_and_flags_bad_pixels():
+    frames = dark_frames(60)
+    frames[30, 5, 5] += 500.  # Cosmic ray
+    frames[:, 1, 2] += 300.  # Hot pixel
+    frames[:, 7, 8] += np.random.default_rng(1).normal(0, 50., 60)  # Noisy pixel
+    accumulator = DarkAccumulator(frames.shape[1:])
+    for frame in frames:
+        accumulator.add(frame)
+    dark = accumulator.result()
+    assert abs(dark.dark[5, 5] - 100.) < 1.
+    assert not dark.bad_pixels[5, 5]
+    assert dark.bad_pixels[1, 2] and dark.bad_pixels[7, 8]
+
+
+def test_accumulator_follows_drifting_pixel():
+    frames = dark_frames(200)
+    frames[50:, 0, 0] += 50.  # Jump after the warm-up
+    accumulator = DarkAccumulator(frames.shape[1:])
+    for frame in frames:
+        accumulator.add(frame)
+    dark = accumulator.result()
+    # The pixel is not rejected for good: the mean follows it and its noise flags it
+    assert abs(dark.dark[0, 0] - frames[:, 0, 0].mean()) < 2.
+    assert accumulator._rejected[0, 0] / accumulator.nb_frames <= accumulator.max_rejected + 0.01
+    assert dark.bad_pixels[0, 0]
+
+
+def test_accumulator_before_warmup():
+    frames = dark_frames(3)
+    accumulator = DarkAccumulator(frames.shape[1:], warmup=5)
+    with pytest.raises(ValueError):
+        accumulator.result()
+    for frame in frames:
+        accumulator.add(frame)
+    dark = accumulator.result()
+    assert dark.nb_frames == 3
+    # The frames of the warm-up are clipped around their median
+    np.testing.assert_allclose(dark.dark, np.median(frames, 0), atol=4.)
+
+
+def test_find_bad_pixels():
+    dark = np.full((10, 10), 100.)
+    dark[2, 3] = 1000.
+    noise = np.ones((10, 10))
+    noise[4, 4] = 20.
+    rejected = np.zeros((10, 10))
+    rejected[6, 6] = 0.8
+    bad = find_bad_pixels(dark, noise, rejected)
+    assert np.flatnonzero(bad).tolist() == [23, 44, 66]
+
+
+def test_library_keys_darks_by_settings(tmp_path):
+    library = DarkLibrary(str(tmp_path / 'darks'))
+    frames = dark_frames(10)
+    settings = {'exposure_time': 0.01, 'refresh_rate': 10., 'frame_shape': [20, 30]}
+    dark = MasterDark(frames.mean(0), frames.std(0), np.zeros((20, 30), dtype=bool), 10, settings)
+    path = library.save(dark)
+    assert path == library.path(settings)
+
+    loaded = library.load(dict(reversed(list(settings.items()))))
+    np.testing.assert_array_equal(loaded.dark, dark.dark)
+    np.testing.assert_array_equal(loaded.noise, dark.noise)
+    np.testing.assert_array_equal(loaded.bad_pixels, dark.bad_pixels)
+    assert loaded.settings == settings and loaded.nb_frames == 10
+    assert library.load(dict(settings, exposure_time=0.02)) is None
+
+
+def test_engine_darks_follow_the_settings(engine, tmp_path):
+    engine.dark_library = DarkLibrary(str(tmp_path))
+    engine.set_detector_settings(dict(engine.frame_source.settings(), refresh_rate=10.))
+    engine.frame_source.flux = 0.
+    assert engine.take_dark(10)
+    assert engine.dark_matches_settings()
+
+    engine.set_detector_settings(dict(engine.frame_source.settings(), refresh_rate=20.))
+    assert not engine.dark_matches_settings()
+    assert not engine.load_dark()
+    engine.set_detector_settings(dict(engine.frame_source.settings(), refresh_rate=10.))
+    assert engine.load_dark() and engine.dark_matches_settings()
+
+
+def test_camera_settings_of_the_frame_sources(tmp_path):
+    path = str(tmp_path / 'frame.fits')
+    header = fits.Header({'EXPTIME': 0.005, 'GAIN': 2, 'TEMP': -40.})
+    fits.writeto(path, np.zeros((4, 5), dtype=np.uint16), header)
+    assert FitsFrameSource(path).settings() == {'exposure_time': 0.005, 'gain': 2}
+
+    # Without exposure time the settings are unknown
+    fits.writeto(path, np.zeros((4, 5), dtype=np.uint16), overwrite=True)
+    assert FitsFrameSource(path).settings() is None
+    assert FitsFrameSource(str(tmp_path / 'missing.fits')).settings() is None
+
+    raw = str(tmp_path / 'frame.raw')
+    np.zeros((4, 5), dtype=np.uint16).tofile(raw)
+    assert RawFrameSource(raw, (4, 5), np.uint16).settings() is None
+    assert RawFrameSource(raw, (4, 5), np.uint16, camera_settings={'exposure_time': 0.01}).settings() == \
+        {'exposure_time': 0.01}
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from astropy.io import fits
+from core import FitsFrameSource, RawFrameSource
+
+
+def touch(path, step):
+    # The modification times of quick writes may be equal
+    os.utime(path, ns=(step * 10**9, step * 10**9))
+
+
+def test_fits_source_reads_only_new_frames(tmp_path):
+    path = str(tmp_path / 'frame.fits')
+    frames = np.arange(3 * 20, dtype=np.int16).reshape(3, 4, 5)
+    fits.writeto(path, frames[0])
+    touch(path, 1)
+    source = FitsFrameSource(path)
+    np.testing.assert_array_equal(source.read(), frames[0])
+    assert source.read() is None
+    np.testing.assert_array_equal(source.read(force=True), frames[0])
+    assert source.frame_count == 1
+
+    fits.writeto(path, frames[1], overwrite=True)
+    touch(path, 2)
+    np.testing.assert_array_equal(source.read(), frames[1])
+    assert source.frame_count == 2
+    source.close()
+
+
+def test_fits_source_unsigned_frames(tmp_path):
+    # uint16 frames are stored with BZERO = 32768
+    path = str(tmp_path / 'frame.fits')
+    frame = np.array([[0, 1, 32767], [32768, 40000, 65535]], dtype=np.uint16)
+    fits.writeto(path, frame)
+    assert fits.getheader(path)['BZERO'] == 32768
+    source = FitsFrameSource(path)
+    read = source.read()
+    assert read.dtype.kind == 'u' and read.dtype.itemsize == 2
+    np.testing.assert_array_equal(read, frame)
+    source.close()
+
+
+def test_fits_source_scaled_frames(tmp_path):
+    path = str(tmp_path / 'frame.fits')
+    hdu = fits.PrimaryHDU(np.array([[0, 1], [2, 3]], dtype=np.int16))
+    hdu.header['BSCALE'] = 0.5
+    hdu.header['BZERO'] = 10.
+    hdu.writeto(path)
+    source = FitsFrameSource(path)
+    np.testing.assert_allclose(source.read(), [[10., 10.5], [11., 11.5]])
+    source.close()
+
+
+def test_raw_source_change_detection(tmp_path):
+    path = str(tmp_path / 'frame.raw')
+    frame = np.arange(20, dtype=np.uint16).reshape(4, 5)
+    frame.tofile(path)
+    touch(path, 1)
+    source = RawFrameSource(path, (4, 5), np.uint16)
+    np.testing.assert_array_equal(source.read(), frame)
+    assert source.read() is None
+    with open(path, 'r+b') as f:
+        (frame + 1).tofile(f)
+    touch(path, 2)
+    np.testing.assert_array_equal(source.read(), frame + 1)
+    source.close()
+
+
+def test_raw_source_frame_counter(tmp_path):
+    # Header of 8 bytes with the frame counter, then the frame
+    path = str(tmp_path / 'frame.raw')
+    data = np.zeros(8 + 2 * 20, dtype=np.uint8)
+    data.tofile(path)
+    source = RawFrameSource(path, (4, 5), np.uint16, offset=8, counter_offset=0)
+    np.testing.assert_array_equal(source.read(), 0)
+    assert source.read() is None
+
+    # The counter is used instead of the modification time
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        np.full(20, 7, dtype=np.uint16).tofile(f)
+    assert source.read() is None
+    with open(path, 'r+b') as f:
+        np.array([1], dtype='<u8').tofile(f)
+    np.testing.assert_array_equal(source.read(), 7)
+    assert source.frame_count == 2
+    source.close()
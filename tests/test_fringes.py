@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from core import fit_fringe, fit_fringes, fringe_model, fringe_minimum, fringe_minimum_error, BEAM_SEGMENTS
+
+
+def test_fit_fringe_recovers_minimum():
+    period = 1.55
+    offset = 0.31
+    positions = np.linspace(-1.5, 1.5, 31)
+    fluxes = 100. - 80. * np.cos(2 * np.pi * (positions - offset) / period)
+    coefs = fit_fringe(positions, fluxes, period)
+    np.testing.assert_allclose(fringe_model(positions, coefs, period), fluxes, atol=1e-9)
+    assert abs(fringe_minimum(coefs, period, 0.) - offset) < 1e-9
+    # The closest minimum to the center
+    assert abs(fringe_minimum(coefs, period, 1.5) - (offset + period)) < 1e-9
+
+
+def test_fit_fringes_batch_with_nan():
+    rng = np.random.default_rng(3)
+    periods = np.linspace(1.4, 1.7, 5)
+    offsets = rng.uniform(-0.5, 0.5, (2, 5))
+    positions = np.linspace(-1.5, 1.5, 41)
+    fluxes = 50. - 40. * np.cos(2 * np.pi * (positions - offsets[..., None]) / periods[:, None])
+    fluxes += rng.normal(0, 0.1, fluxes.shape)
+    fluxes[0, 0, ::3] = np.nan
+    fluxes[1, 2, 2:] = np.nan
+
+    coefs, covariance = fit_fringes(positions, fluxes, periods)
+    assert coefs.shape == (2, 5, 3) and covariance.shape == (2, 5, 3, 3)
+    # Less than 3 valid points: no fit
+    assert np.all(np.isnan(coefs[1, 2])) and np.all(np.isnan(covariance[1, 2]))
+
+    minima = fringe_minimum(coefs, periods, 0.)
+    errors = fringe_minimum_error(coefs, covariance, periods)
+    fitted = np.ones((2, 5), dtype=bool)
+    fitted[1, 2] = False
+    np.testing.assert_allclose(minima[fitted], offsets[fitted], atol=2e-3)
+    assert np.all(errors[fitted] < 1e-3)
+    # The batched fit gives the same coefficients as the single one
+    np.testing.assert_allclose(coefs[0, 0], fit_fringe(positions, fluxes[0, 0], periods[0]))
+
+
+def test_null_scan_finds_piston_offset(engine):
+    simulator = engine.frame_source
+    for k, seg in enumerate(BEAM_SEGMENTS):
+        engine.mems_values[seg - 1, 1:] = simulator.tt_optimum[k]
+    engine.move_mirror()
+    engine.nb_averaged = 1
+    pistons, fluxes, frames, depths = engine.scan_null_grid(29, 12, np.linspace(-1.5, 1.5, 31),
+                                                            simulator.tt_optimum[0], num_loops=2)
+    # Null 1 sees the beams 1 (segment 29) and 2: dark for piston29 = offset2 - offset1
+    truth = simulator.piston_offset[1] - simulator.piston_offset[0]
+
+    period = engine.effective_wavelength(12)
+    assert 1.4 < period < 1.7
+    coefs, covariance = fit_fringes(pistons.reshape(-1), fluxes.reshape(-1), period)
+    broadband = fringe_minimum(coefs, period, truth)
+    assert abs(broadband - truth) < 0.005
+
+    # The edges of the traces are not lit: only the channels with a fringe are compared
+    optimum, error, coefs = engine.fit_null_scan(pistons, depths, truth)
+    amplitude = np.hypot(coefs[0, :, 0], coefs[0, :, 1])
+    measured = amplitude > 0.1 * np.nanmax(amplitude)
+    assert measured.sum() > optimum.shape[1] // 2
+    np.testing.assert_allclose(optimum[0][measured], truth, atol=5e-3)
+    assert np.all(error[0][measured] < 1e-3)
+
+
+@pytest.mark.parametrize('seed', [2, 3, 4, 5])
+def test_broadband_null_at_effective_wavelength(make_engine, seed):
+    engine = make_engine(seed=seed)
+    simulator = engine.frame_source
+    for k, seg in enumerate(BEAM_SEGMENTS):
+        engine.mems_values[seg - 1, 1:] = simulator.tt_optimum[k]
+    engine.move_mirror()
+    pistons, fluxes, frames, depths = engine.scan_null_grid(29, 12, np.arange(-2.5, 2.51, 0.5),
+                                                            simulator.tt_optimum[0])
+    truth = simulator.piston_offset[1] - simulator.piston_offset[0]
+    period = engine.effective_wavelength(12)
+    coefs, covariance = fit_fringes(pistons.reshape(-1), fluxes.reshape(-1), period)
+    assert abs(fringe_minimum(coefs, period, truth) - truth) < 0.005
+
+
+def test_adaptive_null_search(engine):
+    simulator = engine.frame_source
+    for k, seg in enumerate(BEAM_SEGMENTS):
+        engine.mems_values[seg - 1, 1:] = simulator.tt_optimum[k]
+    engine.move_mirror()
+    truth = simulator.piston_offset[1] - simulator.piston_offset[0]
+    result = engine.search_null(29, 12, simulator.tt_optimum[0], (-1., 1.))
+    best, coefs, pistons, fluxes, frames, converged = result
+    assert converged
+    assert abs(best - truth) < 0.005
+    # Fewer moves than a grid scan at the same resolution
+    assert len(pistons) < 21
+    assert engine.pop_scan_errors() == []
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from core import RoiLayout, FrameSimulator, SimulatedIrisAO
+
+
+def test_layout_round_trip(tmp_path):
+    rects = [[1, 2, 30, 5], [1, 12, 30, 5]]
+    layout = RoiLayout(rects, ['N1', 'P1'], {29: 2}, {1: 1})
+    path = str(tmp_path / 'layout.json')
+    layout.save(path)
+    loaded = RoiLayout.load(path)
+    assert loaded.rects == rects and loaded.names == ['N1', 'P1']
+    assert loaded.segment_outputs == {29: 2} and loaded.null_outputs == {1: 1}
+    assert loaded.beam_segments == [29]
+
+
+def test_layout_checks_the_names():
+    with pytest.raises(ValueError):
+        RoiLayout([[0, 0, 10, 5]], ['N1', 'N2'])
+
+
+def test_fit_finds_the_outputs_of_the_simulator():
+    layout = RoiLayout()
+    simulator = FrameSimulator(SimulatedIrisAO(37), photon_noise=False, read_noise=0., seed=0,
+                               flux=5000., bias=0.)
+    # Full injection of all the beams
+    positions = np.zeros((37, 3))
+    for k, seg in enumerate(layout.beam_segments):
+        positions[seg - 1, 1:] = simulator.tt_optimum[k]
+    frame = simulator._row_profiles @ simulator.spectra(positions)
+
+    # A shifted layout is fitted back on the traces
+    shifted = RoiLayout([[x + 3, y - 4, w, h] for x, y, w, h in layout.rects], layout.names)
+    fitted = shifted.fit(frame)
+    assert fitted.names == layout.names
+    rows = np.array([elt[1] for elt in fitted.rects])
+    expected = np.array([elt[1] for elt in layout.rects])
+    assert np.all(np.abs(rows - expected) <= 1)
+    # The spectral extent is the lit part of the traces
+    assert all(elt[0] >= 35 and elt[0] + elt[2] <= 96 and elt[2] > 30 for elt in fitted.rects)
+
+
+def test_fit_needs_all_the_outputs():
+    frame = np.zeros((344, 96))
+    frame[50:55, 30:90] = 100.
+    with pytest.raises(ValueError):
+        RoiLayout().fit(frame)
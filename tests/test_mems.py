@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+from core import MemsControl, SimulatedIrisAO
+
+
+class ReadBackError(SimulatedIrisAO):
+    """Simulated mirror whose read-back positions never exactly equal the commands, counting the commands."""
+    def __init__(self, nb_segments):
+        super(ReadBackError, self).__init__(nb_segments)
+        self.sent = []
+
+    def SetMirrorPositionArray(self, mirror, Segments, PTT):
+        self.sent.append(np.array(Segments))
+        super(ReadBackError, self).SetMirrorPositionArray(mirror, Segments, PTT)
+
+    def GetMirrorPositionArray(self, mirror, Segments, PTT=None):
+        positions, locked, reachable = super(ReadBackError, self).GetMirrorPositionArray(mirror, Segments, PTT)
+        return np.asarray(positions) + 1e-4, locked, reachable
+
+
+def test_only_changed_segments_are_sent():
+    api = ReadBackError(37)
+    mems = MemsControl(api, None, 37)
+    values = np.zeros((37, 3))
+    seg_list, positions, fuse_send, fuse_get = mems.update_mirror(values)
+    assert seg_list.size == 37 and fuse_send and fuse_get
+
+    for step in range(1, 4):
+        values[28, 0] = 0.1 * step
+        seg_list, positions, fuse_send, fuse_get = mems.update_mirror(values)
+        np.testing.assert_array_equal(seg_list, [29])
+        np.testing.assert_allclose(positions, [[0.1 * step + 1e-4, 1e-4, 1e-4]])
+    # The shadow keeps the commands, the read-back positions are apart
+    np.testing.assert_array_equal(mems.shadow, values)
+    np.testing.assert_allclose(mems.positions, values + 1e-4)
+
+    seg_list, positions, fuse_send, fuse_get = mems.update_mirror(values)
+    assert seg_list.size == 0
+    assert len(api.sent) == 4
+    assert mems.update_mirror(values, force_sync=True)[0].size == 37
+
+
+def test_failed_command_is_sent_again():
+    api = ReadBackError(37)
+    mems = MemsControl(api, None, 37)
+    values = np.zeros((37, 3))
+    mems.update_mirror(values)
+    values[3, 1] = 0.5
+    api.SetMirrorPositionArray = lambda *args: 1 / 0
+    assert not mems.update_mirror(values)[2]
+    assert np.all(np.isnan(mems.shadow[3]))
+    del api.SetMirrorPositionArray
+    np.testing.assert_array_equal(mems.update_mirror(values)[0], [4])
+
+
+def test_flatten_commands_zero():
+    mems = MemsControl(ReadBackError(37), None, 37)
+    values = np.full((37, 3), 0.2)
+    mems.update_mirror(values)
+    assert mems.flatten_mirror()
+    np.testing.assert_array_equal(mems.shadow, 0.)
+    assert np.all(np.isnan(mems.positions))
+    values[:] = 0.
+    values[5, 0] = 0.3
+    np.testing.assert_array_equal(mems.update_mirror(values)[0], [6])
+
+
+def test_threads_share_the_shadow():
+    mems = MemsControl(SimulatedIrisAO(37), None, 37)
+    mems.update_mirror(np.zeros((37, 3)))
+    errors = []
+
+    def move(segment):
+        values = np.zeros((37, 3))
+        try:
+            for k in range(50):
+                with mems.lock:
+                    values[:] = mems.shadow
+                    values[segment - 1, 0] = 0.01 * k
+                    mems.update_mirror(values)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=move, args=(seg,)) for seg in (1, 2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    np.testing.assert_allclose(mems.shadow[:3, 0], 0.49)
+    np.testing.assert_allclose(mems.positions[:3, 0], 0.49)
+
+
+def test_engine_commands_start_an_epoch(engine):
+    epoch = engine.command_epoch
+    target = np.zeros((37, 3))
+    target[28] = [0.2, 0.1, -0.1]
+    target[0, 0] = 10.
+    seg_list, positions, fuse_send, fuse_get = engine.command_mirror(target)
+    assert engine.command_epoch == epoch + 1
+    assert fuse_send and fuse_get
+    # Clipped to the range of the mirror, the commanded positions of the engine are unchanged
+    np.testing.assert_allclose(engine.mems_positions[0], [engine.mems_range[1], 0, 0])
+    np.testing.assert_allclose(engine.mems_positions[28], [0.2, 0.1, -0.1])
+    np.testing.assert_array_equal(engine.mems_values, 0.)
+
+    positions, fuse_flatten, fuse_get = engine.command_flatten()
+    assert engine.command_epoch == epoch + 2 and fuse_flatten
+    np.testing.assert_allclose(positions, 0.)
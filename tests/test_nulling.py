@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from core import NullDepthEstimator, RoiLayout, NULL_BEAMS
+
+OUTPUT_NAMES = RoiLayout().names
+
+NB_WAVELENGTHS = 20
+
+
+def make_spectra(photometry, depths, coupling=None, antinull=1.):
+    """Spectra (outputs, wavelengths) of given photometric fluxes (beams, wavelengths) and null depths (nulls, wavelengths)."""
+    coupling = np.ones((len(NULL_BEAMS), 2)) if coupling is None else coupling
+    spectra = np.zeros((len(OUTPUT_NAMES), NB_WAVELENGTHS))
+    for beam in range(1, 5):
+        spectra[OUTPUT_NAMES.index('P%s' % beam)] = photometry[beam - 1]
+    for k, null in enumerate(sorted(NULL_BEAMS)):
+        a, b = NULL_BEAMS[null]
+        peak = (np.sqrt(coupling[k, 0] * photometry[a - 1]) + np.sqrt(coupling[k, 1] * photometry[b - 1]))**2
+        spectra[OUTPUT_NAMES.index('N%s' % null)] = depths[k] * peak
+        spectra[OUTPUT_NAMES.index('N%s' % (null + 6))] = antinull * peak
+    return spectra
+
+
+@pytest.fixture
+def photometry():
+    return np.random.default_rng(0).uniform(500., 1000., (4, NB_WAVELENGTHS))
+
+
+@pytest.fixture
+def depths():
+    return np.random.default_rng(1).uniform(1e-3, 1e-1, (len(NULL_BEAMS), NB_WAVELENGTHS))
+
+
+def test_null_depths(photometry, depths):
+    estimator = NullDepthEstimator(OUTPUT_NAMES)
+    spectra = make_spectra(photometry, depths)
+    measured, peaks = estimator.compute(spectra)
+    np.testing.assert_allclose(measured, depths)
+    assert peaks.shape == depths.shape
+
+    # A stack of frames gives the same null depths and reuses the given arrays
+    stack = np.array([spectra, 2 * spectra])
+    out = np.zeros((2,) + depths.shape)
+    assert estimator.compute(stack, out)[0] is out
+    np.testing.assert_allclose(out, [depths, depths])
+
+
+def test_broadband_null_depth(photometry, depths):
+    estimator = NullDepthEstimator(OUTPUT_NAMES)
+    spectra = make_spectra(photometry, depths)
+    _, peaks = estimator.compute(spectra)
+    np.testing.assert_allclose(estimator.broadband(spectra), (depths * peaks).sum(1) / peaks.sum(1))
+
+
+def test_measured_coupling_corrects_the_null_depths(photometry, depths):
+    coupling = np.random.default_rng(2).uniform(0.5, 1.5, (len(NULL_BEAMS), 2))
+    estimator = NullDepthEstimator(OUTPUT_NAMES)
+    for beam in range(1, 5):
+        # Only the beam injected: the nulls see its coupled flux
+        alone = np.zeros_like(photometry)
+        alone[beam - 1] = photometry[beam - 1]
+        spectra = np.zeros((len(OUTPUT_NAMES), NB_WAVELENGTHS))
+        spectra[OUTPUT_NAMES.index('P%s' % beam)] = alone[beam - 1]
+        for k, null in enumerate(sorted(NULL_BEAMS)):
+            if beam in NULL_BEAMS[null]:
+                side = NULL_BEAMS[null].index(beam)
+                spectra[OUTPUT_NAMES.index('N%s' % null)] = coupling[k, side] * photometry[beam - 1]
+        estimator.measure_coupling(spectra, beam)
+    np.testing.assert_allclose(estimator.coupling, np.repeat(coupling[:, :, None], NB_WAVELENGTHS, 2))
+    measured, _ = estimator.compute(make_spectra(photometry, depths, coupling))
+    np.testing.assert_allclose(measured, depths)
+
+
+def test_noisy_channels_are_rejected(photometry, depths):
+    noise = np.ones((len(OUTPUT_NAMES), NB_WAVELENGTHS))
+    noise[:, 3] = 1e3
+    estimator = NullDepthEstimator(OUTPUT_NAMES, noise=noise)
+    spectra = make_spectra(photometry, depths)
+    measured, _ = estimator.compute(spectra)
+    assert np.all(np.isnan(measured[:, 3]))
+    np.testing.assert_allclose(np.delete(measured, 3, 1), np.delete(depths, 3, 1))
+    assert np.all(np.isfinite(estimator.broadband(spectra)))
+
+    # Without any flux, there is no null depth
+    assert np.all(np.isnan(estimator.compute(np.zeros_like(spectra))[0]))
+    assert np.all(np.isnan(estimator.broadband(np.zeros_like(spectra))))
+
+
+def test_antinull_ratio(photometry, depths):
+    estimator = NullDepthEstimator(OUTPUT_NAMES)
+    ratios = estimator.antinull_ratio(make_spectra(photometry, depths, antinull=0.5))
+    np.testing.assert_allclose(ratios, depths / (depths + 0.5))
+
+
+def test_missing_output():
+    with pytest.raises(ValueError):
+        NullDepthEstimator([name for name in OUTPUT_NAMES if name != 'P3'])
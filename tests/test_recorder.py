@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+from core import FrameRecorder
+
+
+def record_frames(recorder, nb_frames, spectra=True):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 2**16, (nb_frames, 6, 8)).astype(np.uint16)
+    mems_values = rng.normal(0, 1, (nb_frames, 37, 3))
+    all_spectra = rng.normal(0, 1, (nb_frames, 16, 5)).astype(np.float32)
+    recorder.start()
+    for k in range(nb_frames):
+        assert recorder.record(frames[k], mems_values[k], float(k), all_spectra[k] if spectra else None)
+    recorder.stop()
+    assert not recorder.is_recording
+    return frames, mems_values, all_spectra
+
+
+def read_fits(path):
+    frames, times, mems_values, spectra = [], [], [], []
+    with fits.open(path) as hdul:
+        wavelengths = hdul['WAVELENGTHS'].data if 'WAVELENGTHS' in hdul else None
+        for hdu in hdul[1:]:
+            if hdu.name == 'FRAMES':
+                frames.append(hdu.data)
+            elif hdu.name == 'SPECTRA':
+                spectra.append(hdu.data)
+            elif hdu.name == 'META':
+                times.append(hdu.data['TIME'])
+                mems_values.append(hdu.data['MEMS'])
+    return np.concatenate(frames), np.concatenate(times), np.concatenate(mems_values), spectra, wavelengths
+
+
+def test_fits_recording(tmp_path):
+    recorder = FrameRecorder(str(tmp_path / 'run'), 'test', chunk_size=10, wavelengths=np.linspace(1.4, 1.7, 5))
+    frames, mems_values, spectra = record_frames(recorder, 25)
+    assert recorder.nb_recorded == 25 and recorder.nb_dropped == 0
+    assert len(recorder.files) == 1 and recorder.last_error is None
+
+    read_frames, times, read_mems, read_spectra, wavelengths = read_fits(recorder.files[0])
+    np.testing.assert_array_equal(read_frames, frames)
+    np.testing.assert_array_equal(times, np.arange(25.))
+    np.testing.assert_array_equal(read_mems, mems_values)
+    np.testing.assert_array_equal(np.concatenate(read_spectra), spectra)
+    np.testing.assert_allclose(wavelengths, np.linspace(1.4, 1.7, 5))
+
+
+def test_new_file_above_the_maximum_size(tmp_path):
+    recorder = FrameRecorder(str(tmp_path), 'test', chunk_size=5, max_file_size=1)
+    frames, mems_values, spectra = record_frames(recorder, 12, spectra=False)
+    assert len(recorder.files) == 3
+    read_frames = np.concatenate([read_fits(path)[0] for path in recorder.files])
+    np.testing.assert_array_equal(read_frames, frames)
+
+
+def test_full_queue_drops_frames(tmp_path):
+    recorder = FrameRecorder(str(tmp_path), 'test', queue_size=3)
+    # Without the writing thread, nothing empties the queue
+    results = [recorder.record(np.zeros((2, 2)), np.zeros((37, 3))) for k in range(5)]
+    assert results == [True] * 3 + [False] * 2
+    assert recorder.nb_dropped == 2 and recorder.max_queue_length == 3
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        FrameRecorder(str(tmp_path), 'test', fmt='tiff')
+
+
+def test_hdf5_recording(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    recorder = FrameRecorder(str(tmp_path), 'test', fmt='hdf5', chunk_size=10, wavelengths=np.arange(5.))
+    frames, mems_values, spectra = record_frames(recorder, 25)
+    with h5py.File(recorder.files[0], 'r') as f:
+        np.testing.assert_array_equal(f['frames'][:], frames)
+        np.testing.assert_array_equal(f['mems_values'][:], mems_values)
+        np.testing.assert_array_equal(f['spectra'][:], spectra)
+        np.testing.assert_array_equal(f['timestamps'][:], np.arange(25.))
@@ -0,0 +1,51 @@
+import numpy as np
+from core import RoiIndex
+
+
+def reference(frame, rects, bad_pixels=None):
+    """Spectra and fluxes of the outputs, one rectangle at a time."""
+    valid = np.ones(frame.shape, dtype=bool) if bad_pixels is None else ~bad_pixels
+    spectra, fluxes = [], []
+    for x, y, width, height in rects:
+        pixels = frame[y:y + height, x:x + width]
+        weights = valid[y:y + height, x:x + width]
+        spectra.append((pixels * weights).sum(0) / np.maximum(weights.sum(0), 1))
+        fluxes.append((pixels * weights).sum() / max(weights.sum(), 1))
+    return spectra, np.array(fluxes)
+
+
+def test_extract_matches_the_rectangles():
+    frame = np.random.default_rng(0).normal(100., 10., (60, 40))
+    rects = [[2, 3, 30, 5], [5, 20, 20, 7], [0, 40, 40, 4]]
+    index = RoiIndex(rects, frame.shape)
+    spectra, fluxes = index.extract(frame)
+    expected_spectra, expected_fluxes = reference(frame, rects)
+    assert spectra.shape == (3, 40)
+    for k, (x, y, width, height) in enumerate(rects):
+        np.testing.assert_allclose(spectra[k, :width], expected_spectra[k])
+    np.testing.assert_allclose(fluxes, expected_fluxes)
+
+
+def test_extract_leaves_out_bad_pixels():
+    frame = np.random.default_rng(1).normal(100., 10., (30, 20))
+    bad_pixels = np.zeros(frame.shape, dtype=bool)
+    bad_pixels[5, 3] = bad_pixels[6, 10] = True
+    frame[bad_pixels] = 1e6
+    rects = [[2, 4, 15, 4], [0, 15, 20, 5]]
+    spectra, fluxes = RoiIndex(rects, frame.shape, bad_pixels).extract(frame)
+    expected_spectra, expected_fluxes = reference(frame, rects, bad_pixels)
+    np.testing.assert_allclose(spectra[0, :15], expected_spectra[0])
+    np.testing.assert_allclose(fluxes, expected_fluxes)
+
+
+def test_extract_reuses_the_buffers():
+    frame = np.ones((20, 20), dtype=np.float32)
+    index = RoiIndex([[0, 0, 10, 2], [0, 5, 10, 2]], frame.shape)
+    spectra = np.zeros((2, 10))
+    fluxes = np.zeros(2)
+    out = index.extract(frame, spectra, fluxes)
+    assert out[0] is spectra and out[1] is fluxes
+    np.testing.assert_allclose(fluxes, 1.)
+    # Rectangles partly outside the frame only average the pixels inside
+    spectra, fluxes = RoiIndex([[15, 18, 10, 4]], frame.shape).extract(2 * frame)
+    np.testing.assert_allclose(fluxes, 2.)
@@ -0,0 +1,60 @@
+import json
+import numpy as np
+import pytest
+from core import Axis, Grid, FixedPoints, ScanSpec, ScanResult, ScanExecutor, RoiLayout
+
+
+def make_spec(**kwargs):
+    return ScanSpec([Axis.single('piston', [29])], Grid(np.linspace(-0.5, 0.5, 3)), [1, 12], **kwargs)
+
+
+def test_ragged_repeats_are_padded():
+    result = ScanResult(make_spec(repeats=2), np.array([29]), np.zeros((1, 3)))
+    result._add(0, np.zeros((3, 1)), np.zeros((3, 1, 3)), np.ones((3, 2)), None)
+    result._add(1, np.zeros((2, 1)), np.zeros((2, 1, 3)), 2 * np.ones((2, 2)), None)
+    result._add(1, np.zeros((2, 1)), np.zeros((2, 1, 3)), 3 * np.ones((2, 2)), None)
+    fluxes = result.fluxes
+    assert fluxes.shape == (2, 4, 2)
+    np.testing.assert_array_equal(fluxes[0, :3], 1.)
+    assert np.all(np.isnan(fluxes[0, 3]))
+    np.testing.assert_array_equal(fluxes[1, :, 0], [2, 2, 3, 3])
+    assert result.reached.shape == (2, 4, 1, 3)
+
+
+def test_scan_result_round_trip(engine, tmp_path):
+    spec = make_spec(repeats=2, keep_frames=True, name='round_trip')
+    result = ScanExecutor(engine).run(spec)
+    assert result.fluxes.shape == (2, 3, 2)
+    assert result.frames.shape == (2, 3) + engine.frame_shape
+
+    path = result.save(str(tmp_path))
+    with np.load(path) as saved:
+        for name in ('points', 'reached', 'fluxes', 'frames', 'spectra', 'wavelengths'):
+            np.testing.assert_array_equal(saved[name], getattr(result, name))
+        np.testing.assert_array_equal(saved['segments'], [29])
+        np.testing.assert_array_equal(saved['outputs'], [1, 12])
+        axes = [Axis.from_dict(elt) for elt in json.loads(str(saved['axes']))]
+    assert [axis.to_dict() for axis in axes] == [axis.to_dict() for axis in spec.axes]
+
+
+def test_spec_from_dict():
+    names = RoiLayout().names
+    spec = ScanSpec.from_dict({'axes': [{'axis': 'piston', 'segments': [29]}],
+                               'points': {'type': 'grid', 'values': [[-1., 1., 5]]},
+                               'outputs': ['N1', 3], 'repeats': 2}, names)
+    assert spec.outputs == [names.index('N1') + 1, 3]
+    assert spec.points.first().shape == (5, 1)
+    with pytest.raises(ValueError):
+        ScanSpec.from_dict({'axes': [{'axis': 'piston', 'segments': [29]}],
+                            'points': {'type': 'grid', 'values': [[-1., 1., 5]]}, 'outputs': ['N1']})
+    with pytest.raises(ValueError):
+        ScanSpec.from_dict({'axes': [{'axis': 'piston', 'segments': [29]}],
+                            'points': {'type': 'grid', 'values': [[-1., 1., 5]]}, 'outputs': ['X9']}, names)
+
+
+def test_invalid_spec_is_not_run(engine):
+    spec = ScanSpec([Axis.single('piston', [99])], FixedPoints([[0.]]), [1])
+    with pytest.raises(ValueError):
+        ScanExecutor(engine).run(spec)
+    with pytest.raises(ValueError):
+        ScanSpec([Axis.single('piston', [29])], FixedPoints([[0.]]), []).validate()
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def test_scan_wait_longer_than_timeout(engine):
+    # The timeout starts once the mirror has settled, a long settling does not lose the points
+    engine.scan_timeout = 0.05
+    pistons, fluxes, frames, depths = engine.scan_null_grid(29, 12, [-0.2, 0.2], [0, 0], scan_wait=0.2)
+    assert np.all(np.isfinite(fluxes))
+    assert engine.pop_scan_errors() == []
+
+
+def test_slow_frames_within_timeout(make_engine):
+    # The timeout grows with the frames to average at the rate of the acquisition
+    engine = make_engine(acquisition_fps=20.)
+    engine.scan_timeout = 0.05
+    engine.nb_averaged = 3
+    pistons, fluxes, frames, depths = engine.scan_null_grid(29, 12, [-0.2, 0.2], [0, 0])
+    assert np.all(np.isfinite(fluxes))
+    assert engine.pop_scan_errors() == []
+
+
+def test_no_frame_times_out(engine):
+    engine.scan_timeout = 0.05
+    engine.frame_source.read = lambda force=False: None
+    pistons, fluxes, frames, depths = engine.scan_null_grid(29, 12, [-0.2, 0., 0.2], [0, 0])
+    assert np.all(np.isnan(fluxes))
+    errors = engine.pop_scan_errors()
+    assert len(errors) == 3
+    assert all(isinstance(elt, TimeoutError) for elt in errors)
+    assert engine.pop_scan_errors() == []
@@ -0,0 +1,36 @@
+import numpy as np
+from core import SimulatedIrisAO, FrameSimulator, RoiLayout, BEAM_SEGMENTS
+
+
+def test_mirror_applies_positions_on_send():
+    api = SimulatedIrisAO(37)
+    api.SetMirrorPositionArray(None, [3, 5], [[0.1, 0.2, 0.3], [1., 0., 0.]])
+    np.testing.assert_array_equal(api.get_state(), 0.)
+    api.MirrorCommand(None, api.MirrorSendSettings)
+    positions, locked, reachable = api.GetMirrorPositionArray(None, [3, 5])
+    np.testing.assert_allclose(positions, [[0.1, 0.2, 0.3], [1., 0., 0.]], rtol=1e-6)
+    assert np.all(reachable)
+    api.MirrorCommand(None, api.MirrorInitSettings)
+    np.testing.assert_array_equal(api.get_state(), 0.)
+
+
+def test_frames_depend_on_the_mirror():
+    api = SimulatedIrisAO(37)
+    simulator = FrameSimulator(api, photon_noise=False, read_noise=0., seed=1)
+    names = RoiLayout().names
+    positions = np.zeros((37, 3))
+    for k, seg in enumerate(BEAM_SEGMENTS):
+        positions[seg - 1, 1:] = simulator.tt_optimum[k]
+    np.testing.assert_allclose(simulator.injections(positions), 1.)
+
+    # Null 1 (beams 1 and 2) is dark when the pistons compensate the offsets
+    positions[BEAM_SEGMENTS[0] - 1, 0] = simulator.piston_offset[1] - simulator.piston_offset[0]
+    spectra = simulator.spectra(positions)
+    null, antinull = spectra[names.index('N1')], spectra[names.index('N7')]
+    assert null.sum() < 0.02 * antinull.sum()
+
+    api.SetMirrorPositionArray(None, np.arange(1, 38), positions)
+    api.MirrorCommand(None, api.MirrorSendSettings)
+    frame = simulator.read()
+    assert frame.dtype == np.uint16 and frame.shape == simulator.frame_shape
+    assert simulator.frame_count == 1
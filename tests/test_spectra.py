@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from core import RoiIndex, SpectralExtractor, WavelengthSolution
+
+RECTS = [[2, 3, 30, 5], [6, 12, 24, 6], [0, 22, 36, 4]]
+FRAME_SHAPE = (30, 40)
+
+
+def output_frame(values, profiles=None):
+    """Frame whose pixels in each output are ``values(output, columns)`` times the profile of the output."""
+    frame = np.zeros(FRAME_SHAPE)
+    for k, (x, y, width, height) in enumerate(RECTS):
+        profile = np.ones(height) if profiles is None else profiles[k][:height]
+        frame[y:y + height, x:x + width] = profile[:, None] * values(k, x + np.arange(width))[None, :]
+    return frame
+
+
+def test_solution_round_trip(tmp_path):
+    solution = WavelengthSolution.linear(RECTS)
+    path = str(tmp_path / 'wavelengths.json')
+    solution.save(path)
+    loaded = WavelengthSolution.load(path)
+    columns = np.array([[x, x + width - 1] for x, _, width, _ in RECTS])
+    np.testing.assert_allclose(loaded.evaluate(columns), np.tile([1.4, 1.7], (3, 1)))
+    with pytest.raises(ValueError):
+        loaded.evaluate(columns[:2])
+
+
+def test_solution_fit():
+    columns = [np.arange(0., 30., 3.)] * 2
+    coefficients = [[1e-4, 0.01, 1.4], [-2e-4, 0.012, 1.38]]
+    wavelengths = [np.polyval(coefs, cols) for coefs, cols in zip(coefficients, columns)]
+    solution = WavelengthSolution.fit(columns, wavelengths)
+    np.testing.assert_allclose(solution.coefficients, coefficients, atol=1e-12)
+
+
+def test_uniform_extraction_is_the_column_sum_on_the_grid():
+    solution = WavelengthSolution.linear(RECTS)
+    extractor = SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), solution)
+    # Linear in wavelength, so the interpolation on the grid is exact
+    frame = output_frame(lambda k, cols: 100. + 50. * solution.evaluate([cols] * 3)[k])
+    spectra = extractor.extract(frame)
+    heights = np.array(RECTS)[:, 3, None]
+    assert spectra.shape == (3, extractor.nb_wavelengths)
+    np.testing.assert_allclose(spectra, heights * (100. + 50. * extractor.wavelengths), rtol=1e-7)
+
+
+def test_optimal_extraction_gives_the_column_flux():
+    rows = np.arange(6)
+    profiles = np.exp(-0.5 * ((rows[None, :] - np.array([[2.], [2.5], [1.5]])) / 1.)**2)
+    flux = lambda k, cols: 1000. + 10. * cols
+    frame = output_frame(flux, profiles)
+    noise = np.random.default_rng(0).uniform(5., 20., FRAME_SHAPE)
+    extractor = SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), WavelengthSolution.linear(RECTS), noise=noise)
+    extractor.fit_profiles(frame)
+    spectra = extractor.extract(frame)
+
+    # Without noise in the frame, the weighted sum is the total flux of each column
+    uniform = SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), WavelengthSolution.linear(RECTS))
+    np.testing.assert_allclose(spectra, uniform.extract(frame), rtol=1e-5)
+    assert not np.allclose(extractor._weights, uniform._weights)
+
+
+def test_spectral_noise_matches_the_scatter():
+    rng = np.random.default_rng(1)
+    noise = rng.uniform(5., 20., FRAME_SHAPE)
+    extractor = SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), WavelengthSolution.linear(RECTS), noise=noise)
+    assert SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), WavelengthSolution.linear(RECTS)).spectral_noise() is None
+    spectra = np.array([extractor.extract(noise * rng.standard_normal(FRAME_SHAPE)) for _ in range(2000)])
+    np.testing.assert_allclose(spectra.std(0), extractor.spectral_noise(), rtol=0.1)
+
+
+def test_copy_has_its_own_buffers():
+    extractor = SpectralExtractor(RoiIndex(RECTS, FRAME_SHAPE), WavelengthSolution.linear(RECTS))
+    frames = np.random.default_rng(2).normal(100., 10., (2,) + FRAME_SHAPE)
+    other = extractor.copy()
+    first = extractor.extract(frames[0]).copy()
+    second = other.extract(frames[1])
+    np.testing.assert_array_equal(extractor.extract(frames[0]), first)
+    assert not np.allclose(first, second)
+    assert other._cube is not extractor._cube
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from core import RollingSeries
+
+
+@pytest.mark.parametrize('nb_samples', [1, 7, 10, 25, 1000])
+def test_rolling_series_matches_numpy(nb_samples):
+    rng = np.random.default_rng(0)
+    samples = 1e3 + rng.normal(0, 5, (nb_samples, 3))
+    series = RollingSeries(3, 10)
+    for values in samples:
+        series.push(values)
+
+    window = samples[-10:]
+    assert len(series) == len(window)
+    np.testing.assert_array_equal(series.values(), window)
+    np.testing.assert_array_equal(series.last(), samples[-1])
+    np.testing.assert_allclose(series.mean(), np.mean(window, 0), rtol=1e-12)
+    np.testing.assert_allclose(series.std(), np.std(window, 0), rtol=1e-8)
+    np.testing.assert_array_equal(series.minimum(), window.min(0))
+    np.testing.assert_array_equal(series.maximum(), window.max(0))
+
+
+def test_rolling_series_resize_keeps_newest():
+    rng = np.random.default_rng(1)
+    samples = rng.normal(0, 1, (30, 2))
+    series = RollingSeries(2, 20)
+    for values in samples:
+        series.push(values)
+    series.resize(5)
+    np.testing.assert_array_equal(series.values(), samples[-5:])
+    np.testing.assert_allclose(series.mean(), np.mean(samples[-5:], 0))
+    np.testing.assert_allclose(series.std(), np.std(samples[-5:], 0))
+
+
+def test_rolling_series_empty():
+    series = RollingSeries(4, 10)
+    assert series.last() is None
+    np.testing.assert_array_equal(series.std(), np.zeros(4))
+    series.push(np.ones(4))
+    series.clear()
+    assert len(series) == 0